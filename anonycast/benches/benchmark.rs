@@ -73,6 +73,100 @@ pub fn bench_verify(c: &mut Criterion) {
     }
 }
 
+/// Verifications done by the deaddrop workers one by one and in batches, ring signatures are the
+/// ones of the sender-restricted mode
+pub fn bench_verify_batch(c: &mut Criterion) {
+    let data = vec![0u8; 256];
+    for batch in [1, 8, 32, 64] {
+        let mut group = c.benchmark_group(format!("crypto_verify_batch {batch}"));
+        group.throughput(criterion::Throughput::Elements(batch as u64));
+
+        // a few clients each sending several requests
+        let keys = (0..4).map(|_| crypto::generate()).collect::<Vec<_>>();
+        let signatures = (0..batch)
+            .map(|i| {
+                let (pubk, privk) = &keys[i % keys.len()];
+                (pubk, crypto::sign(privk, &data))
+            })
+            .collect::<Vec<_>>();
+        let items = signatures
+            .iter()
+            .map(|(pubk, signature)| (*pubk, data.as_slice(), signature))
+            .collect::<Vec<_>>();
+        group.bench_function("asymmetric individual", |b| {
+            b.iter(|| {
+                items
+                    .iter()
+                    .all(|(pubk, data, signature)| crypto::verify(pubk, data, signature))
+            });
+        });
+        group.bench_function("asymmetric batch", |b| {
+            b.iter(|| crypto::verify_batch(black_box(&items)));
+        });
+
+        let ring_keys = (0..16).map(|_| crypto::ring_generate()).collect::<Vec<_>>();
+        let ring = crypto::Ring::from(ring_keys.iter().map(|(pk, _)| *pk).collect::<Vec<_>>());
+        let ring_signatures = (0..batch)
+            .map(|i| crypto::ring_sign(&ring_keys[i % ring_keys.len()].1, &ring, &data))
+            .collect::<Vec<_>>();
+        let ring_items = ring_signatures
+            .iter()
+            .map(|signature| (data.as_slice(), signature))
+            .collect::<Vec<_>>();
+        group.bench_function("ring individual", |b| {
+            b.iter(|| {
+                ring_items
+                    .iter()
+                    .all(|(data, signature)| crypto::ring_verify(&ring, data, signature))
+            });
+        });
+        // the ring is prepared once per key update, the batch then shares the compression of the
+        // commitments of every ring step
+        let prepared = crypto::PreparedRing::new(&ring);
+        group.bench_function("ring prepared individual", |b| {
+            b.iter(|| {
+                ring_items
+                    .iter()
+                    .all(|(data, signature)| prepared.verify(data, signature))
+            });
+        });
+        group.bench_function("ring prepared batch", |b| {
+            b.iter(|| prepared.verify_batch(black_box(&ring_items)));
+        });
+    }
+}
+
+/// Ring signatures of the sender-restricted modes with and without a prepared ring, over the ring
+/// sizes of the latency configs
+pub fn bench_ring(c: &mut Criterion) {
+    let data = vec![0u8; 1024];
+    for size in [2, 4, 8, 16, 32, 64] {
+        let mut group = c.benchmark_group(format!("crypto_ring {size}"));
+        let keys = (0..size)
+            .map(|_| crypto::ring_generate())
+            .collect::<Vec<_>>();
+        let ring = crypto::Ring::from(keys.iter().map(|(pk, _)| *pk).collect::<Vec<_>>());
+        let prepared = crypto::PreparedRing::new(&ring);
+        let signature = crypto::ring_sign(&keys[0].1, &ring, &data);
+
+        group.bench_function("prepare", |b| {
+            b.iter(|| crypto::PreparedRing::new(black_box(&ring)));
+        });
+        group.bench_function("sign", |b| {
+            b.iter(|| crypto::ring_sign(&keys[0].1, &ring, &data));
+        });
+        group.bench_function("sign prepared", |b| {
+            b.iter(|| prepared.sign(&keys[0].1, &data));
+        });
+        group.bench_function("verify", |b| {
+            b.iter(|| crypto::ring_verify(&ring, &data, &signature));
+        });
+        group.bench_function("verify prepared", |b| {
+            b.iter(|| prepared.verify(&data, &signature));
+        });
+    }
+}
+
 fn get_chain_and_beacon() -> (drand::ChainInfo, drand::Beacon) {
     run_future(async {
         let chains = drand::chain_list().await.unwrap();
@@ -98,6 +192,8 @@ criterion_group!(
     bench_crypto_puzzle,
     bench_beacon_verify,
     bench_sign,
-    bench_verify
+    bench_verify,
+    bench_verify_batch,
+    bench_ring
 );
 criterion_main!(benches);
@@ -14,6 +14,7 @@ async fn main() -> Result<()> {
         ring: Default::default(),
         receivers_keys: Default::default(),
         deaddrop_addresses: Default::default(),
+        deaddrop_connections: 1,
         difficulty: 0,
         acceptance_window: 100,
         asset_owner_public_key: Default::default(),
@@ -1,14 +1,21 @@
 use std::{
+    future::Future,
     net::{SocketAddr, ToSocketAddrs as _},
-    path::PathBuf,
-    sync::{atomic::AtomicBool, Arc, Mutex},
+    ops::Range,
+    path::{Path, PathBuf},
+    sync::{
+        atomic::{AtomicBool, AtomicU64},
+        Arc, Mutex,
+    },
     time::{Duration, Instant, SystemTime, UNIX_EPOCH},
 };
 
+use anonycast::stats;
 use anyhow::{Context, Result};
 use clap::Parser;
+use rand::{rngs::StdRng, Rng as _, SeedableRng as _};
 use serde::{Deserialize, Serialize};
-use tokio::sync::Barrier;
+use tokio::{sync::Barrier, task::JoinSet};
 
 #[derive(Debug, Parser)]
 pub struct Args {
@@ -23,6 +30,12 @@ enum Benchmark {
     Latency(LatencyArgs),
 }
 
+#[derive(Debug, Clone, Copy, PartialEq, Eq, clap::ValueEnum)]
+enum OutputFormat {
+    Json,
+    Columnar,
+}
+
 #[derive(Debug, Parser)]
 struct PublishTroughputArgs {
     #[clap(long)]
@@ -41,6 +54,17 @@ struct PublishTroughputArgs {
     acceptance_window: usize,
     #[clap(long)]
     output: Option<PathBuf>,
+    #[clap(long, value_enum, default_value_t = OutputFormat::Json)]
+    output_format: OutputFormat,
+    /// Write latency histograms of every second of the run to this file
+    #[clap(long)]
+    stats_snapshot: Option<PathBuf>,
+    #[clap(flatten)]
+    convergence: ConvergenceArgs,
+    #[clap(flatten)]
+    open_loop: OpenLoopArgs,
+    #[clap(flatten)]
+    distributed: DistributedArgs,
 }
 
 #[derive(Debug, Parser)]
@@ -55,12 +79,95 @@ struct RetreiveTroughputArgs {
     message_size: usize,
     #[clap(long)]
     message_count: usize,
+    /// Documents published in the fetched topic before the run, in rounds older than the
+    /// messages so that the clients never fetch them
+    #[clap(long, default_value = "0")]
+    background_documents: usize,
+    /// Do not publish the messages, another machine already did
+    #[clap(long)]
+    skip_populate: bool,
+    /// Round the clients fetch the documents since, printed by the run that populated the
+    /// deaddrop when it is not this one
+    #[clap(long, default_value = "0")]
+    since_round: u64,
+    /// Only publish the messages that are then fetched by the clients
+    #[clap(long)]
+    populate_only: bool,
+    /// Fetches each client keeps in flight at the same time
+    #[clap(long, default_value = "1")]
+    pipeline: usize,
+    /// Connections of each client to the deaddrop, the fetches in flight are spread over them
+    #[clap(long, default_value = "1")]
+    connections: usize,
     #[clap(long)]
     deaddrop_address: String,
     #[clap(long)]
     acceptance_window: usize,
     #[clap(long)]
     output: Option<PathBuf>,
+    #[clap(long, value_enum, default_value_t = OutputFormat::Json)]
+    output_format: OutputFormat,
+    /// Write latency histograms of every second of the run to this file
+    #[clap(long)]
+    stats_snapshot: Option<PathBuf>,
+    #[clap(flatten)]
+    convergence: ConvergenceArgs,
+    #[clap(flatten)]
+    open_loop: OpenLoopArgs,
+    #[clap(flatten)]
+    distributed: DistributedArgs,
+}
+
+/// Options used when the clients of a run are split across several machines.
+#[derive(Debug, clap::Args)]
+struct DistributedArgs {
+    /// Id of the first client of this machine, so that client ids are unique across machines
+    #[clap(long, default_value = "0")]
+    client_offset: usize,
+    /// Unix timestamp at which the clients start, once they are all connected
+    #[clap(long)]
+    start_at: Option<f64>,
+}
+
+#[derive(Debug, clap::Args)]
+struct ConvergenceArgs {
+    /// Stop once the 95% confidence intervals of the throughput and latency of the
+    /// windows after warm-up are within this fraction of their mean, `--runtime` is
+    /// then the maximum runtime
+    #[clap(long)]
+    tolerance: Option<f64>,
+    /// Length in seconds of the windows throughput and latency are measured over
+    #[clap(long, default_value = "1.0")]
+    convergence_window: f64,
+    /// Number of consecutive stable windows that end warm-up and that are needed
+    /// before stopping
+    #[clap(long, default_value = "5")]
+    convergence_windows: usize,
+}
+
+#[derive(Debug, Clone, Copy, PartialEq, Eq, clap::ValueEnum, Serialize, Deserialize)]
+#[serde(rename_all = "lowercase")]
+enum Arrival {
+    Fixed,
+    Poisson,
+}
+
+#[derive(Debug, clap::Args)]
+struct OpenLoopArgs {
+    /// Requests per second of each client, sent on a schedule without waiting for the previous
+    /// ones to complete. Each client waits for its reply before the next request when not set
+    #[clap(long)]
+    client_rate: Option<f64>,
+    /// Spacing of the scheduled requests, constant or exponentially distributed
+    #[clap(long, value_enum, default_value_t = Arrival::Fixed)]
+    arrival: Arrival,
+    /// Seed of the schedules, each client adds its id
+    #[clap(long, default_value = "0")]
+    seed: u64,
+    /// Seconds the requests still in flight at the end of the run are waited for, the others
+    /// are counted as unfinished
+    #[clap(long, default_value = "10")]
+    drain_timeout: f64,
 }
 
 #[derive(Debug, Parser)]
@@ -129,6 +236,14 @@ struct PublishTroughputResultsMessage {
     latency: f64,
 }
 
+impl ResultRow for PublishTroughputResultsMessage {
+    const COLUMNS: [&'static str; 4] = ["client", "message", "timestamp", "latency"];
+
+    fn columns(&self) -> (usize, usize, f64, f64) {
+        (self.client, self.message, self.timestamp, self.latency)
+    }
+}
+
 #[derive(Debug, Serialize, Deserialize)]
 struct PublishTroughputResults {
     clients: usize,
@@ -136,20 +251,42 @@ struct PublishTroughputResults {
     message_size: usize,
     prepared_messages: usize,
     acceptance_window: usize,
+    /// Seconds spent preparing the messages before the run, not part of the measured phase
+    preparation_time: f64,
+    /// Requests per second of each client of an open-loop run
+    client_rate: Option<f64>,
+    arrival: Option<Arrival>,
+    /// Requests of an open-loop run still in flight after the drain timeout
+    unfinished: usize,
+    /// Timestamp of the end of warm-up when running until convergence
+    warmup_end: Option<f64>,
+    converged: bool,
     messages: Vec<PublishTroughputResultsMessage>,
 }
 
 async fn benchmark_publish_troughput(args: PublishTroughputArgs) -> Result<()> {
     let deaddrop_addr = deaddrop_sockaddr(&args.deaddrop_address)?;
+    args.open_loop.check()?;
+    // prepared before the measured phase, usually loaded from the cache
+    let preparation_start = Instant::now();
     let (client_priv_key, prepared_messages) = prepare_open_mode_messages_cached(
+        "topic",
         args.prepared_messages,
         args.message_size,
         args.difficulty,
+        args.acceptance_window,
     )
-    .await;
+    .await?;
+    let preparation_time = preparation_start.elapsed().as_secs_f64();
+    println!(
+        "prepared {} messages in {preparation_time:.2} s",
+        prepared_messages.len()
+    );
     let message_queue = ConsumerQueue::new(prepared_messages);
     let barrier = Arc::new(Barrier::new(args.clients + 1));
     let stop_flag = Arc::new(AtomicBool::new(false));
+    let progress = Arc::new(Progress::default());
+    let unfinished = Arc::new(AtomicU64::new(0));
     let mut handles = Vec::with_capacity(args.clients);
     for client_id in 0..args.clients {
         let config = anonycast::client::Config {
@@ -159,6 +296,7 @@ async fn benchmark_publish_troughput(args: PublishTroughputArgs) -> Result<()> {
             ring: None,
             receivers_keys: Default::default(),
             deaddrop_addresses: vec![anonycast::DeaddropAddr::Tcp(deaddrop_addr)],
+            deaddrop_connections: 1,
             difficulty: args.difficulty as u8,
             acceptance_window: args.acceptance_window as u64,
             asset_owner_public_key: None,
@@ -166,15 +304,20 @@ async fn benchmark_publish_troughput(args: PublishTroughputArgs) -> Result<()> {
             drand_client: Default::default(),
         };
 
+        let client_offset = args.distributed.client_offset;
+        let schedule = Schedule::new(&args.open_loop, client_offset + client_id);
+        let drain_timeout = Duration::from_secs_f64(args.open_loop.drain_timeout);
         let message_queue = message_queue.clone();
         let barrier = barrier.clone();
         let stop_flag = stop_flag.clone();
+        let progress = progress.clone();
+        let unfinished = unfinished.clone();
         let handle = tokio::spawn(async move {
             // stagger connects to help prevent timeouts
             tokio::time::sleep(Duration::from_millis(50 * client_id as u64)).await;
 
-            let mut client = match create_client_retry(&config, 5).await {
-                Ok(client) => client,
+            let client = match create_client_retry(&config, 5).await {
+                Ok(client) => Arc::new(client),
                 Err(err) => {
                     eprintln!("client failed to connect: {err}");
                     std::process::exit(1);
@@ -185,16 +328,56 @@ async fn benchmark_publish_troughput(args: PublishTroughputArgs) -> Result<()> {
             let mut result_messages = Vec::new();
 
             barrier.wait().await;
+            if let Some(schedule) = schedule {
+                let (messages, client_unfinished) = run_open_loop(
+                    schedule,
+                    &stop_flag,
+                    &progress,
+                    stats::Operation::Send,
+                    drain_timeout,
+                    || {
+                        let message = message_queue.consume()?;
+                        let client = client.clone();
+                        Some(async move { client.send_serialized_message(message).await })
+                    },
+                )
+                .await;
+                if !stop_flag.load(std::sync::atomic::Ordering::Relaxed) {
+                    eprintln!("client {client_id} ran out of prepared messages");
+                }
+                unfinished.fetch_add(
+                    client_unfinished as u64,
+                    std::sync::atomic::Ordering::Relaxed,
+                );
+                return messages
+                    .into_iter()
+                    .enumerate()
+                    .map(
+                        |(message, (timestamp, latency))| PublishTroughputResultsMessage {
+                            client: client_offset + client_id,
+                            message,
+                            timestamp,
+                            latency,
+                        },
+                    )
+                    .collect();
+            }
+
             while let Some(message) = message_queue.consume() {
                 if stop_flag.load(std::sync::atomic::Ordering::Relaxed) {
                     break;
                 }
 
                 let timestamp = get_timestamp();
-                client.send_prepared_message(message).await;
+                client.send_serialized_message(message).await;
                 let latency = get_timestamp() - timestamp;
+                stats::log(
+                    stats::Operation::Send,
+                    Duration::try_from_secs_f64(latency).unwrap_or_default(),
+                );
+                progress.record(latency);
                 let result_message = PublishTroughputResultsMessage {
-                    client: client_id,
+                    client: client_offset + client_id,
                     message: message_id,
                     timestamp,
                     latency,
@@ -208,8 +391,10 @@ async fn benchmark_publish_troughput(args: PublishTroughputArgs) -> Result<()> {
         handles.push(handle);
     }
 
+    let stats_writer = spawn_stats_writer(&args.stats_snapshot)?;
+    wait_for_start(&args.distributed).await;
     barrier.wait().await;
-    tokio::time::sleep(Duration::from_secs(args.runtime as u64)).await;
+    let run_end = run_until_converged(args.runtime, &args.convergence, &progress).await;
     stop_flag.store(true, std::sync::atomic::Ordering::Relaxed);
 
     let mut client_messages = Vec::new();
@@ -217,17 +402,31 @@ async fn benchmark_publish_troughput(args: PublishTroughputArgs) -> Result<()> {
         let m = handle.await.context("client task failed")?;
         client_messages.extend(m);
     }
+    drop(stats_writer);
 
-    let results = PublishTroughputResults {
+    let mut results = PublishTroughputResults {
         clients: args.clients,
         difficulty: args.difficulty,
         message_size: args.message_size,
         prepared_messages: args.prepared_messages,
         acceptance_window: args.acceptance_window,
+        preparation_time,
+        client_rate: args.open_loop.client_rate,
+        arrival: args.open_loop.client_rate.map(|_| args.open_loop.arrival),
+        unfinished: unfinished.load(std::sync::atomic::Ordering::Relaxed) as usize,
+        warmup_end: run_end.warmup_end,
+        converged: run_end.converged,
         messages: client_messages,
     };
 
-    write_result_to_output(&args.output, &results).await?;
+    match args.output_format {
+        OutputFormat::Json => write_result_to_output(&args.output, &results).await?,
+        OutputFormat::Columnar => {
+            let rows = std::mem::take(&mut results.messages);
+            write_columnar_result_to_output(&args.output, &results, &rows).await?;
+            results.messages = rows;
+        }
+    }
 
     let min_ts = results
         .messages
@@ -253,6 +452,14 @@ struct RetreiveTroughputResultsFetch {
     latency: f64,
 }
 
+impl ResultRow for RetreiveTroughputResultsFetch {
+    const COLUMNS: [&'static str; 4] = ["client", "fetch", "timestamp", "latency"];
+
+    fn columns(&self) -> (usize, usize, f64, f64) {
+        (self.client, self.fetch, self.timestamp, self.latency)
+    }
+}
+
 #[derive(Debug, Serialize)]
 struct RetreiveTroughputResults {
     clients: usize,
@@ -260,7 +467,18 @@ struct RetreiveTroughputResults {
     difficulty: usize,
     message_size: usize,
     message_count: usize,
+    background_documents: usize,
+    pipeline: usize,
+    connections: usize,
     acceptance_window: usize,
+    /// Requests per second of each client of an open-loop run
+    client_rate: Option<f64>,
+    arrival: Option<Arrival>,
+    /// Requests of an open-loop run still in flight after the drain timeout
+    unfinished: usize,
+    /// Timestamp of the end of warm-up when running until convergence
+    warmup_end: Option<f64>,
+    converged: bool,
     message_fetches: Vec<RetreiveTroughputResultsFetch>,
 }
 
@@ -268,8 +486,22 @@ async fn benchmark_retrieve_troughput(args: RetreiveTroughputArgs) -> Result<()>
     const TOPIC: &'static str = "topic";
 
     let deaddrop_addr = deaddrop_sockaddr(&args.deaddrop_address)?;
+    args.open_loop.check()?;
+
+    let mut since_round = args.since_round;
+    if !args.skip_populate {
+        if args.background_documents != 0 {
+            since_round = publish_background_documents(
+                deaddrop_addr,
+                TOPIC,
+                args.background_documents,
+                args.difficulty,
+                args.acceptance_window,
+            )
+            .await?;
+            println!("since round {since_round}");
+        }
 
-    {
         let (_kpub, kpriv) = crypto::generate();
         let config = anonycast::client::Config {
             mode: anonycast::ModeOfOperation::Open,
@@ -278,6 +510,7 @@ async fn benchmark_retrieve_troughput(args: RetreiveTroughputArgs) -> Result<()>
             ring: Default::default(),
             receivers_keys: Default::default(),
             deaddrop_addresses: vec![anonycast::DeaddropAddr::Tcp(deaddrop_addr)],
+            deaddrop_connections: 1,
             difficulty: args.difficulty as u8,
             acceptance_window: args.acceptance_window as u64,
             asset_owner_public_key: Default::default(),
@@ -292,12 +525,17 @@ async fn benchmark_retrieve_troughput(args: RetreiveTroughputArgs) -> Result<()>
             client.send_message(TOPIC, &data).await;
         }
     }
+    if args.populate_only {
+        return Ok(());
+    }
 
     let (_client_kpub, client_kpriv) = crypto::generate();
-    let drand_client = drand::CachingClient::new(drand::DEFAULT_API_URL);
+    let drand_client = drand::CachingClient::default();
     let mut handles = Vec::with_capacity(args.clients);
     let barrier = Arc::new(Barrier::new(args.clients + 1));
     let stop_flag = Arc::new(AtomicBool::new(false));
+    let progress = Arc::new(Progress::default());
+    let unfinished = Arc::new(AtomicU64::new(0));
     let drand_chain = drand::chain_list().await.unwrap()[0].clone();
     for client_id in 0..args.clients {
         let config = anonycast::client::Config {
@@ -307,6 +545,7 @@ async fn benchmark_retrieve_troughput(args: RetreiveTroughputArgs) -> Result<()>
             ring: Default::default(),
             receivers_keys: Default::default(),
             deaddrop_addresses: vec![anonycast::DeaddropAddr::Tcp(deaddrop_addr)],
+            deaddrop_connections: args.connections,
             difficulty: args.difficulty as u8,
             acceptance_window: args.acceptance_window as u64,
             asset_owner_public_key: Default::default(),
@@ -314,14 +553,20 @@ async fn benchmark_retrieve_troughput(args: RetreiveTroughputArgs) -> Result<()>
             drand_client: Some(drand_client.clone()),
         };
 
+        let client_offset = args.distributed.client_offset;
+        let pipeline = args.pipeline.max(1);
+        let schedule = Schedule::new(&args.open_loop, client_offset + client_id);
+        let drain_timeout = Duration::from_secs_f64(args.open_loop.drain_timeout);
         let barrier = barrier.clone();
         let stop_flag = stop_flag.clone();
+        let progress = progress.clone();
+        let unfinished = unfinished.clone();
         let handle = tokio::spawn(async move {
             // stagger connects to help prevent timeouts
             tokio::time::sleep(Duration::from_millis(50 * client_id as u64)).await;
 
-            let mut client = match create_client_retry(&config, 5).await {
-                Ok(client) => client,
+            let client = match create_client_retry(&config, 5).await {
+                Ok(client) => Arc::new(client),
                 Err(err) => {
                     eprintln!("client failed to connect: {err}");
                     std::process::exit(1);
@@ -330,26 +575,73 @@ async fn benchmark_retrieve_troughput(args: RetreiveTroughputArgs) -> Result<()>
 
             barrier.wait().await;
             let mut fetches = Vec::new();
-            let mut fetch_id = 0;
-            while !stop_flag.load(std::sync::atomic::Ordering::Relaxed) {
-                let timestamp = get_timestamp();
-                client.fetch_messages_bench(TOPIC).await;
-                let latency = get_timestamp() - timestamp;
-                fetches.push(RetreiveTroughputResultsFetch {
-                    client: client_id,
-                    fetch: fetch_id,
-                    timestamp,
-                    latency,
-                });
-                fetch_id += 1;
+            if let Some(schedule) = schedule {
+                let client_unfinished;
+                (fetches, client_unfinished) = run_open_loop(
+                    schedule,
+                    &stop_flag,
+                    &progress,
+                    stats::Operation::Retrieve,
+                    drain_timeout,
+                    || {
+                        let client = client.clone();
+                        Some(async move { client.fetch_messages_bench(TOPIC, since_round).await })
+                    },
+                )
+                .await;
+                unfinished.fetch_add(
+                    client_unfinished as u64,
+                    std::sync::atomic::Ordering::Relaxed,
+                );
+            } else {
+                // each loop waits for its fetch before the next one, so the client always has
+                // `pipeline` fetches in flight
+                let mut loops = JoinSet::new();
+                for _ in 0..pipeline {
+                    let client = client.clone();
+                    let stop_flag = stop_flag.clone();
+                    let progress = progress.clone();
+                    loops.spawn(async move {
+                        let mut fetches = Vec::new();
+                        while !stop_flag.load(std::sync::atomic::Ordering::Relaxed) {
+                            let timestamp = get_timestamp();
+                            client.fetch_messages_bench(TOPIC, since_round).await;
+                            let latency = get_timestamp() - timestamp;
+                            stats::log(
+                                stats::Operation::Retrieve,
+                                Duration::try_from_secs_f64(latency).unwrap_or_default(),
+                            );
+                            progress.record(latency);
+                            fetches.push((timestamp, latency));
+                        }
+                        fetches
+                    });
+                }
+                while let Some(loop_fetches) = loops.join_next().await {
+                    fetches.extend(loop_fetches.unwrap());
+                }
             }
+            fetches.sort_by(|a, b| a.0.total_cmp(&b.0));
             fetches
+                .into_iter()
+                .enumerate()
+                .map(
+                    |(fetch_id, (timestamp, latency))| RetreiveTroughputResultsFetch {
+                        client: client_offset + client_id,
+                        fetch: fetch_id,
+                        timestamp,
+                        latency,
+                    },
+                )
+                .collect::<Vec<_>>()
         });
         handles.push(handle);
     }
 
+    let stats_writer = spawn_stats_writer(&args.stats_snapshot)?;
+    wait_for_start(&args.distributed).await;
     barrier.wait().await;
-    tokio::time::sleep(Duration::from_secs(args.runtime as u64)).await;
+    let run_end = run_until_converged(args.runtime, &args.convergence, &progress).await;
     stop_flag.store(true, std::sync::atomic::Ordering::Relaxed);
 
     let mut fetches = Vec::new();
@@ -357,18 +649,34 @@ async fn benchmark_retrieve_troughput(args: RetreiveTroughputArgs) -> Result<()>
         let f = handle.await.context("client task failed")?;
         fetches.extend(f);
     }
+    drop(stats_writer);
 
-    let results = RetreiveTroughputResults {
+    let mut results = RetreiveTroughputResults {
         clients: args.clients,
         runtime: args.runtime,
         difficulty: args.difficulty,
         message_size: args.message_size,
         message_count: args.message_count,
+        background_documents: args.background_documents,
+        pipeline: args.pipeline,
+        connections: args.connections,
         acceptance_window: args.acceptance_window,
+        client_rate: args.open_loop.client_rate,
+        arrival: args.open_loop.client_rate.map(|_| args.open_loop.arrival),
+        unfinished: unfinished.load(std::sync::atomic::Ordering::Relaxed) as usize,
+        warmup_end: run_end.warmup_end,
+        converged: run_end.converged,
         message_fetches: fetches,
     };
 
-    write_result_to_output(&args.output, &results).await?;
+    match args.output_format {
+        OutputFormat::Json => write_result_to_output(&args.output, &results).await?,
+        OutputFormat::Columnar => {
+            let rows = std::mem::take(&mut results.message_fetches);
+            write_columnar_result_to_output(&args.output, &results, &rows).await?;
+            results.message_fetches = rows;
+        }
+    }
 
     let min_ts = results
         .message_fetches
@@ -382,61 +690,190 @@ async fn benchmark_retrieve_troughput(args: RetreiveTroughputArgs) -> Result<()>
         .fold(f64::NEG_INFINITY, |a, b| a.max(b));
     let troughput = results.message_fetches.len() as f64 / (max_ts - min_ts);
     println!("troughput: {:.2} ops/s", troughput);
+    println!(
+        "troughput per client: {:.2} ops/s",
+        troughput / args.clients as f64
+    );
 
     Ok(())
 }
 
+const PREPARED_MESSAGES_CACHE_DIR: &str = ".cache/prepared-messages";
+
+/// Header of a file of the prepared messages cache.
+///
+/// The file is the length of the header as a little endian u64, the header, then the messages
+/// serialized as they are sent one after the other. It is mapped in memory, loading it neither
+/// reads nor deserializes the messages.
 #[derive(Debug, Clone, Serialize, Deserialize)]
-struct PreparedMessageCache {
+struct PreparedMessageCacheHeader {
     message_size: usize,
     crypto_difficulty: usize,
+    /// Drand round before the messages were prepared, their documents are of this round or later
+    round: u64,
     private_key: crypto::PrivateKey,
-    messages: Vec<anonycast::client::PreparedMessage>,
+    /// End of each message from the end of the header
+    ends: Vec<u64>,
+}
+
+/// A message of the prepared messages cache, serialized as it is sent
+#[derive(Debug, Clone)]
+pub struct CachedMessage {
+    map: Arc<memmap2::Mmap>,
+    range: Range<usize>,
 }
 
+impl AsRef<[u8]> for CachedMessage {
+    fn as_ref(&self) -> &[u8] {
+        &self.map[self.range.clone()]
+    }
+}
+
+/// Prepared open mode messages of at least `message_count` documents, from the on-disk cache
+/// when it has enough messages prepared less than `acceptance_window` rounds ago.
 pub async fn prepare_open_mode_messages_cached(
+    topic: &str,
     message_count: usize,
     message_size: usize,
     crypto_difficulty: usize,
-) -> (crypto::PrivateKey, Vec<anonycast::client::PreparedMessage>) {
-    let cache_dir = PathBuf::from(".cache/prepared-messages");
+    acceptance_window: usize,
+) -> Result<(crypto::PrivateKey, Vec<CachedMessage>)> {
+    let cache_dir = PathBuf::from(PREPARED_MESSAGES_CACHE_DIR);
     tokio::fs::create_dir_all(&cache_dir)
         .await
-        .context("creating prepared messages cache dir")
-        .unwrap();
-    let filename = format!("ms{message_size}_cd{crypto_difficulty}.bin");
-    let filepath = cache_dir.join(filename);
-    if filepath.exists() {
-        let content = tokio::fs::read(&filepath)
-            .await
-            .context("reading prepared messages cache file")
-            .unwrap();
-        let cached = bincode::deserialize::<PreparedMessageCache>(&content).unwrap();
-        assert_eq!(cached.message_size, message_size);
-        assert_eq!(cached.crypto_difficulty, crypto_difficulty);
-        if cached.messages.len() >= message_count {
-            return (cached.private_key, cached.messages);
+        .context("creating prepared messages cache dir")?;
+    let drand_chain = drand::chain_list().await?[0].clone();
+    let round = drand::CachingClient::default()
+        .chain_latest_randomness(&drand_chain)
+        .await?
+        .round_number;
+
+    // newest round first, files of rounds outside the window are removed
+    let prefix = format!("{topic}_ms{message_size}_cd{crypto_difficulty}_r");
+    let mut cached_rounds = Vec::new();
+    for entry in std::fs::read_dir(&cache_dir)? {
+        let name = entry?.file_name().to_string_lossy().into_owned();
+        let cached_round = name
+            .strip_prefix(&prefix)
+            .and_then(|name| name.strip_suffix(".bin"))
+            .and_then(|cached_round| cached_round.parse::<u64>().ok());
+        if let Some(cached_round) = cached_round {
+            cached_rounds.push(cached_round);
+        }
+    }
+    cached_rounds.sort_unstable_by(|a, b| b.cmp(a));
+    let cache_path = |round: u64| cache_dir.join(format!("{prefix}{round}.bin"));
+    for cached_round in cached_rounds {
+        let path = cache_path(cached_round);
+        // a replayed drand chain starts over at every run, rounds after the current one are stale
+        if cached_round > round || round - cached_round >= acceptance_window as u64 {
+            std::fs::remove_file(&path).context("removing expired prepared messages")?;
+            continue;
+        }
+        match load_prepared_messages(&path) {
+            Ok((header, messages))
+                if messages.len() >= message_count
+                    && header.message_size == message_size
+                    && header.crypto_difficulty == crypto_difficulty =>
+            {
+                return Ok((header.private_key, messages));
+            }
+            Ok(_) => {}
+            Err(err) => eprintln!("ignoring prepared messages cache {path:?}: {err:#}"),
         }
     }
 
-    let (_pubkey, privkey) = crypto::generate();
-    let messages =
-        prepare_open_mode_messages(message_count, message_size, crypto_difficulty, &privkey).await;
-    let cached = PreparedMessageCache {
+    let (_pubkey, private_key) = crypto::generate();
+    let messages = prepare_open_mode_messages(
+        topic,
+        message_count,
+        message_size,
+        crypto_difficulty,
+        &private_key,
+    )
+    .await;
+    let header = PreparedMessageCacheHeader {
         message_size,
-        private_key: privkey,
         crypto_difficulty,
-        messages,
+        round,
+        private_key,
+        ends: Default::default(),
     };
-    let serialized = bincode::serialize(&cached).unwrap();
-    tokio::fs::write(filepath, serialized)
-        .await
-        .context("writing prepared messages cache")
-        .unwrap();
-    (cached.private_key, cached.messages)
+    let path = cache_path(round);
+    write_prepared_messages(&path, header, &messages).context("writing prepared messages cache")?;
+    drop(messages);
+    let (header, messages) = load_prepared_messages(&path)?;
+    Ok((header.private_key, messages))
+}
+
+fn write_prepared_messages(
+    path: &Path,
+    mut header: PreparedMessageCacheHeader,
+    messages: &[anonycast::client::PreparedMessage],
+) -> Result<()> {
+    use std::io::Write as _;
+
+    let serialized = messages
+        .iter()
+        .map(|message| bincode::serialize(message).unwrap())
+        .collect::<Vec<_>>();
+    let mut end = 0;
+    header.ends = serialized
+        .iter()
+        .map(|message| {
+            end += message.len() as u64;
+            end
+        })
+        .collect();
+    let header = bincode::serialize(&header).unwrap();
+
+    // concurrent runs may prepare the same messages, the file is only visible once complete
+    let tmp_path = path.with_extension(format!("tmp{}", std::process::id()));
+    let mut file = std::io::BufWriter::new(std::fs::File::create(&tmp_path)?);
+    file.write_all(&(header.len() as u64).to_le_bytes())?;
+    file.write_all(&header)?;
+    for message in serialized.iter() {
+        file.write_all(message)?;
+    }
+    file.into_inner()?.sync_all()?;
+    std::fs::rename(&tmp_path, path)?;
+    Ok(())
+}
+
+fn load_prepared_messages(path: &Path) -> Result<(PreparedMessageCacheHeader, Vec<CachedMessage>)> {
+    let file = std::fs::File::open(path)?;
+    // safety: cache files are replaced by renaming a new file over them, never written in place
+    let map = Arc::new(unsafe { memmap2::Mmap::map(&file)? });
+    let header_len = map
+        .get(..8)
+        .context("truncated prepared messages cache")?
+        .try_into()
+        .map(u64::from_le_bytes)?;
+    let start = 8 + header_len as usize;
+    let header = map
+        .get(8..start)
+        .context("truncated prepared messages cache")?;
+    let header = bincode::deserialize::<PreparedMessageCacheHeader>(header)?;
+
+    let mut messages = Vec::with_capacity(header.ends.len());
+    let mut begin = start;
+    for end in header.ends.iter() {
+        let end = start + *end as usize;
+        anyhow::ensure!(
+            begin <= end && end <= map.len(),
+            "truncated prepared messages cache"
+        );
+        messages.push(CachedMessage {
+            map: map.clone(),
+            range: begin..end,
+        });
+        begin = end;
+    }
+    Ok((header, messages))
 }
 
 pub async fn prepare_open_mode_messages(
+    topic: &str,
     message_count: usize,
     message_size: usize,
     crypto_difficulty: usize,
@@ -449,6 +886,7 @@ pub async fn prepare_open_mode_messages(
         ring: Default::default(),
         receivers_keys: Default::default(),
         deaddrop_addresses: Default::default(),
+        deaddrop_connections: 1,
         difficulty: crypto_difficulty as u8,
         acceptance_window: Default::default(),
         asset_owner_public_key: Default::default(),
@@ -464,13 +902,100 @@ pub async fn prepare_open_mode_messages(
         content.extend(std::iter::repeat('x').take(message_size - content.len()));
         content.truncate(message_size);
         requests.push(anonycast::client::PrepareMessageRequest {
-            topic: "topic".to_string(),
+            topic: topic.to_string(),
             content,
         });
     }
     client.prepare_messages(requests).await
 }
 
+/// Fill the deaddrop with documents of `topic` that the clients of the run do not fetch, returns
+/// the first round after them that the clients fetch the documents since.
+///
+/// The documents come from the prepared messages cache and keep the drand round they were
+/// prepared in, the deaddrop must then accept old rounds with a large acceptance window. Their
+/// ids are still in the per round index of the topic, so that the fetches measure a range query
+/// that skips them.
+async fn publish_background_documents(
+    deaddrop_addr: SocketAddr,
+    topic: &str,
+    count: usize,
+    difficulty: usize,
+    acceptance_window: usize,
+) -> Result<u64> {
+    const BACKGROUND_MESSAGE_SIZE: usize = 128;
+    const BACKGROUND_CLIENTS: usize = 64;
+
+    let preparation_start = Instant::now();
+    let (client_priv_key, mut prepared_messages) = prepare_open_mode_messages_cached(
+        topic,
+        count,
+        BACKGROUND_MESSAGE_SIZE,
+        difficulty,
+        acceptance_window,
+    )
+    .await?;
+    println!(
+        "prepared {count} background documents in {:.2} s",
+        preparation_start.elapsed().as_secs_f64()
+    );
+    prepared_messages.truncate(count);
+    let message_queue = ConsumerQueue::new(prepared_messages);
+
+    let start = Instant::now();
+    let mut handles = Vec::with_capacity(BACKGROUND_CLIENTS);
+    for _ in 0..BACKGROUND_CLIENTS {
+        let config = anonycast::client::Config {
+            mode: anonycast::ModeOfOperation::Open,
+            private_key: Some(client_priv_key.clone()),
+            ring_private_key: None,
+            ring: None,
+            receivers_keys: Default::default(),
+            deaddrop_addresses: vec![anonycast::DeaddropAddr::Tcp(deaddrop_addr)],
+            deaddrop_connections: 1,
+            difficulty: difficulty as u8,
+            acceptance_window: acceptance_window as u64,
+            asset_owner_public_key: None,
+            drand_chain: Default::default(),
+            drand_client: Default::default(),
+        };
+        let message_queue = message_queue.clone();
+        handles.push(tokio::spawn(async move {
+            let client = create_client_retry(&config, 5).await?;
+            while let Some(message) = message_queue.consume() {
+                client.send_serialized_message(message).await;
+            }
+            anyhow::Ok(())
+        }));
+    }
+    for handle in handles {
+        handle.await.context("background client task failed")??;
+    }
+    println!(
+        "published {count} background documents in {:.2} s",
+        start.elapsed().as_secs_f64()
+    );
+
+    // the documents were prepared in this round at the latest, the messages of the run are
+    // published from the next one
+    let drand_client = drand::CachingClient::default();
+    let drand_chain = drand::chain_list().await?[0].clone();
+    let background_round = drand_client
+        .chain_latest_randomness(&drand_chain)
+        .await?
+        .round_number;
+    loop {
+        let round = drand_client
+            .chain_latest_randomness(&drand_chain)
+            .await?
+            .round_number;
+        if round > background_round {
+            return Ok(round);
+        }
+        tokio::time::sleep(Duration::from_millis(100)).await;
+    }
+}
+
 #[derive(Debug, Serialize)]
 struct LatencyResults {
     deaddrops: usize,
@@ -568,6 +1093,8 @@ async fn benchmark_latency(args: LatencyArgs) -> Result<()> {
             acceptance_window: args.acceptance_window as u64,
             asset_owner_key: Some(asset_owner_public_key.clone()),
             asset_owner_update: asset_owner_update.clone(),
+            verify_batching: Default::default(),
+            document_log: None,
         };
         tokio::spawn(async move {
             if let Err(err) = anonycast::deaddrop::run(config).await {
@@ -597,6 +1124,7 @@ async fn benchmark_latency(args: LatencyArgs) -> Result<()> {
             ring,
             receivers_keys,
             deaddrop_addresses,
+            deaddrop_connections: 1,
             difficulty: args.difficulty as u8,
             acceptance_window: args.acceptance_window as u64,
             asset_owner_public_key: Some(asset_owner_public_key),
@@ -670,6 +1198,342 @@ async fn write_result_to_output(output: &Option<PathBuf>, result: &impl Serializ
     Ok(())
 }
 
+/// A row of a benchmark result that can be stored in the columnar format.
+trait ResultRow {
+    /// Names of the (client, index, timestamp, latency) columns
+    const COLUMNS: [&'static str; 4];
+
+    fn columns(&self) -> (usize, usize, f64, f64);
+}
+
+const COLUMNAR_MAGIC: &[u8; 8] = b"ANCRES01";
+
+#[derive(Debug, Serialize)]
+struct ColumnarHeader<'a, T> {
+    columns: [&'static str; 4],
+    results: &'a T,
+}
+
+/// Write the rows of a benchmark result as fixed width columns that can be memory mapped.
+///
+/// Layout, all little endian:
+/// magic (8 bytes), header length (u64), row count (u64), header (json),
+/// zero padding to a multiple of 8 bytes, timestamp (f64 x rows), latency (f64 x rows),
+/// client (u32 x rows), index (u32 x rows).
+async fn write_columnar_result_to_output<R: ResultRow>(
+    output: &Option<PathBuf>,
+    result: &impl Serialize,
+    rows: &[R],
+) -> Result<()> {
+    if let Some(output) = output {
+        if let Some(parent) = output.parent() {
+            tokio::fs::create_dir_all(parent)
+                .await
+                .context("while creating benchmark results output parent directory")?;
+        }
+        let header = serde_json::to_vec(&ColumnarHeader {
+            columns: R::COLUMNS,
+            results: result,
+        })
+        .unwrap();
+
+        let mut serialized = Vec::with_capacity(32 + header.len() + rows.len() * 24);
+        serialized.extend_from_slice(COLUMNAR_MAGIC);
+        serialized.extend_from_slice(&(header.len() as u64).to_le_bytes());
+        serialized.extend_from_slice(&(rows.len() as u64).to_le_bytes());
+        serialized.extend_from_slice(&header);
+        serialized.resize(serialized.len().next_multiple_of(8), 0);
+        for row in rows {
+            serialized.extend_from_slice(&row.columns().2.to_le_bytes());
+        }
+        for row in rows {
+            serialized.extend_from_slice(&row.columns().3.to_le_bytes());
+        }
+        for row in rows {
+            serialized.extend_from_slice(&(row.columns().0 as u32).to_le_bytes());
+        }
+        for row in rows {
+            serialized.extend_from_slice(&(row.columns().1 as u32).to_le_bytes());
+        }
+
+        tokio::fs::write(output, serialized)
+            .await
+            .context("while writing benchmark results")?;
+    }
+    Ok(())
+}
+
+/// Wait for the start time shared by every machine of a distributed run.
+///
+/// Clients connect in the meantime and wait on the barrier, so they all start at the
+/// same time once it is reached.
+async fn wait_for_start(distributed: &DistributedArgs) {
+    let Some(start_at) = distributed.start_at else {
+        return;
+    };
+    let delay = start_at - get_timestamp();
+    if delay > 0.0 {
+        tokio::time::sleep(Duration::from_secs_f64(delay)).await;
+    } else {
+        eprintln!("start time passed {:.3}s ago, starting now", -delay);
+    }
+}
+
+impl OpenLoopArgs {
+    fn check(&self) -> Result<()> {
+        if let Some(rate) = self.client_rate {
+            anyhow::ensure!(
+                rate.is_finite() && rate > 0.0,
+                "the client rate must be positive"
+            );
+        }
+        anyhow::ensure!(
+            self.drain_timeout >= 0.0,
+            "the drain timeout must not be negative"
+        );
+        Ok(())
+    }
+}
+
+/// Send times of the requests of an open-loop client.
+struct Schedule {
+    arrival: Arrival,
+    rate: f64,
+    rng: StdRng,
+    next: f64,
+}
+
+impl Schedule {
+    /// Schedule of a client when `--client-rate` is set, starting once `start` is called
+    fn new(args: &OpenLoopArgs, client_id: usize) -> Option<Self> {
+        Some(Self {
+            arrival: args.arrival,
+            rate: args.client_rate?,
+            rng: StdRng::seed_from_u64(args.seed.wrapping_add(client_id as u64)),
+            next: 0.0,
+        })
+    }
+
+    fn start(&mut self, timestamp: f64) {
+        // clients on a fixed schedule start at a random phase so they do not all send at once
+        self.next = timestamp
+            + match self.arrival {
+                Arrival::Fixed => self.rng.gen::<f64>() / self.rate,
+                Arrival::Poisson => self.interval(),
+            };
+    }
+
+    fn interval(&mut self) -> f64 {
+        match self.arrival {
+            Arrival::Fixed => 1.0 / self.rate,
+            // exponentially distributed, 1 - x is in (0, 1]
+            Arrival::Poisson => -(1.0 - self.rng.gen::<f64>()).ln() / self.rate,
+        }
+    }
+
+    /// Timestamp of the next request
+    fn next(&mut self) -> f64 {
+        let scheduled = self.next;
+        self.next += self.interval();
+        scheduled
+    }
+}
+
+/// Send the requests of an open-loop client on its schedule, until `stop_flag` is set or
+/// `request` runs out, without waiting for the previous ones to complete.
+///
+/// Latencies are measured from the scheduled send time, so a request that waits behind a
+/// saturated deaddrop adds to its own latency instead of delaying the following requests.
+/// Returns the scheduled time and latency of the completed requests, in order, and the number
+/// of requests still in flight after `drain_timeout`.
+async fn run_open_loop<F, Fut>(
+    mut schedule: Schedule,
+    stop_flag: &AtomicBool,
+    progress: &Arc<Progress>,
+    operation: stats::Operation,
+    drain_timeout: Duration,
+    mut request: F,
+) -> (Vec<(f64, f64)>, usize)
+where
+    F: FnMut() -> Option<Fut>,
+    Fut: Future<Output = ()> + Send + 'static,
+{
+    use std::sync::atomic::Ordering;
+
+    let mut in_flight = JoinSet::new();
+    let mut completed = Vec::new();
+    schedule.start(get_timestamp());
+    loop {
+        let scheduled = schedule.next();
+        let delay = scheduled - get_timestamp();
+        if delay > 0.0 {
+            tokio::time::sleep(Duration::from_secs_f64(delay)).await;
+        }
+        if stop_flag.load(Ordering::Relaxed) {
+            break;
+        }
+        let Some(request) = request() else {
+            break;
+        };
+        let progress = progress.clone();
+        in_flight.spawn(async move {
+            request.await;
+            let latency = get_timestamp() - scheduled;
+            stats::log(
+                operation,
+                Duration::try_from_secs_f64(latency).unwrap_or_default(),
+            );
+            progress.record(latency);
+            (scheduled, latency)
+        });
+        while let Some(result) = in_flight.try_join_next() {
+            completed.push(result.unwrap());
+        }
+    }
+
+    let _ = tokio::time::timeout(drain_timeout, async {
+        while let Some(result) = in_flight.join_next().await {
+            completed.push(result.unwrap());
+        }
+    })
+    .await;
+    completed.sort_by(|a, b| a.0.total_cmp(&b.0));
+    (completed, in_flight.len())
+}
+
+/// Operations completed by all the clients, read by `run_until_converged`.
+#[derive(Debug, Default)]
+struct Progress {
+    operations: AtomicU64,
+    latency_nanos: AtomicU64,
+}
+
+impl Progress {
+    fn record(&self, latency: f64) {
+        use std::sync::atomic::Ordering;
+        self.operations.fetch_add(1, Ordering::Relaxed);
+        self.latency_nanos
+            .fetch_add((latency.max(0.0) * 1e9) as u64, Ordering::Relaxed);
+    }
+
+    fn load(&self) -> (u64, u64) {
+        use std::sync::atomic::Ordering;
+        (
+            self.operations.load(Ordering::Relaxed),
+            self.latency_nanos.load(Ordering::Relaxed),
+        )
+    }
+}
+
+#[derive(Debug, Default)]
+struct RunEnd {
+    warmup_end: Option<f64>,
+    converged: bool,
+}
+
+/// Wait for `runtime` seconds, or less when `convergence.tolerance` is set and the
+/// throughput and latency reached a steady state.
+///
+/// Throughput and mean latency are measured over consecutive windows. Warm-up ends
+/// with the first `convergence_windows` windows whose throughput is within twice the
+/// tolerance, the run converges once both are within the tolerance over every window
+/// since then.
+async fn run_until_converged(
+    runtime: usize,
+    convergence: &ConvergenceArgs,
+    progress: &Progress,
+) -> RunEnd {
+    let deadline = tokio::time::Instant::now() + Duration::from_secs(runtime as u64);
+    let Some(tolerance) = convergence.tolerance else {
+        tokio::time::sleep_until(deadline).await;
+        return RunEnd::default();
+    };
+
+    let window = Duration::from_secs_f64(convergence.convergence_window);
+    let k = convergence.convergence_windows.max(2);
+    let mut window_starts = Vec::new();
+    let mut throughputs = Vec::new();
+    let mut latencies = Vec::new();
+    let mut steady_from = None;
+    let mut previous = progress.load();
+    loop {
+        window_starts.push(get_timestamp());
+        let window_end = tokio::time::Instant::now() + window;
+        if window_end > deadline {
+            tokio::time::sleep_until(deadline).await;
+            break;
+        }
+        tokio::time::sleep_until(window_end).await;
+
+        let current = progress.load();
+        let operations = current.0 - previous.0;
+        throughputs.push(operations as f64 / window.as_secs_f64());
+        latencies.push((current.1 - previous.1) as f64 / 1e9 / operations as f64);
+        previous = current;
+
+        let n = throughputs.len();
+        if steady_from.is_none()
+            && n >= k
+            && relative_ci(&throughputs[n - k..]).is_some_and(|ci| ci <= 2.0 * tolerance)
+        {
+            steady_from = Some(n - k);
+        }
+        if let Some(from) = steady_from {
+            let converged = [&throughputs[from..], &latencies[from..]]
+                .iter()
+                .all(|values| relative_ci(values).is_some_and(|ci| ci <= tolerance));
+            if converged {
+                return RunEnd {
+                    warmup_end: Some(window_starts[from]),
+                    converged: true,
+                };
+            }
+        }
+    }
+
+    RunEnd {
+        warmup_end: steady_from.map(|from| window_starts[from]),
+        converged: false,
+    }
+}
+
+/// Half width of the 95% confidence interval of the mean relative to the mean.
+fn relative_ci(values: &[f64]) -> Option<f64> {
+    let n = values.len();
+    if n < 2 || values.iter().any(|v| !v.is_finite()) {
+        return None;
+    }
+    let mean = values.iter().sum::<f64>() / n as f64;
+    if mean <= 0.0 {
+        return None;
+    }
+    let variance = values.iter().map(|v| (v - mean).powi(2)).sum::<f64>() / (n - 1) as f64;
+    Some(student_t_975(n - 1) * (variance / n as f64).sqrt() / mean)
+}
+
+/// 97.5% quantile of the Student t distribution.
+fn student_t_975(degrees_of_freedom: usize) -> f64 {
+    const TABLE: [f64; 10] = [
+        12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    ];
+    match degrees_of_freedom {
+        0 => f64::INFINITY,
+        1..=10 => TABLE[degrees_of_freedom - 1],
+        // smallest degrees of freedom of each range, to stay conservative
+        11..=20 => 2.201,
+        21..=30 => 2.080,
+        31..=60 => 2.040,
+        _ => 2.000,
+    }
+}
+
+fn spawn_stats_writer(path: &Option<PathBuf>) -> Result<Option<stats::SnapshotWriter>> {
+    path.as_ref()
+        .map(|path| stats::SnapshotWriter::spawn(path, Duration::from_secs(1)))
+        .transpose()
+        .context("while creating stats snapshot file")
+}
+
 async fn create_client_retry(
     config: &anonycast::client::Config,
     retries: usize,
@@ -42,6 +42,10 @@ pub struct Args {
     #[clap(long)]
     deaddrop_tor: Vec<String>,
 
+    /// Connections opened to each deaddrop
+    #[clap(long, default_value = "1")]
+    deaddrop_connections: usize,
+
     #[clap(long, default_value = "1")]
     number_of_requests: u64,
 
@@ -66,6 +70,7 @@ pub async fn main(args: Args) -> Result<()> {
         },
         receivers_keys: args.receiver_key,
         deaddrop_addresses,
+        deaddrop_connections: args.deaddrop_connections,
         difficulty: args.difficulty,
         acceptance_window: args.acceptance_window,
         asset_owner_public_key: args.asset_owner_public_key,
@@ -1,4 +1,4 @@
-use std::net::SocketAddr;
+use std::{net::SocketAddr, path::PathBuf, time::Duration};
 
 use anonycast::ModeOfOperation;
 use anyhow::{Context, Result};
@@ -24,6 +24,27 @@ pub struct Args {
 
     #[clap(long, default_value = "100")]
     acceptance_window: u64,
+
+    /// Maximum number of queued signature verifications a worker does at once
+    #[clap(long, default_value = "64")]
+    verify_batch_size: usize,
+
+    /// Microseconds a worker waits for more signature verifications to fill a batch
+    #[clap(long, default_value = "0")]
+    verify_batch_delay: u64,
+
+    /// Keep the published documents in segment files of this directory instead of in memory,
+    /// the documents found there are served again after a restart
+    #[clap(long)]
+    document_log: Option<PathBuf>,
+
+    /// Size of a segment of the document log in MiB
+    #[clap(long, default_value = "1024")]
+    document_log_segment_size: u64,
+
+    /// Rounds covered by a segment of the document log
+    #[clap(long, default_value = "16")]
+    document_log_segment_rounds: u64,
 }
 
 pub async fn main(args: Args) -> Result<()> {
@@ -35,6 +56,17 @@ pub async fn main(args: Args) -> Result<()> {
         acceptance_window: args.acceptance_window,
         asset_owner_key: args.asset_owner_key,
         asset_owner_update: None,
+        verify_batching: anonycast::deaddrop::VerifyBatching {
+            max_size: args.verify_batch_size,
+            max_delay: Duration::from_micros(args.verify_batch_delay),
+        },
+        document_log: args
+            .document_log
+            .map(|directory| anonycast::deaddrop::DocumentLogConfig {
+                directory,
+                segment_size: args.document_log_segment_size * 1024 * 1024,
+                segment_rounds: args.document_log_segment_rounds,
+            }),
     };
     anonycast::deaddrop::run(config)
         .await
@@ -0,0 +1,36 @@
+use std::path::PathBuf;
+
+use anyhow::Result;
+use clap::Parser;
+
+/// Record the last rounds of a drand chain, to replay them with `--drand replay:<output>`
+#[derive(Debug, Parser)]
+pub struct Args {
+    /// Chain to record, the first chain of the API when not set
+    #[clap(long)]
+    chain: Option<String>,
+    #[clap(long, default_value_t = 256)]
+    rounds: u64,
+    #[clap(long, default_value = drand::DEFAULT_API_URL)]
+    url: String,
+    #[clap(long)]
+    output: PathBuf,
+}
+
+pub async fn main(args: Args) -> Result<()> {
+    let client = drand::BasicClient::new(args.url);
+    let chain = match args.chain {
+        Some(chain) => chain,
+        None => client
+            .chain_list()
+            .await?
+            .into_iter()
+            .next()
+            .ok_or_else(|| anyhow::anyhow!("no chains found"))?,
+    };
+    tracing::info!("recording {} rounds of chain {chain}", args.rounds);
+    let recording = client.record(&chain, args.rounds).await?;
+    let file = std::io::BufWriter::new(std::fs::File::create(&args.output)?);
+    serde_json::to_writer(file, &recording)?;
+    Ok(())
+}
@@ -1,17 +1,19 @@
-use std::net::SocketAddr;
+use std::{net::SocketAddr, path::PathBuf};
 
 use anonycast::DeaddropAddr;
 use anyhow::Result;
 use clap::Parser;
-use tracing_chrome::ChromeLayerBuilder;
+use tracing_chrome::{ChromeLayerBuilder, TraceStyle};
 use tracing_subscriber::{
-    fmt::format::FmtSpan, layer::SubscriberExt, util::SubscriberInitExt, EnvFilter,
+    filter::filter_fn, fmt::format::FmtSpan, layer::SubscriberExt, util::SubscriberInitExt,
+    EnvFilter, Layer as _,
 };
 
 mod asset_owner;
 mod benchmark;
 mod client;
 mod deaddrop;
+mod drand_record;
 mod genkey;
 mod pubkey;
 
@@ -19,6 +21,18 @@ mod pubkey;
 struct Args {
     #[clap(subcommand)]
     cmd: Subcommand,
+    /// Source of the drand beacons: the url of a drand HTTP API, `local` or `local:<period>` for a
+    /// chain synthesized in process, or `replay:<path>[@<unix start time>]` for a recording made
+    /// with `drand-record`, replayed once from the start time or from now
+    #[clap(long, global = true, default_value = drand::DEFAULT_API_URL)]
+    drand: drand::Source,
+    /// Fetch each drand round in the background as soon as it is published
+    #[clap(long, global = true)]
+    drand_prefetch: bool,
+    /// Record the spans of the request pipeline to this file as a Chrome trace, that Perfetto
+    /// can open and scripts/trace-stages.py turns into latency percentiles per stage
+    #[clap(long, global = true)]
+    trace: Option<PathBuf>,
 }
 
 #[derive(Debug, Parser)]
@@ -29,27 +43,62 @@ enum Subcommand {
     Genkey(genkey::Args),
     Pubkey(pubkey::Args),
     Benchmark(benchmark::Args),
+    DrandRecord(drand_record::Args),
 }
 
 pub async fn main() -> Result<()> {
-    //let (chrome_layer, _guard) = ChromeLayerBuilder::new().build();
-    tracing_subscriber::fmt()
-        .with_span_events(FmtSpan::CLOSE)
-        .with_writer(std::io::stderr)
-        .with_env_filter(EnvFilter::from_default_env())
-        .finish()
-        //.with(chrome_layer)
+    let args = Args::parse();
+
+    let Some(trace) = args.trace else {
+        tracing_subscriber::fmt()
+            .with_span_events(FmtSpan::CLOSE)
+            .with_writer(std::io::stderr)
+            .with_env_filter(EnvFilter::from_default_env())
+            .finish()
+            .init();
+        drand::set_default_source(args.drand, args.drand_prefetch)?;
+        return run(args.cmd).await;
+    };
+
+    // every span of this crate from creation to close, whatever the log level, the trace is
+    // written by a background thread
+    let (chrome_layer, _guard) = ChromeLayerBuilder::new()
+        .file(trace)
+        .trace_style(TraceStyle::Async)
+        .include_args(true)
+        .build();
+    tracing_subscriber::registry()
+        .with(
+            tracing_subscriber::fmt::layer()
+                .with_span_events(FmtSpan::CLOSE)
+                .with_writer(std::io::stderr)
+                .with_filter(EnvFilter::from_default_env()),
+        )
+        .with(chrome_layer.with_filter(filter_fn(|metadata| {
+            metadata.is_span() && metadata.target().starts_with("anonycast")
+        })))
         .init();
+    drand::set_default_source(args.drand, args.drand_prefetch)?;
 
-    let args = Args::parse();
+    // the trace is only complete once the guard is dropped, so stop on SIGTERM instead of being
+    // killed by it
+    let mut terminate = tokio::signal::unix::signal(tokio::signal::unix::SignalKind::terminate())?;
+    tokio::select! {
+        result = run(args.cmd) => result,
+        _ = terminate.recv() => Ok(()),
+        _ = tokio::signal::ctrl_c() => Ok(()),
+    }
+}
 
-    match args.cmd {
+async fn run(cmd: Subcommand) -> Result<()> {
+    match cmd {
         Subcommand::Client(cargs) => client::main(cargs).await,
         Subcommand::AssetOwner(cargs) => asset_owner::main(cargs).await,
         Subcommand::Deaddrop(cargs) => deaddrop::main(cargs).await,
         Subcommand::Genkey(cargs) => genkey::main(cargs).await,
         Subcommand::Pubkey(cargs) => pubkey::main(cargs).await,
         Subcommand::Benchmark(cargs) => benchmark::main(cargs).await,
+        Subcommand::DrandRecord(cargs) => drand_record::main(cargs).await,
     }
 }
 
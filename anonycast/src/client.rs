@@ -1,9 +1,10 @@
 use std::collections::HashMap;
 
-use crypto::{PrivateKey, PublicKey, Ring, RingPrivateKey, Sha256};
+use bytes::Bytes;
+use crypto::{PreparedRing, PrivateKey, PublicKey, Ring, RingPrivateKey, Sha256};
 use rayon::iter::{IntoParallelIterator, ParallelIterator as _};
 use serde::{Deserialize, Serialize};
-use tokio::task::JoinSet;
+use tokio::task::{JoinHandle, JoinSet};
 use tracing::Instrument;
 
 use crate::{
@@ -11,7 +12,7 @@ use crate::{
     protocol::{
         Message, PublishDocument, RetrieveDocumentIds, RetrieveDocuments, Signed, UpdateAllowedKeys,
     },
-    DeaddropAddr, DeaddropConn, ModeOfOperation,
+    DeaddropAddr, DeaddropPool, ModeOfOperation,
 };
 
 #[derive(Debug, Clone)]
@@ -22,6 +23,8 @@ pub struct Config {
     pub ring: Option<Ring>,
     pub receivers_keys: Vec<PublicKey>,
     pub deaddrop_addresses: Vec<DeaddropAddr>,
+    /// Connections opened to each deaddrop, every connection carries several requests at once
+    pub deaddrop_connections: usize,
     pub difficulty: u8,
     pub acceptance_window: u64,
     pub asset_owner_public_key: Option<PublicKey>,
@@ -42,8 +45,10 @@ pub struct Client {
     config: Config,
     drand_client: drand::CachingClient,
     drand_chain: String,
-    deaddrops: Vec<DeaddropConn>,
-    sender_ring: Ring,
+    deaddrops: Vec<DeaddropPool>,
+    /// `config.ring` prepared once for all the messages
+    ring: Option<PreparedRing>,
+    sender_ring: PreparedRing,
     receiver_keys: Vec<PublicKey>,
 }
 
@@ -52,7 +57,8 @@ impl Client {
         let mut set = JoinSet::new();
         #[allow(clippy::unnecessary_to_owned)]
         for addr in config.deaddrop_addresses.iter().cloned() {
-            set.spawn(async move { DeaddropConn::connect(&addr).await });
+            let connections = config.deaddrop_connections;
+            set.spawn(async move { DeaddropPool::connect(&addr, connections).await });
         }
 
         let mut conns = Vec::new();
@@ -74,12 +80,13 @@ impl Client {
 
         let drand_client = match config.drand_client {
             Some(ref client) => client.clone(),
-            None => drand::CachingClient::new(drand::DEFAULT_API_URL),
+            None => Default::default(),
         };
         Ok(Self {
             config,
             drand_client,
             drand_chain,
+            ring: config.ring.as_ref().map(PreparedRing::new),
             deaddrops: conns,
             sender_ring: Default::default(),
             receiver_keys: Default::default(),
@@ -115,21 +122,29 @@ impl Client {
         self.deaddrop_broadcast_publish(&msg).await;
     }
 
-    pub async fn send_prepared_message(&mut self, PreparedMessage(msg): PreparedMessage) {
+    pub async fn send_prepared_message(&self, PreparedMessage(msg): PreparedMessage) {
         self.deaddrop_broadcast_publish(&msg).await;
     }
 
-    pub async fn fetch_messages_bench(&mut self, topic: &str) {
-        let since = 0;
+    /// Publish a message serialized ahead of time with `bincode::serialize` of its
+    /// `PreparedMessage`
+    pub async fn send_serialized_message<B>(&self, serialized: B)
+    where
+        B: AsRef<[u8]> + Clone + Send + 'static,
+    {
+        self.deaddrop_broadcast_serialized(serialized).await;
+    }
+
+    pub async fn fetch_messages_bench(&self, topic: &str, since_round: u64) {
         let request = self.sign_message(Message::RetrieveDocumentIds(RetrieveDocumentIds {
             topic: topic.to_string(),
-            since_round: since,
+            since_round,
         }));
 
         let message_ids = async {
             let mut response_set = JoinSet::new();
             let mut message_ids = HashMap::<DocumentId, usize>::default();
-            for (stream_idx, stream) in self.deaddrops.iter_mut().enumerate() {
+            for (stream_idx, stream) in self.deaddrops.iter().enumerate() {
                 let stream = stream.clone();
                 let request = request.clone();
                 response_set.spawn(async move {
@@ -182,8 +197,6 @@ impl Client {
         since: u64,
         check: bool,
     ) -> Vec<SignedDocument> {
-        self.update_keys().await;
-
         let current_round = self
             .drand_client
             .chain_latest_randomness(&self.drand_chain)
@@ -205,10 +218,12 @@ impl Client {
             since_round: since,
         }));
 
+        // the keys are not needed to list the documents, both requests are in flight together
+        let key_update = self.request_key_update();
         let mut response_set = JoinSet::new();
         let mut message_ids = HashMap::<DocumentId, usize>::default();
         let mut key_updates = Vec::new();
-        for (stream_idx, stream) in self.deaddrops.iter_mut().enumerate() {
+        for (stream_idx, stream) in self.deaddrops.iter().enumerate() {
             let stream = stream.clone();
             let request = request.clone();
             response_set.spawn(async move {
@@ -232,6 +247,11 @@ impl Client {
             }
         }
 
+        if let Some(key_update) = key_update {
+            let key_update = key_update.await.unwrap();
+            self.handle_key_update(key_update);
+            tracing::info!("keys updated");
+        }
         for key_update in key_updates {
             self.handle_key_update(key_update);
         }
@@ -301,7 +321,7 @@ impl Client {
                             let verified = match self.config.mode {
                                 ModeOfOperation::Open => signed_document.verify(),
                                 ModeOfOperation::SenderRestricted => {
-                                    signed_document.ring_verify(self.config.ring.as_ref().unwrap())
+                                    signed_document.ring_verify(self.ring.as_ref().unwrap())
                                 }
                                 ModeOfOperation::ReceiverRestricted => {
                                     signed_document.verify()
@@ -310,7 +330,7 @@ impl Client {
                                             .decrypt(self.config.private_key.as_ref().unwrap())
                                 }
                                 ModeOfOperation::FullyRestricted => {
-                                    signed_document.ring_verify(self.config.ring.as_ref().unwrap())
+                                    signed_document.ring_verify(self.ring.as_ref().unwrap())
                                         && signed_document
                                             .content
                                             .decrypt(self.config.private_key.as_ref().unwrap())
@@ -346,24 +366,39 @@ impl Client {
     }
 
     pub async fn update_keys(&mut self) {
+        if let Some(key_update) = self.request_key_update() {
+            let response = key_update.await.unwrap();
+            self.handle_key_update(response);
+            tracing::info!("keys updated");
+        }
+    }
+
+    /// Ask the first deaddrop for the allowed keys, none in open mode
+    fn request_key_update(&self) -> Option<JoinHandle<Signed<UpdateAllowedKeys>>> {
         tracing::info!("updating keys...");
         if std::matches!(self.config.mode, ModeOfOperation::Open) {
             tracing::info!("skipping key update, using open mop");
-            return;
+            return None;
         }
 
         let request = self.sign_message(Message::RetrieveKeys);
-        let stream = &mut self.deaddrops[0];
-        let response: Signed<UpdateAllowedKeys> = stream.send_and_read(&request).await;
-        self.handle_key_update(response);
-        tracing::info!("keys updated");
+        let stream = self.deaddrops[0].clone();
+        Some(tokio::spawn(async move {
+            stream
+                .send_and_read::<Signed<UpdateAllowedKeys>, _>(&request)
+                .await
+        }))
     }
 
     fn handle_key_update(&mut self, update: Signed<UpdateAllowedKeys>) {
         if !update.verify_with(self.config.asset_owner_public_key.as_ref().unwrap()) {
             panic!("deaddrop sent key update with invalid asset owner signature");
         }
-        self.sender_ring = Ring::from(update.content.allowed_sender_keys);
+        // every send and fetch asks for the keys, the ring is only prepared again when they change
+        let sender_ring = Ring::from(update.content.allowed_sender_keys);
+        if self.sender_ring.ring() != &sender_ring {
+            self.sender_ring = PreparedRing::new(&sender_ring);
+        }
         self.receiver_keys = update.content.allowed_receiver_keys;
     }
 
@@ -443,16 +478,27 @@ impl Client {
         self.sign_message(Message::PublishDocument(PublishDocument { document }))
     }
 
-    async fn deaddrop_broadcast_publish(&mut self, message: &Signed<Message>) {
+    async fn deaddrop_broadcast_publish(&self, message: &Signed<Message>) {
+        // serialized once for all the deaddrops
+        let serialized = Bytes::from(bincode::serialize(message).unwrap());
+        self.deaddrop_broadcast_serialized(serialized).await
+    }
+
+    async fn deaddrop_broadcast_serialized<B>(&self, serialized: B)
+    where
+        B: AsRef<[u8]> + Clone + Send + 'static,
+    {
         tracing::info!("broadingcasting message to deaddrops");
 
         let mut handles = Vec::with_capacity(self.deaddrops.len());
-        for (i, stream) in &mut self.deaddrops.iter_mut().enumerate() {
+        for (i, stream) in self.deaddrops.iter().enumerate() {
             let stream = stream.clone();
-            let message = message.clone();
+            let serialized = serialized.clone();
             let handle = tokio::spawn(async move {
                 tracing::debug!("sending message to stream {i}");
-                let response = stream.send_and_read::<Signed<Message>, _>(&message).await;
+                let response = stream
+                    .send_serialized_and_read::<Signed<Message>>(serialized.as_ref())
+                    .await;
                 match response.content {
                     Message::Success => {}
                     _ => panic!("expected success when publishing message"),
@@ -554,7 +600,7 @@ impl Client {
             }
             ModeOfOperation::SenderRestricted | ModeOfOperation::FullyRestricted => {
                 let key = self.config.ring_private_key.as_ref().unwrap();
-                let ring = self.config.ring.as_ref().unwrap();
+                let ring = self.ring.as_ref().unwrap();
                 Signed::ring_sign(key, ring, message)
             }
         })
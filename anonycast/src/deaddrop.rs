@@ -1,27 +1,36 @@
 use std::{
-    collections::HashMap,
     net::SocketAddr,
-    sync::{Arc, RwLock},
+    sync::{Arc, RwLock, RwLockReadGuard, RwLockWriteGuard},
+    time::{Duration, Instant},
 };
 
 use crossbeam::channel::{Receiver, Sender};
-use crypto::{PrivateKey, PublicKey, Ring};
+use crypto::{PreparedRing, PrivateKey, PublicKey, Ring};
 use tokio::{
-    io::BufStream,
-    net::{TcpListener, TcpStream},
-    sync::oneshot,
+    io::{BufReader, BufWriter},
+    net::{tcp::OwnedWriteHalf, TcpListener, TcpStream},
+    sync::{oneshot, Mutex, Semaphore},
 };
+use tracing::Instrument as _;
 
 use crate::{
-    document::{Document, DocumentId, SignedDocument},
+    document::DocumentId,
+    document_log::DocumentLog,
+    document_store::{ShardedDocumentStore, StoredDocument},
     protocol::{
-        DocumentIdList, DocumentList, Message, PublishDocument, RetrieveDocumentIds,
-        RetrieveDocuments, Signed, UpdateAllowedKeys,
+        self, DocumentIdList, Message, PublishDocument, RetrieveDocumentIds, RetrieveDocuments,
+        Signable, Signature, Signed, UpdateAllowedKeys,
     },
     rle, ModeOfOperation,
 };
 
-type ClientStream = BufStream<TcpStream>;
+pub use crate::document_log::DocumentLogConfig;
+
+/// Write half of a client connection, shared by the requests of the connection
+type ClientWriter = Arc<Mutex<BufWriter<OwnedWriteHalf>>>;
+
+/// Requests of a connection handled at the same time
+const MAX_REQUESTS_IN_FLIGHT: usize = 256;
 
 #[derive(Debug)]
 pub struct Config {
@@ -32,6 +41,27 @@ pub struct Config {
     pub acceptance_window: u64,
     pub asset_owner_key: Option<PublicKey>,
     pub asset_owner_update: Option<Signed<UpdateAllowedKeys>>,
+    pub verify_batching: VerifyBatching,
+    /// Keep the published documents on disk instead of in memory
+    pub document_log: Option<DocumentLogConfig>,
+}
+
+/// How the workers group the signature verifications queued at the same time.
+#[derive(Debug, Clone, Copy)]
+pub struct VerifyBatching {
+    /// Maximum number of verifications in a batch, 1 verifies every signature by itself
+    pub max_size: usize,
+    /// How long a worker waits for more verifications before verifying an incomplete batch
+    pub max_delay: Duration,
+}
+
+impl Default for VerifyBatching {
+    fn default() -> Self {
+        Self {
+            max_size: 64,
+            max_delay: Duration::ZERO,
+        }
+    }
 }
 
 type SharedState = Arc<State>;
@@ -43,13 +73,32 @@ struct State {
     difficulty: u8,
     acceptance_window: u64,
     drand_client: drand::CachingClient,
+    /// Published documents, separate from `state_mut` so that publishing does not block the
+    /// signature verifications
+    documents: ShardedDocumentStore,
+    /// Where the documents are kept when they are not in memory
+    document_log: Option<DocumentLog>,
     state_mut: RwLock<StateMut>,
     success_response: Signed<Message>,
 }
 
+impl State {
+    /// Read lock of `state_mut`, the wait is traced
+    fn read_state_mut(&self) -> RwLockReadGuard<'_, StateMut> {
+        let _span = tracing::debug_span!("acquire_state_lock", write = false).entered();
+        self.state_mut.read().unwrap()
+    }
+
+    /// Write lock of `state_mut`, the wait is traced
+    fn write_state_mut(&self) -> RwLockWriteGuard<'_, StateMut> {
+        let _span = tracing::debug_span!("acquire_state_lock", write = true).entered();
+        self.state_mut.write().unwrap()
+    }
+}
+
 struct StateMut {
-    published_documents: HashMap<DocumentId, SignedDocument>,
-    allowed_sender_ring: Ring,
+    /// Prepared once per key update for all the ring signature verifications
+    allowed_sender_ring: PreparedRing,
     allowed_receiver_keys: Vec<PublicKey>,
     keys_update_asset_owner: Option<Signed<UpdateAllowedKeys>>,
 }
@@ -67,7 +116,7 @@ enum WorkerJob {
     },
     RetrieveDocuments {
         request: RetrieveDocuments,
-        resp: oneshot::Sender<Vec<Signed<Document>>>,
+        resp: oneshot::Sender<(Vec<StoredDocument>, Signature)>,
     },
     RetrieveDocumentIds {
         request: RetrieveDocumentIds,
@@ -79,26 +128,53 @@ enum WorkerJob {
     },
 }
 
+impl WorkerJob {
+    fn name(&self) -> &'static str {
+        match self {
+            WorkerJob::Sign { .. } => "sign",
+            WorkerJob::PublishDocument { .. } => "publish_document",
+            WorkerJob::RetrieveDocuments { .. } => "retrieve_documents",
+            WorkerJob::RetrieveDocumentIds { .. } => "retrieve_document_ids",
+            WorkerJob::VerifySignature { .. } => "verify_signature",
+        }
+    }
+}
+
+/// A job waiting for a worker, `queued` is closed once a worker takes it
+struct QueuedJob {
+    job: WorkerJob,
+    queued: tracing::Span,
+}
+
+/// Verifications have a channel of their own, so that a worker filling a batch of them never
+/// takes other jobs away from the idle workers.
 #[derive(Debug, Clone)]
 struct Workers {
-    sender: Sender<WorkerJob>,
+    sender: Sender<QueuedJob>,
+    verify_sender: Sender<QueuedJob>,
 }
 
 impl Workers {
-    pub fn new(state: SharedState, workers: usize) -> Self {
+    pub fn new(state: SharedState, workers: usize, batching: VerifyBatching) -> Self {
         assert!(workers >= 1);
+        assert!(batching.max_size >= 1);
         let (sender, receiver) = crossbeam::channel::unbounded();
+        let (verify_sender, verify_receiver) = crossbeam::channel::unbounded();
         for _ in 0..workers {
             std::thread::Builder::new()
                 .name("deaddrop-worker".to_string())
                 .spawn({
                     let state = state.clone();
                     let receiver = receiver.clone();
-                    || Self::worker_entrypoint(state, receiver)
+                    let verify_receiver = verify_receiver.clone();
+                    move || Self::worker_entrypoint(state, receiver, verify_receiver, batching)
                 })
                 .expect("thread should spawn");
         }
-        Self { sender }
+        Self {
+            sender,
+            verify_sender,
+        }
     }
 
     #[tracing::instrument(skip_all)]
@@ -128,7 +204,10 @@ impl Workers {
     }
 
     #[tracing::instrument(skip_all)]
-    pub async fn retreive_documents(&self, request: RetrieveDocuments) -> Vec<Signed<Document>> {
+    pub async fn retreive_documents(
+        &self,
+        request: RetrieveDocuments,
+    ) -> (Vec<StoredDocument>, Signature) {
         let (sender, receiver) = oneshot::channel();
         self.send_job(WorkerJob::RetrieveDocuments {
             request,
@@ -159,13 +238,32 @@ impl Workers {
     }
 
     fn send_job(&self, job: WorkerJob) {
-        self.sender
-            .send(job)
+        let sender = match job {
+            WorkerJob::VerifySignature { .. } => &self.verify_sender,
+            _ => &self.sender,
+        };
+        let queued = tracing::debug_span!("queued", job = job.name(), queue_depth = sender.len());
+        sender
+            .send(QueuedJob { job, queued })
             .expect("workers should always be alive while the Sender is alive");
     }
 
-    fn worker_entrypoint(state: SharedState, receiver: Receiver<WorkerJob>) {
-        while let Ok(job) = receiver.recv() {
+    fn worker_entrypoint(
+        state: SharedState,
+        receiver: Receiver<QueuedJob>,
+        verify_receiver: Receiver<QueuedJob>,
+        batching: VerifyBatching,
+    ) {
+        loop {
+            let job = crossbeam::channel::select! {
+                recv(receiver) -> job => job,
+                recv(verify_receiver) -> job => job,
+            };
+            let QueuedJob { job, queued } = match job {
+                Ok(job) => job,
+                Err(_) => break,
+            };
+            drop(queued);
             match job {
                 WorkerJob::Sign { message, resp } => {
                     let _ = resp.send(sign(&state, message));
@@ -193,8 +291,37 @@ impl Workers {
                     signed_message,
                     resp,
                 } => {
-                    let _ = resp.send(verify_signature(&state, signed_message));
+                    let mut batch = vec![(signed_message, resp)];
+                    Self::fill_verify_batch(&verify_receiver, batching, &mut batch);
+                    verify_signatures(&state, batch);
+                }
+            }
+        }
+    }
+
+    /// Add the verifications queued behind the first one to `batch`, up to `max_size` of them.
+    fn fill_verify_batch(
+        verify_receiver: &Receiver<QueuedJob>,
+        batching: VerifyBatching,
+        batch: &mut Vec<(Signed<Message>, oneshot::Sender<bool>)>,
+    ) {
+        let deadline = Instant::now() + batching.max_delay;
+        for _ in 1..batching.max_size {
+            // returns the queued jobs even once the deadline has passed
+            match verify_receiver.recv_deadline(deadline) {
+                Ok(QueuedJob {
+                    job:
+                        WorkerJob::VerifySignature {
+                            signed_message,
+                            resp,
+                        },
+                    queued,
+                }) => {
+                    drop(queued);
+                    batch.push((signed_message, resp));
                 }
+                Ok(_) => unreachable!("only verifications are sent to the verify channel"),
+                Err(_) => break,
             }
         }
     }
@@ -202,26 +329,39 @@ impl Workers {
 
 pub async fn run(config: Config) -> std::io::Result<()> {
     let success_response = Signed::sign(&config.private_key, Message::Success);
+    let workers = usize::from(std::thread::available_parallelism().unwrap());
+    // enough shards that concurrent workers seldom contend on the same one
+    let documents = ShardedDocumentStore::new(4 * workers);
+    let document_log = match config.document_log {
+        Some(log_config) => {
+            let log = DocumentLog::open(log_config)?;
+            let recovered = log.documents();
+            tracing::info!("recovered {} documents from the log", recovered.len());
+            for (id, topic, document) in recovered {
+                documents.insert(id, &topic, document);
+            }
+            Some(log)
+        }
+        None => None,
+    };
     let state = Arc::new(State {
         mode: config.mode,
         private_key: config.private_key,
         asset_owner_key: config.asset_owner_key.clone(),
         difficulty: config.difficulty,
         acceptance_window: config.acceptance_window,
-        drand_client: drand::CachingClient::new(drand::DEFAULT_API_URL),
+        drand_client: Default::default(),
         success_response,
+        documents,
+        document_log,
         state_mut: RwLock::new(StateMut {
-            published_documents: Default::default(),
             allowed_sender_ring: Default::default(),
             allowed_receiver_keys: Default::default(),
             keys_update_asset_owner: None,
         }),
     });
 
-    let workers = Workers::new(
-        state.clone(),
-        usize::from(std::thread::available_parallelism().unwrap()),
-    );
+    let workers = Workers::new(state.clone(), workers, config.verify_batching);
 
     if let Some(update) = config.asset_owner_update {
         handle_update_allowed_keys(&state, &workers, update).await;
@@ -254,69 +394,111 @@ async fn handle_connection(
 ) -> std::io::Result<()> {
     tracing::info!("handling connection");
 
-    let mut stream = BufStream::new(stream);
+    let (reader, writer) = stream.into_split();
+    let mut reader = BufReader::new(reader);
+    let writer: ClientWriter = Arc::new(Mutex::new(BufWriter::new(writer)));
+    // bounds the requests of a connection that are handled at the same time, reading waits for
+    // one to complete once there are as many
+    let in_flight = Arc::new(Semaphore::new(MAX_REQUESTS_IN_FLIGHT));
 
     loop {
-        let signed = match rle::async_deserialize_and_read::<Signed<Message>, _>(&mut stream).await
-        {
-            Ok(signed) => signed,
-            Err(err) if err.kind() == std::io::ErrorKind::UnexpectedEof => break,
-            Err(err) => return Err(err),
-        };
-
-        if !workers.verify_signature(signed.clone()).await {
-            tracing::warn!(
-                "signature verification failed for message {:#?}",
-                signed.content
-            );
-            continue;
-        }
-
-        match signed.content {
-            Message::RetrieveDocumentIds(request) => {
-                handle_retrieve_document_ids(&state, &workers, &mut stream, request).await
-            }
-            Message::RetrieveDocuments(request) => {
-                handle_retrieve_documents(&state, &workers, &mut stream, request).await
-            }
-            Message::PublishDocument(request) => {
-                handle_publish_documents(&state, &workers, &mut stream, request).await;
-                // let response = sign(state.clone(), Message::Success);
-                // rle::async_serialize_and_write(&mut stream, &response)
-                //     .await
-                //     .unwrap();
-            }
-            Message::UpdateAllowedKeys(update) => {
-                handle_update_allowed_keys(&state, &workers, Signed::new(update, signed.signature))
-                    .await
+        let (id, signed) =
+            match rle::async_deserialize_and_read::<Signed<Message>, _>(&mut reader).await {
+                Ok(request) => request,
+                Err(err) if err.kind() == std::io::ErrorKind::UnexpectedEof => break,
+                Err(err) => return Err(err),
+            };
+
+        let permit = in_flight.clone().acquire_owned().await.unwrap();
+        let state = state.clone();
+        let workers = workers.clone();
+        let writer = writer.clone();
+        let span = tracing::debug_span!("handle_request", id, message = signed.content.name());
+        // responses are written as the requests complete, the client matches them by id
+        tokio::spawn(
+            async move {
+                let _permit = permit;
+                if let Err(err) = handle_request(&state, &workers, &writer, id, signed).await {
+                    tracing::error!("failed to handle request {id}: {err}");
+                }
             }
-            Message::RetrieveKeys => handle_retreive_keys(&state, &workers, &mut stream).await,
-            _ => return Err(std::io::Error::other("invalid message type received")),
-        }
+            .instrument(span),
+        );
     }
 
     tracing::info!("connection handling terminated");
     Ok(())
 }
 
-async fn handle_retreive_keys(state: &SharedState, _workers: &Workers, stream: &mut ClientStream) {
+async fn handle_request(
+    state: &SharedState,
+    workers: &Workers,
+    writer: &ClientWriter,
+    id: u32,
+    signed: Signed<Message>,
+) -> std::io::Result<()> {
+    if !workers.verify_signature(signed.clone()).await {
+        tracing::warn!(
+            "signature verification failed for message {:#?}",
+            signed.content
+        );
+        return Ok(());
+    }
+
+    match signed.content {
+        Message::RetrieveDocumentIds(request) => {
+            handle_retrieve_document_ids(state, workers, writer, id, request).await
+        }
+        Message::RetrieveDocuments(request) => {
+            handle_retrieve_documents(state, workers, writer, id, request).await
+        }
+        Message::PublishDocument(request) => {
+            handle_publish_documents(state, workers, writer, id, request).await;
+        }
+        Message::UpdateAllowedKeys(update) => {
+            handle_update_allowed_keys(state, workers, Signed::new(update, signed.signature)).await
+        }
+        Message::RetrieveKeys => handle_retreive_keys(state, workers, writer, id).await,
+        _ => return Err(std::io::Error::other("invalid message type received")),
+    }
+    Ok(())
+}
+
+async fn handle_retreive_keys(
+    state: &SharedState,
+    _workers: &Workers,
+    writer: &ClientWriter,
+    id: u32,
+) {
     let update_message = {
-        let state_mut = state.state_mut.write().unwrap();
+        let state_mut = state.write_state_mut();
         state_mut
             .keys_update_asset_owner
             .clone()
             .expect("asset owner hasnt sent key update")
     };
-    rle::async_serialize_and_write(stream, &update_message)
+    let response = bincode::serialize(&update_message).unwrap();
+    write_response(writer, id, &[&response]).await.unwrap();
+}
+
+/// Write the response of request `id` once the connection is free, the wait for the connection
+/// and the write are traced separately
+async fn write_response(writer: &ClientWriter, id: u32, parts: &[&[u8]]) -> std::io::Result<()> {
+    let mut writer = writer
+        .lock()
+        .instrument(tracing::debug_span!("acquire_writer_lock"))
+        .await;
+    rle::async_write_vectored(&mut *writer, id, parts)
+        .instrument(tracing::debug_span!("write_response"))
         .await
-        .unwrap();
 }
 
 #[tracing::instrument(skip_all)]
 async fn handle_retrieve_document_ids(
     _state: &SharedState,
     workers: &Workers,
-    stream: &mut ClientStream,
+    writer: &ClientWriter,
+    id: u32,
     request: RetrieveDocumentIds,
 ) {
     let (document_ids, allowed_sender_keys) = workers.retreive_document_ids(request).await;
@@ -324,31 +506,33 @@ async fn handle_retrieve_document_ids(
         message_ids: document_ids,
         allowed_sender_keys,
     });
-    let response = workers.sign(message).await;
-    rle::async_serialize_and_write(stream, &response)
-        .await
-        .unwrap();
+    let response = bincode::serialize(&workers.sign(message).await).unwrap();
+    write_response(writer, id, &[&response]).await.unwrap();
 }
 
 #[tracing::instrument(skip_all)]
 async fn handle_retrieve_documents(
     _state: &SharedState,
     workers: &Workers,
-    stream: &mut ClientStream,
+    writer: &ClientWriter,
+    id: u32,
     request: RetrieveDocuments,
 ) {
-    let documents = workers.retreive_documents(request).await;
-    let message = Message::DocumentList(DocumentList { documents });
-    let response = workers.sign(message).await;
-    rle::async_serialize_and_write(stream, &response)
-        .await
-        .unwrap();
+    let (documents, signature) = workers.retreive_documents(request).await;
+    let header = protocol::document_list_header(documents.len());
+    let signature = bincode::serialize(&signature).unwrap();
+    let mut parts = Vec::with_capacity(documents.len() + 2);
+    parts.push(header.as_slice());
+    parts.extend(documents.iter().map(|document| &document.serialized[..]));
+    parts.push(signature.as_slice());
+    write_response(writer, id, &parts).await.unwrap();
 }
 
 async fn handle_publish_documents(
     state: &SharedState,
     workers: &Workers,
-    stream: &mut ClientStream,
+    writer: &ClientWriter,
+    id: u32,
     request: PublishDocument,
 ) {
     let document = &request.document.content;
@@ -363,9 +547,8 @@ async fn handle_publish_documents(
         .await
         .unwrap();
     if workers.publish_document(request, chain, beacon).await {
-        rle::async_serialize_and_write(stream, &state.success_response)
-            .await
-            .unwrap();
+        let response = bincode::serialize(&state.success_response).unwrap();
+        write_response(writer, id, &[&response]).await.unwrap();
     } else {
         tracing::warn!("message invalid, not publishing");
         panic!("should not be happening during testing");
@@ -391,12 +574,109 @@ async fn handle_update_allowed_keys(
         );
         return;
     }
-    let mut state_mut = state.state_mut.write().unwrap();
-    state_mut.allowed_sender_ring = Ring::from(update.clone().content.allowed_sender_keys);
+    // prepared before taking the lock, it takes a while for large rings
+    let allowed_sender_ring =
+        PreparedRing::new(&Ring::from(update.clone().content.allowed_sender_keys));
+    let mut state_mut = state.write_state_mut();
+    state_mut.allowed_sender_ring = allowed_sender_ring;
     state_mut.allowed_receiver_keys = update.clone().content.allowed_receiver_keys;
     state_mut.keys_update_asset_owner = Some(update);
 }
 
+/// Signature checks that can be done for several messages at once
+enum BatchedCheck {
+    Asymmetric,
+    Ring,
+}
+
+/// Check done by `verify_signature` for a message when it is enough to accept it, if it can be
+/// batched.
+fn batched_check(state: &SharedState, signed_message: &Signed<Message>) -> Option<BatchedCheck> {
+    let (asymmetric, ring) = match signed_message.content {
+        Message::PublishDocument(_) => match state.mode {
+            ModeOfOperation::Open | ModeOfOperation::ReceiverRestricted => (true, false),
+            ModeOfOperation::SenderRestricted | ModeOfOperation::FullyRestricted => (false, true),
+        },
+        Message::RetrieveDocumentIds(_) | Message::RetrieveDocuments(_) | Message::RetrieveKeys => {
+            (true, true)
+        }
+        _ => return None,
+    };
+    match signed_message.signature {
+        Signature::Asymmetric { .. } if asymmetric => Some(BatchedCheck::Asymmetric),
+        Signature::RingAsymmetric { .. } if ring => Some(BatchedCheck::Ring),
+        _ => None,
+    }
+}
+
+/// Verify the signatures of a batch of messages with the same result as `verify_signature`.
+///
+/// Asymmetric signatures are screened together and verified one by one if the screening fails,
+/// ring signatures are checked against the allowed sender ring together. Messages that cannot be
+/// batched are verified by themselves.
+#[inline(never)]
+#[tracing::instrument(name = "work", skip_all, fields(job = "verify_signature", batch = batch.len()))]
+fn verify_signatures(state: &SharedState, batch: Vec<(Signed<Message>, oneshot::Sender<bool>)>) {
+    let mut asymmetric = Vec::new();
+    let mut ring = Vec::new();
+    for (signed_message, resp) in batch {
+        match batched_check(state, &signed_message) {
+            Some(BatchedCheck::Asymmetric) => {
+                let serialized = signed_message.content.serialize_for_signature();
+                asymmetric.push((signed_message, serialized, resp));
+            }
+            Some(BatchedCheck::Ring) => {
+                let serialized = signed_message.content.serialize_for_signature();
+                ring.push((signed_message, serialized, resp));
+            }
+            None => {
+                let _ = resp.send(verify_signature(state, signed_message));
+            }
+        }
+    }
+
+    if !asymmetric.is_empty() {
+        let items = asymmetric
+            .iter()
+            .map(
+                |(signed_message, serialized, _)| match signed_message.signature {
+                    Signature::Asymmetric {
+                        ref key,
+                        ref signature,
+                    } => (key, serialized.as_slice(), signature),
+                    Signature::RingAsymmetric { .. } => unreachable!(),
+                },
+            )
+            .collect::<Vec<_>>();
+        let valid = crypto::verify_batch(&items);
+        for (signed_message, _, resp) in asymmetric {
+            // a failed screening does not tell which signatures are invalid
+            let _ = resp.send(valid || signed_message.verify());
+        }
+    }
+
+    if !ring.is_empty() {
+        let items = ring
+            .iter()
+            .map(
+                |(signed_message, serialized, _)| match signed_message.signature {
+                    Signature::RingAsymmetric { ref signature } => {
+                        (serialized.as_slice(), signature)
+                    }
+                    Signature::Asymmetric { .. } => unreachable!(),
+                },
+            )
+            .collect::<Vec<_>>();
+        let valid = {
+            let state_mut = state.read_state_mut();
+            state_mut.allowed_sender_ring.verify_batch(&items)
+        };
+        for ((_, _, resp), valid) in ring.into_iter().zip(valid) {
+            let _ = resp.send(valid);
+        }
+    }
+}
+
 #[inline(never)]
 fn verify_signature(state: &SharedState, signed_message: Signed<Message>) -> bool {
     match signed_message.content {
@@ -413,7 +693,7 @@ fn verify_signature(state: &SharedState, signed_message: Signed<Message>) -> boo
         Message::PublishDocument(_) => match state.mode {
             ModeOfOperation::Open | ModeOfOperation::ReceiverRestricted => signed_message.verify(),
             ModeOfOperation::SenderRestricted | ModeOfOperation::FullyRestricted => {
-                let state_mut = state.state_mut.read().unwrap();
+                let state_mut = state.read_state_mut();
                 let ring = &state_mut.allowed_sender_ring;
                 signed_message.ring_verify(ring)
             }
@@ -422,7 +702,7 @@ fn verify_signature(state: &SharedState, signed_message: Signed<Message>) -> boo
             unreachable!("deaddrop should not received this message type")
         }
         Message::RetrieveDocumentIds(_) | Message::RetrieveDocuments(_) | Message::RetrieveKeys => {
-            let state_mut = state.state_mut.read().unwrap();
+            let state_mut = state.read_state_mut();
             let ring = &state_mut.allowed_sender_ring;
             signed_message.verify() || signed_message.ring_verify(ring)
         }
@@ -430,18 +710,15 @@ fn verify_signature(state: &SharedState, signed_message: Signed<Message>) -> boo
 }
 
 #[inline(never)]
-#[tracing::instrument(skip_all)]
+#[tracing::instrument(name = "work", skip_all, fields(job = "retrieve_document_ids"))]
 fn retreive_document_ids(
     state: &SharedState,
     request: RetrieveDocumentIds,
 ) -> (Vec<DocumentId>, Option<Signed<UpdateAllowedKeys>>) {
-    let mut document_ids = Vec::new();
-    let state_mut = state.state_mut.read().unwrap();
-    for signed_document in state_mut.published_documents.values() {
-        if signed_document.content.id.round >= request.since_round {
-            document_ids.push(signed_document.content.id.clone());
-        }
-    }
+    let document_ids = state
+        .documents
+        .ids_since(&request.topic, request.since_round);
+    let state_mut = state.read_state_mut();
 
     let allowed_sender_keys = match state.mode {
         ModeOfOperation::Open | ModeOfOperation::ReceiverRestricted => None,
@@ -454,27 +731,24 @@ fn retreive_document_ids(
 }
 
 #[inline(never)]
-#[tracing::instrument(skip_all)]
-fn retreive_documents(state: &SharedState, request: RetrieveDocuments) -> Vec<Signed<Document>> {
-    let mut documents = Vec::new();
-
-    let span = tracing::info_span!("acquire_state_lock");
-    let _guard = span.enter();
-    let state_mut = state.state_mut.read().unwrap();
-    drop(_guard);
-
-    for id in request.message_ids {
-        documents.push(
-            state_mut
-                .published_documents
-                .get(&id)
-                .cloned()
-                .expect("request unknown message id"),
-        );
-    }
-    documents
+#[tracing::instrument(name = "work", skip_all, fields(job = "retrieve_documents"))]
+fn retreive_documents(
+    state: &SharedState,
+    request: RetrieveDocuments,
+) -> (Vec<StoredDocument>, Signature) {
+    // the documents are shared with the store, ids that are unknown or expired since they were
+    // listed are skipped
+    let documents = state.documents.get_many(&request.message_ids);
+
+    let data = protocol::document_list_signature_data(documents.iter().map(|d| d.digest));
+    let signature = Signature::Asymmetric {
+        key: state.private_key.public_key(),
+        signature: crypto::sign(&state.private_key, &data),
+    };
+    (documents, signature)
 }
 
+#[tracing::instrument(name = "work", skip_all, fields(job = "publish_document"))]
 fn publish_document(
     state: &SharedState,
     request: PublishDocument,
@@ -491,15 +765,50 @@ fn publish_document(
     }
 
     tracing::info!("storing {:#?}", request.document.content.id);
-    let mut state_mut = state.state_mut.write().unwrap();
-    // TODO: handle duplicates?
-    state_mut
-        .published_documents
-        .insert(request.document.content.id.clone(), request.document);
+    let document = &request.document.content;
+    // documents of older rounds are no longer accepted nor requested by the clients
+    if state.acceptance_window != 0 {
+        let expire_before = document_beacon
+            .round_number
+            .saturating_sub(state.acceptance_window);
+        let expired = state.documents.expire_before(expire_before);
+        if expired != 0 {
+            tracing::info!(
+                "expired {expired} documents before round {expire_before}, {} left",
+                state.documents.len()
+            );
+        }
+        if let Some(ref log) = state.document_log {
+            let segments = log.expire_before(expire_before);
+            if segments != 0 {
+                tracing::info!("deleted {segments} segments before round {expire_before}");
+            }
+        }
+    }
+
+    let mut stored = StoredDocument::new(&request.document);
+    if let Some(ref log) = state.document_log {
+        // do not append the documents that are already in the log
+        if state.documents.contains(&document.id) {
+            tracing::debug!("document already stored");
+            return true;
+        }
+        match log.append(&document.id, &document.topic, &stored) {
+            Ok(appended) => stored = appended,
+            Err(err) => tracing::error!("failed to append to the document log: {err}"),
+        }
+    }
+    if !state
+        .documents
+        .insert(document.id.clone(), &document.topic, stored)
+    {
+        tracing::debug!("document already stored");
+    }
 
     true
 }
 
+#[tracing::instrument(name = "work", skip_all, fields(job = "sign"))]
 fn sign(state: &SharedState, message: Message) -> Signed<Message> {
     Signed::sign(&state.private_key, message)
 }
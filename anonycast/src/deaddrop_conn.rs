@@ -1,7 +1,22 @@
-use std::{net::SocketAddr, sync::Arc};
+use std::{
+    collections::HashMap,
+    net::SocketAddr,
+    sync::{
+        atomic::{AtomicUsize, Ordering},
+        Arc,
+    },
+};
 
 use serde::{de::DeserializeOwned, Serialize};
-use tokio::{io::BufStream, net::TcpStream, sync::Mutex, time::Instant};
+use tokio::{
+    io::{BufReader, BufWriter},
+    net::{
+        tcp::{OwnedReadHalf, OwnedWriteHalf},
+        TcpStream,
+    },
+    sync::{oneshot, Mutex},
+    task::{AbortHandle, JoinSet},
+};
 use tor_stream::TorStream;
 
 use crate::rle;
@@ -23,15 +38,47 @@ pub enum DeaddropAddr {
     Tcp(SocketAddr),
 }
 
+/// A connection to a deaddrop that carries several requests at once.
+///
+/// Every request gets an id that the deaddrop repeats in its response. A reader task hands the
+/// responses to the requests waiting for them in whatever order they arrive.
 #[derive(Debug, Clone)]
-struct Inner(Arc<Mutex<BufStream<TcpStream>>>);
+pub struct DeaddropConn(Arc<Inner>);
 
-#[derive(Debug, Clone)]
-pub struct DeaddropConn(Inner);
+#[derive(Debug)]
+struct Inner {
+    writer: Mutex<BufWriter<OwnedWriteHalf>>,
+    pending: Arc<std::sync::Mutex<Pending>>,
+    reader: AbortHandle,
+}
+
+impl Drop for Inner {
+    fn drop(&mut self) {
+        self.reader.abort();
+    }
+}
+
+#[derive(Debug, Default)]
+struct Pending {
+    next_id: u32,
+    waiting: HashMap<u32, oneshot::Sender<Vec<u8>>>,
+    /// The reader stopped, no response will arrive anymore
+    closed: bool,
+}
 
 impl DeaddropConn {
     pub fn new(stream: TcpStream) -> Self {
-        Self(Inner(Arc::new(Mutex::new(BufStream::new(stream)))))
+        let (reader, writer) = stream.into_split();
+        let pending = Arc::new(std::sync::Mutex::new(Pending::default()));
+        let reader = tokio::spawn(Self::read_responses(
+            BufReader::new(reader),
+            pending.clone(),
+        ));
+        Self(Arc::new(Inner {
+            writer: Mutex::new(BufWriter::new(writer)),
+            pending,
+            reader: reader.abort_handle(),
+        }))
     }
 
     pub async fn connect(addr: &DeaddropAddr) -> std::io::Result<Self> {
@@ -66,35 +113,140 @@ impl DeaddropConn {
         Ok(Self::new(TcpStream::from_std(tcp_stream)?))
     }
 
+    async fn read_responses(
+        mut reader: BufReader<OwnedReadHalf>,
+        pending: Arc<std::sync::Mutex<Pending>>,
+    ) {
+        loop {
+            match rle::async_read(&mut reader).await {
+                Ok((id, data)) => match pending.lock().unwrap().waiting.remove(&id) {
+                    Some(waiting) => {
+                        let _ = waiting.send(data);
+                    }
+                    None => tracing::warn!("response to unknown request {id}"),
+                },
+                Err(err) => {
+                    if err.kind() != std::io::ErrorKind::UnexpectedEof {
+                        tracing::error!("failed to read from deaddrop: {err}");
+                    }
+                    break;
+                }
+            }
+        }
+        // the waiting requests fail once their sender is dropped
+        let mut pending = pending.lock().unwrap();
+        pending.closed = true;
+        pending.waiting.clear();
+    }
+
+    /// Id of a new request, with the receiver of its response if it has one
+    fn start_request(&self, response: bool) -> (u32, Option<oneshot::Receiver<Vec<u8>>>) {
+        let mut pending = self.0.pending.lock().unwrap();
+        let id = pending.next_id;
+        pending.next_id = pending.next_id.wrapping_add(1);
+        if !response {
+            return (id, None);
+        }
+        let (sender, receiver) = oneshot::channel();
+        if !pending.closed {
+            pending.waiting.insert(id, sender);
+        }
+        (id, Some(receiver))
+    }
+
+    async fn write(&self, id: u32, serialized: &[u8]) {
+        let mut writer = self.0.writer.lock().await;
+        rle::async_write(&mut *writer, id, serialized)
+            .await
+            .unwrap()
+    }
+
+    /// Send a message the deaddrop does not respond to
     pub async fn send<T>(&self, message: &T)
     where
         T: Serialize,
     {
-        let mut stream = self.0 .0.lock().await;
-        rle::async_serialize_and_write(&mut *stream, message)
+        let (id, _) = self.start_request(false);
+        self.write(id, &bincode::serialize(message).unwrap()).await
+    }
+
+    #[tracing::instrument(skip_all)]
+    pub async fn send_and_read<R, T>(&self, message: &T) -> R
+    where
+        R: DeserializeOwned,
+        T: Serialize,
+    {
+        self.send_serialized_and_read(&bincode::serialize(message).unwrap())
             .await
-            .unwrap()
     }
 
-    pub async fn read<R>(&self) -> R
+    /// Same as `send_and_read` with a message that is already serialized
+    pub async fn send_serialized_and_read<R>(&self, serialized: &[u8]) -> R
     where
         R: DeserializeOwned,
     {
-        let mut stream = self.0 .0.lock().await;
-        rle::async_deserialize_and_read(&mut *stream).await.unwrap()
+        let (id, response) = self.start_request(true);
+        self.write(id, serialized).await;
+        let data = response
+            .unwrap()
+            .await
+            .expect("deaddrop connection closed before the response");
+        bincode::deserialize(&data).unwrap()
+    }
+}
+
+/// Connections to the same deaddrop, requests are spread over them round robin.
+///
+/// Each connection already carries several requests at once, more connections spread them over
+/// more Tor circuits and deaddrop connection tasks.
+#[derive(Debug, Clone)]
+pub struct DeaddropPool {
+    conns: Arc<[DeaddropConn]>,
+    next: Arc<AtomicUsize>,
+}
+
+impl DeaddropPool {
+    pub async fn connect(addr: &DeaddropAddr, size: usize) -> std::io::Result<Self> {
+        let mut set = JoinSet::new();
+        for _ in 0..size.max(1) {
+            let addr = addr.clone();
+            set.spawn(async move { DeaddropConn::connect(&addr).await });
+        }
+
+        let mut conns = Vec::new();
+        while let Some(result) = set.join_next().await {
+            conns.push(result.map_err(std::io::Error::other)??);
+        }
+        Ok(Self {
+            conns: conns.into(),
+            next: Default::default(),
+        })
+    }
+
+    pub fn conn(&self) -> &DeaddropConn {
+        let i = self.next.fetch_add(1, Ordering::Relaxed);
+        &self.conns[i % self.conns.len()]
+    }
+
+    pub async fn send<T>(&self, message: &T)
+    where
+        T: Serialize,
+    {
+        self.conn().send(message).await
     }
 
-    #[tracing::instrument(skip_all)]
     pub async fn send_and_read<R, T>(&self, message: &T) -> R
     where
         R: DeserializeOwned,
         T: Serialize,
     {
-        let mut stream = self.0 .0.lock().await;
-        rle::async_serialize_and_write(&mut *stream, message)
-            .await
-            .unwrap();
-        let r = rle::async_deserialize_and_read(&mut *stream).await.unwrap();
-        r
+        self.conn().send_and_read(message).await
+    }
+
+    pub async fn send_serialized_and_read<R>(&self, serialized: &[u8]) -> R
+    where
+        R: DeserializeOwned,
+    {
+        self.conn().send_serialized_and_read(serialized).await
     }
 }
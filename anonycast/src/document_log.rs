@@ -0,0 +1,420 @@
+use std::{
+    collections::HashMap,
+    fs::{File, OpenOptions},
+    os::unix::fs::FileExt,
+    path::{Path, PathBuf},
+    sync::{
+        atomic::{AtomicU64, Ordering},
+        Arc, Mutex,
+    },
+};
+
+use memmap2::{Mmap, MmapOptions};
+
+use crate::{
+    document::DocumentId,
+    document_store::{DocumentBytes, StoredDocument},
+};
+
+const MAGIC: &[u8; 8] = b"ACDLOG01";
+/// magic, first round, end round, 8 reserved bytes
+const SEGMENT_HEADER_LEN: u64 = 32;
+/// length of the document and length of its metadata
+const RECORD_HEADER_LEN: u64 = 8;
+const SEGMENT_EXTENSION: &str = "seg";
+
+#[derive(Debug, Clone)]
+pub struct DocumentLogConfig {
+    pub directory: PathBuf,
+    /// Bytes of a segment file, a document must fit in a single segment
+    pub segment_size: u64,
+    /// Rounds covered by a segment, all its documents expire at once after the last one
+    pub segment_rounds: u64,
+}
+
+/// Published documents appended to segment files on disk and served from memory mappings.
+///
+/// Each segment holds the documents of a range of `segment_rounds` rounds and is deleted as a
+/// whole once the documents of its rounds have expired. Only the index of the documents stays in
+/// memory, it is rebuilt on startup from the small metadata stored before each document.
+///
+/// A record is the length of the document, the length of its metadata, the metadata, a bincode
+/// `(DocumentId, topic, digest)`, then the document. Appends reserve their space in the segment
+/// and write the length of the document last, a length of 0 ends the records of a segment. A
+/// crash may lose the records written after the first incomplete one.
+pub struct DocumentLog {
+    config: DocumentLogConfig,
+    segments: Mutex<Segments>,
+    expired_before: AtomicU64,
+}
+
+#[derive(Default)]
+struct Segments {
+    /// Segment appended to for the rounds starting at the key
+    open: HashMap<u64, Arc<Segment>>,
+    all: Vec<Arc<Segment>>,
+    next_id: u64,
+}
+
+impl DocumentLog {
+    /// Open the segments of the directory, or create it.
+    pub fn open(config: DocumentLogConfig) -> std::io::Result<Self> {
+        assert!(config.segment_size > SEGMENT_HEADER_LEN);
+        assert!(config.segment_rounds >= 1);
+        std::fs::create_dir_all(&config.directory)?;
+
+        let mut segments = Segments::default();
+        for entry in std::fs::read_dir(&config.directory)? {
+            let path = entry?.path();
+            if path.extension().and_then(|e| e.to_str()) != Some(SEGMENT_EXTENSION) {
+                continue;
+            }
+            let Some(id) = path
+                .file_stem()
+                .and_then(|s| s.to_str())
+                .and_then(|s| s.parse::<u64>().ok())
+            else {
+                continue;
+            };
+            segments.next_id = segments.next_id.max(id + 1);
+            match Segment::open(&path)? {
+                Some(segment) => segments.all.push(Arc::new(segment)),
+                None => tracing::warn!("ignoring invalid segment {}", path.display()),
+            }
+        }
+        segments.all.sort_by_key(|s| s.first_round);
+
+        Ok(Self {
+            config,
+            segments: Mutex::new(segments),
+            expired_before: AtomicU64::new(0),
+        })
+    }
+
+    /// Documents stored in the segments found by `open`, in the order they were appended to each
+    /// segment.
+    pub fn documents(&self) -> Vec<(DocumentId, String, StoredDocument)> {
+        let segments = self.segments.lock().unwrap().all.clone();
+        let mut documents = Vec::new();
+        for segment in segments {
+            let scanned = segment.scan(&mut documents);
+            tracing::info!(
+                "{} documents in segment {}",
+                scanned,
+                segment.path.display()
+            );
+        }
+        documents
+    }
+
+    /// Append a document, returns it as stored in the segment.
+    pub fn append(
+        &self,
+        id: &DocumentId,
+        topic: &str,
+        document: &StoredDocument,
+    ) -> std::io::Result<StoredDocument> {
+        let metadata = bincode::serialize(&(id, topic, document.digest)).unwrap();
+        let record_len =
+            RECORD_HEADER_LEN + metadata.len() as u64 + document.serialized.len() as u64;
+        if SEGMENT_HEADER_LEN + record_len > self.config.segment_size {
+            return Err(std::io::Error::other(format!(
+                "document of {} bytes larger than a segment",
+                document.serialized.len()
+            )));
+        }
+
+        let first_round = id.round - id.round % self.config.segment_rounds;
+        let (segment, offset) = loop {
+            let segment = self.open_segment(first_round)?;
+            match segment.reserve(record_len) {
+                Some(offset) => break (segment, offset),
+                None => self.close_segment(&segment),
+            }
+        };
+
+        let mut header = [0u8; RECORD_HEADER_LEN as usize];
+        header[..4].copy_from_slice(&(document.serialized.len() as u32).to_le_bytes());
+        header[4..].copy_from_slice(&(metadata.len() as u32).to_le_bytes());
+        let data_offset = offset + RECORD_HEADER_LEN + metadata.len() as u64;
+        segment.file.write_all_at(&header[4..], offset + 4)?;
+        segment
+            .file
+            .write_all_at(&metadata, offset + RECORD_HEADER_LEN)?;
+        segment
+            .file
+            .write_all_at(&document.serialized, data_offset)?;
+        // the record is complete once its length is written
+        segment.file.write_all_at(&header[..4], offset)?;
+
+        Ok(StoredDocument {
+            serialized: segment.bytes(data_offset, document.serialized.len()),
+            digest: document.digest,
+        })
+    }
+
+    /// Delete the segments whose rounds are all before `round`, returns the number of segments
+    /// deleted. Documents already handed out stay readable until they are dropped.
+    pub fn expire_before(&self, round: u64) -> usize {
+        if self.expired_before.fetch_max(round, Ordering::Relaxed) >= round {
+            return 0;
+        }
+        let mut segments = self.segments.lock().unwrap();
+        let (expired, kept) = std::mem::take(&mut segments.all)
+            .into_iter()
+            .partition::<Vec<_>, _>(|s| s.end_round <= round);
+        segments.all = kept;
+        segments.open.retain(|_, s| s.end_round > round);
+        drop(segments);
+
+        for segment in expired.iter() {
+            if let Err(err) = std::fs::remove_file(&segment.path) {
+                tracing::error!("failed to remove segment {}: {err}", segment.path.display());
+            }
+        }
+        expired.len()
+    }
+
+    fn open_segment(&self, first_round: u64) -> std::io::Result<Arc<Segment>> {
+        let mut segments = self.segments.lock().unwrap();
+        if let Some(segment) = segments.open.get(&first_round) {
+            return Ok(segment.clone());
+        }
+        let path = self
+            .config
+            .directory
+            .join(format!("{:010}.{SEGMENT_EXTENSION}", segments.next_id));
+        let segment = Arc::new(Segment::create(
+            &path,
+            self.config.segment_size,
+            first_round,
+            first_round + self.config.segment_rounds,
+        )?);
+        segments.next_id += 1;
+        segments.all.push(segment.clone());
+        segments.open.insert(first_round, segment.clone());
+        Ok(segment)
+    }
+
+    /// Stop appending to a full segment
+    fn close_segment(&self, segment: &Arc<Segment>) {
+        let mut segments = self.segments.lock().unwrap();
+        if segments
+            .open
+            .get(&segment.first_round)
+            .is_some_and(|s| Arc::ptr_eq(s, segment))
+        {
+            segments.open.remove(&segment.first_round);
+        }
+    }
+}
+
+impl std::fmt::Debug for DocumentLog {
+    fn fmt(&self, f: &mut std::fmt::Formatter<'_>) -> std::fmt::Result {
+        f.debug_struct("DocumentLog")
+            .field("config", &self.config)
+            .finish_non_exhaustive()
+    }
+}
+
+struct Segment {
+    path: PathBuf,
+    file: File,
+    map: Mmap,
+    first_round: u64,
+    /// First round after the rounds of the segment
+    end_round: u64,
+    /// End of the reserved records
+    len: AtomicU64,
+}
+
+impl Segment {
+    fn create(path: &Path, size: u64, first_round: u64, end_round: u64) -> std::io::Result<Self> {
+        let file = OpenOptions::new()
+            .read(true)
+            .write(true)
+            .create_new(true)
+            .open(path)?;
+        // sparse, the records are zeroed until they are written
+        file.set_len(size)?;
+        let mut header = [0u8; SEGMENT_HEADER_LEN as usize];
+        header[..8].copy_from_slice(MAGIC);
+        header[8..16].copy_from_slice(&first_round.to_le_bytes());
+        header[16..24].copy_from_slice(&end_round.to_le_bytes());
+        file.write_all_at(&header, 0)?;
+        Self::map(path, file, first_round, end_round, SEGMENT_HEADER_LEN)
+    }
+
+    /// Open an existing segment from its header, None if it is not a segment. Its records are
+    /// only read by `scan`.
+    fn open(path: &Path) -> std::io::Result<Option<Self>> {
+        let file = OpenOptions::new().read(true).write(true).open(path)?;
+        let mut header = [0u8; SEGMENT_HEADER_LEN as usize];
+        if file.read_exact_at(&mut header, 0).is_err() || &header[..8] != MAGIC {
+            return Ok(None);
+        }
+        let first_round = u64::from_le_bytes(header[8..16].try_into().unwrap());
+        let end_round = u64::from_le_bytes(header[16..24].try_into().unwrap());
+        // nothing is appended to the segments of a previous run
+        let size = file.metadata()?.len();
+        Self::map(path, file, first_round, end_round, size).map(Some)
+    }
+
+    fn map(
+        path: &Path,
+        file: File,
+        first_round: u64,
+        end_round: u64,
+        len: u64,
+    ) -> std::io::Result<Self> {
+        let size = file.metadata()?.len();
+        // SAFETY: the file is only written by this process and a range is only read once its
+        // record has been written, after which it never changes
+        let map = unsafe { MmapOptions::new().len(size as usize).map(&file)? };
+        Ok(Self {
+            path: path.to_owned(),
+            file,
+            map,
+            first_round,
+            end_round,
+            len: AtomicU64::new(len),
+        })
+    }
+
+    /// Reserve the space of a record, returns its offset or None if the segment is full.
+    fn reserve(&self, record_len: u64) -> Option<u64> {
+        let offset = self.len.fetch_add(record_len, Ordering::Relaxed);
+        (offset + record_len <= self.map.len() as u64).then_some(offset)
+    }
+
+    fn bytes(self: &Arc<Self>, offset: u64, len: usize) -> DocumentBytes {
+        DocumentBytes::Mapped(MappedBytes {
+            segment: self.clone(),
+            offset: offset as usize,
+            len,
+        })
+    }
+
+    /// Append the complete records of the segment to `documents`, returns their number.
+    fn scan(self: &Arc<Self>, documents: &mut Vec<(DocumentId, String, StoredDocument)>) -> usize {
+        let map = &self.map[..];
+        let mut offset = SEGMENT_HEADER_LEN as usize;
+        let mut scanned = 0;
+        while offset + RECORD_HEADER_LEN as usize <= map.len() {
+            let document_len = u32::from_le_bytes(map[offset..offset + 4].try_into().unwrap());
+            let metadata_len = u32::from_le_bytes(map[offset + 4..offset + 8].try_into().unwrap());
+            let metadata_offset = offset + RECORD_HEADER_LEN as usize;
+            let data_offset = metadata_offset + metadata_len as usize;
+            if document_len == 0 || data_offset + document_len as usize > map.len() {
+                break;
+            }
+            let Ok((id, topic, digest)) =
+                bincode::deserialize::<(DocumentId, String, crypto::Sha256)>(
+                    &map[metadata_offset..data_offset],
+                )
+            else {
+                tracing::warn!("invalid record in segment {}", self.path.display());
+                break;
+            };
+            let stored = StoredDocument {
+                serialized: self.bytes(data_offset as u64, document_len as usize),
+                digest,
+            };
+            documents.push((id, topic, stored));
+            offset = data_offset + document_len as usize;
+            scanned += 1;
+        }
+        scanned
+    }
+}
+
+/// A document in a memory mapped segment, keeps the segment mapped
+#[derive(Clone)]
+pub struct MappedBytes {
+    segment: Arc<Segment>,
+    offset: usize,
+    len: usize,
+}
+
+impl std::ops::Deref for MappedBytes {
+    type Target = [u8];
+
+    fn deref(&self) -> &[u8] {
+        &self.segment.map[self.offset..self.offset + self.len]
+    }
+}
+
+impl std::fmt::Debug for MappedBytes {
+    fn fmt(&self, f: &mut std::fmt::Formatter<'_>) -> std::fmt::Result {
+        f.debug_struct("MappedBytes")
+            .field("segment", &self.segment.path)
+            .field("offset", &self.offset)
+            .field("len", &self.len)
+            .finish()
+    }
+}
+
+#[cfg(test)]
+mod test {
+    use bytes::Bytes;
+
+    use super::*;
+
+    fn document(round: u64, i: u8) -> (DocumentId, StoredDocument) {
+        let data = vec![i; 500];
+        let id = DocumentId {
+            round,
+            content_hash: crypto::sha256(&data),
+            public_key_hash: crypto::sha256(b"key"),
+        };
+        let stored = StoredDocument {
+            digest: crypto::sha256(&data),
+            serialized: DocumentBytes::Memory(Bytes::from(data)),
+        };
+        (id, stored)
+    }
+
+    #[test]
+    fn append_reopen_expire() {
+        let directory = std::env::temp_dir().join(format!("document-log-{}", std::process::id()));
+        let _ = std::fs::remove_dir_all(&directory);
+        let config = DocumentLogConfig {
+            directory: directory.clone(),
+            segment_size: 4096,
+            segment_rounds: 4,
+        };
+
+        let log = DocumentLog::open(config.clone()).unwrap();
+        for i in 0..40 {
+            let (id, stored) = document(i as u64 / 4, i);
+            let appended = log.append(&id, "a", &stored).unwrap();
+            assert_eq!(&appended.serialized[..], &stored.serialized[..]);
+        }
+        let (id, _) = document(0, 0);
+        let large = StoredDocument {
+            serialized: DocumentBytes::Memory(Bytes::from(vec![0; 4096])),
+            digest: crypto::sha256(b""),
+        };
+        assert!(log.append(&id, "a", &large).is_err());
+        drop(log);
+
+        let log = DocumentLog::open(config.clone()).unwrap();
+        let documents = log.documents();
+        assert_eq!(documents.len(), 40);
+        for (id, topic, stored) in documents.iter() {
+            assert_eq!(topic, "a");
+            assert_eq!(crypto::sha256(&stored.serialized), id.content_hash);
+        }
+
+        // the segments of rounds 0 to 3 are deleted, their documents stay readable while held
+        assert!(log.expire_before(4) > 0);
+        assert_eq!(log.expire_before(4), 0);
+        assert_eq!(documents[0].2.serialized.len(), 500);
+        drop(log);
+
+        let documents = DocumentLog::open(config).unwrap().documents();
+        assert_eq!(documents.len(), 24);
+        assert!(documents.iter().all(|(id, _, _)| id.round >= 4));
+        std::fs::remove_dir_all(&directory).unwrap();
+    }
+}
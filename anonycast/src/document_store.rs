@@ -0,0 +1,357 @@
+use std::{
+    collections::{BTreeMap, HashMap},
+    sync::{
+        atomic::{AtomicU64, Ordering},
+        RwLock,
+    },
+};
+
+use bytes::Bytes;
+use crypto::Sha256;
+
+use crate::{
+    document::{DocumentId, SignedDocument},
+    document_log::MappedBytes,
+};
+
+/// A serialized document, in memory or in a segment of the document log
+#[derive(Debug, Clone)]
+pub enum DocumentBytes {
+    Memory(Bytes),
+    Mapped(MappedBytes),
+}
+
+impl std::ops::Deref for DocumentBytes {
+    type Target = [u8];
+
+    fn deref(&self) -> &[u8] {
+        match self {
+            DocumentBytes::Memory(bytes) => bytes,
+            DocumentBytes::Mapped(bytes) => bytes,
+        }
+    }
+}
+
+/// A published document kept serialized, it is written as is in the responses.
+#[derive(Debug, Clone)]
+pub struct StoredDocument {
+    pub serialized: DocumentBytes,
+    /// Digest of `serialized`, signed in place of the document, see `DocumentList`
+    pub digest: Sha256,
+}
+
+impl StoredDocument {
+    pub fn new(document: &SignedDocument) -> Self {
+        let serialized = bincode::serialize(document).unwrap();
+        let digest = crypto::sha256(&serialized);
+        Self {
+            serialized: DocumentBytes::Memory(Bytes::from(serialized)),
+            digest,
+        }
+    }
+}
+
+/// Published documents with an index by topic and drand round.
+///
+/// Listing the documents of a topic since a round only visits the rounds in that range,
+/// so it costs O(new documents) instead of O(stored documents).
+#[derive(Debug, Default)]
+pub struct DocumentStore {
+    documents: HashMap<DocumentId, StoredDocument>,
+    rounds: HashMap<String, BTreeMap<u64, Vec<DocumentId>>>,
+    /// Documents of rounds before this one have been expired
+    expired_before: u64,
+}
+
+impl DocumentStore {
+    /// Store a document, returns false if a document with the same id was already stored.
+    pub fn insert(&mut self, id: DocumentId, topic: &str, document: StoredDocument) -> bool {
+        if id.round < self.expired_before {
+            return false;
+        }
+        if self.documents.insert(id.clone(), document).is_some() {
+            return false;
+        }
+        if !self.rounds.contains_key(topic) {
+            self.rounds.insert(topic.to_owned(), Default::default());
+        }
+        self.rounds
+            .get_mut(topic)
+            .unwrap()
+            .entry(id.round)
+            .or_default()
+            .push(id);
+        true
+    }
+
+    pub fn get(&self, id: &DocumentId) -> Option<&StoredDocument> {
+        self.documents.get(id)
+    }
+
+    /// Ids of the documents of `topic` published in `since_round` or later.
+    pub fn ids_since(&self, topic: &str, since_round: u64) -> impl Iterator<Item = &DocumentId> {
+        self.rounds
+            .get(topic)
+            .into_iter()
+            .flat_map(move |rounds| rounds.range(since_round..))
+            .flat_map(|(_, ids)| ids.iter())
+    }
+
+    /// Remove the documents of rounds before `round`, returns the number of documents removed.
+    pub fn expire_before(&mut self, round: u64) -> usize {
+        if round <= self.expired_before {
+            return 0;
+        }
+        self.expired_before = round;
+
+        let mut expired = 0;
+        for rounds in self.rounds.values_mut() {
+            let kept = rounds.split_off(&round);
+            for (_, ids) in std::mem::replace(rounds, kept) {
+                for id in ids {
+                    self.documents.remove(&id);
+                    expired += 1;
+                }
+            }
+        }
+        self.rounds.retain(|_, rounds| !rounds.is_empty());
+        expired
+    }
+
+    pub fn len(&self) -> usize {
+        self.documents.len()
+    }
+}
+
+/// Documents spread over shards by id, each with its own lock.
+///
+/// Publishing a document only blocks the readers of its shard, listing ids takes the read lock of
+/// every shard one after the other.
+#[derive(Debug)]
+pub struct ShardedDocumentStore {
+    shards: Box<[RwLock<DocumentStore>]>,
+    expired_before: AtomicU64,
+}
+
+impl ShardedDocumentStore {
+    pub fn new(shards: usize) -> Self {
+        assert!(shards >= 1);
+        Self {
+            shards: (0..shards).map(|_| Default::default()).collect(),
+            expired_before: AtomicU64::new(0),
+        }
+    }
+
+    pub fn insert(&self, id: DocumentId, topic: &str, document: StoredDocument) -> bool {
+        self.shard(&id).write().unwrap().insert(id, topic, document)
+    }
+
+    pub fn contains(&self, id: &DocumentId) -> bool {
+        self.shard(id).read().unwrap().get(id).is_some()
+    }
+
+    /// Documents with the given ids, unknown ids are skipped.
+    pub fn get_many(&self, ids: &[DocumentId]) -> Vec<StoredDocument> {
+        ids.iter()
+            .filter_map(|id| self.shard(id).read().unwrap().get(id).cloned())
+            .collect()
+    }
+
+    /// Ids of the documents of `topic` published in `since_round` or later, in no particular
+    /// order.
+    pub fn ids_since(&self, topic: &str, since_round: u64) -> Vec<DocumentId> {
+        let mut ids = Vec::new();
+        for shard in self.shards.iter() {
+            ids.extend(shard.read().unwrap().ids_since(topic, since_round).cloned());
+        }
+        ids
+    }
+
+    /// See `DocumentStore::expire_before`, shards are only locked when `round` is newer than the
+    /// previous expiry.
+    pub fn expire_before(&self, round: u64) -> usize {
+        if self.expired_before.fetch_max(round, Ordering::Relaxed) >= round {
+            return 0;
+        }
+        self.shards
+            .iter()
+            .map(|shard| shard.write().unwrap().expire_before(round))
+            .sum()
+    }
+
+    pub fn len(&self) -> usize {
+        self.shards
+            .iter()
+            .map(|shard| shard.read().unwrap().len())
+            .sum()
+    }
+
+    fn shard(&self, id: &DocumentId) -> &RwLock<DocumentStore> {
+        // the content hash is already uniformly distributed
+        let hash = u64::from_le_bytes(id.content_hash.as_bytes()[..8].try_into().unwrap());
+        &self.shards[(hash ^ id.round) as usize % self.shards.len()]
+    }
+}
+
+#[cfg(test)]
+mod test {
+    use crate::{
+        document::{Document, DocumentContent, DocumentDrand},
+        protocol::{self, DocumentList, Message, Signed},
+    };
+
+    use super::*;
+
+    fn signed_document(
+        key: &crypto::PrivateKey,
+        topic: &str,
+        round: u64,
+        i: u32,
+    ) -> SignedDocument {
+        let data = i.to_le_bytes();
+        let document = Document {
+            id: DocumentId {
+                round,
+                content_hash: crypto::sha256(&data),
+                public_key_hash: crypto::sha256(b"key"),
+            },
+            topic: topic.to_string(),
+            content: DocumentContent::Plaintext(data.to_vec()),
+            crypto_difficulty: 0,
+            nonce_solution: 0,
+            drand: DocumentDrand {
+                chain: Default::default(),
+                beacon: drand::Beacon {
+                    round_number: round,
+                    randomness: Default::default(),
+                    signature: Default::default(),
+                    previous_signature: Default::default(),
+                },
+                scheme: drand::SchemeId::UnchainedOnG1,
+            },
+        };
+        Signed::sign(key, document)
+    }
+
+    fn insert(
+        store: &mut DocumentStore,
+        key: &crypto::PrivateKey,
+        topic: &str,
+        round: u64,
+        i: u32,
+    ) -> bool {
+        let document = signed_document(key, topic, round, i);
+        let id = document.content.id.clone();
+        store.insert(id, topic, StoredDocument::new(&document))
+    }
+
+    #[test]
+    fn ids_since_round() {
+        let (_, key) = crypto::generate();
+        let mut store = DocumentStore::default();
+        for round in 0..10 {
+            assert!(insert(&mut store, &key, "a", round, round as u32));
+            assert!(insert(&mut store, &key, "b", round, 100 + round as u32));
+        }
+        assert!(!insert(&mut store, &key, "a", 3, 3));
+        assert_eq!(store.len(), 20);
+
+        let rounds = store
+            .ids_since("a", 7)
+            .map(|id| id.round)
+            .collect::<Vec<_>>();
+        assert_eq!(rounds, vec![7, 8, 9]);
+        assert_eq!(store.ids_since("b", 0).count(), 10);
+        assert_eq!(store.ids_since("c", 0).count(), 0);
+    }
+
+    #[test]
+    fn ids_since_skips_older_rounds_of_topic() {
+        let (_, key) = crypto::generate();
+        let mut store = DocumentStore::default();
+        for i in 0..1000 {
+            assert!(insert(&mut store, &key, "a", i as u64 % 10, i));
+        }
+        let new_ids = (1000..1003)
+            .map(|i| {
+                assert!(insert(&mut store, &key, "a", 10, i));
+                signed_document(&key, "a", 10, i).content.id
+            })
+            .collect::<std::collections::HashSet<_>>();
+
+        let ids = store
+            .ids_since("a", 10)
+            .cloned()
+            .collect::<std::collections::HashSet<_>>();
+        assert_eq!(ids, new_ids);
+        assert_eq!(store.ids_since("a", 0).count(), 1003);
+    }
+
+    #[test]
+    fn expire_rounds() {
+        let (_, key) = crypto::generate();
+        let mut store = DocumentStore::default();
+        assert!(insert(&mut store, &key, "a", 1, 1));
+        assert!(insert(&mut store, &key, "a", 5, 5));
+        let old_id = signed_document(&key, "a", 1, 1).content.id;
+
+        assert_eq!(store.expire_before(3), 1);
+        assert_eq!(store.expire_before(2), 0);
+        assert!(store.get(&old_id).is_none());
+        assert!(!insert(&mut store, &key, "a", 2, 2));
+        assert_eq!(store.ids_since("a", 0).count(), 1);
+    }
+
+    #[test]
+    fn sharded_store() {
+        let (_, key) = crypto::generate();
+        let store = ShardedDocumentStore::new(4);
+        let documents = (0..32)
+            .map(|i| signed_document(&key, "a", i / 4, i as u32))
+            .collect::<Vec<_>>();
+        for document in documents.iter() {
+            let id = document.content.id.clone();
+            assert!(store.insert(id, "a", StoredDocument::new(document)));
+        }
+        assert_eq!(store.len(), 32);
+        assert_eq!(store.ids_since("a", 6).len(), 8);
+
+        let ids = documents
+            .iter()
+            .map(|d| d.content.id.clone())
+            .collect::<Vec<_>>();
+        assert_eq!(store.get_many(&ids).len(), 32);
+        assert_eq!(store.expire_before(2), 8);
+        assert_eq!(store.expire_before(2), 0);
+        assert_eq!(store.get_many(&ids).len(), 24);
+    }
+
+    #[test]
+    fn serialized_document_list() {
+        let (_, key) = crypto::generate();
+        let documents = (0..3)
+            .map(|i| signed_document(&key, "a", i, i as u32))
+            .collect::<Vec<_>>();
+        let stored = documents
+            .iter()
+            .map(StoredDocument::new)
+            .collect::<Vec<_>>();
+
+        let digests = stored.iter().map(|d| d.digest);
+        let signature = protocol::Signature::Asymmetric {
+            key: key.public_key(),
+            signature: crypto::sign(&key, &protocol::document_list_signature_data(digests)),
+        };
+        let signed = Signed::new(Message::DocumentList(DocumentList { documents }), signature);
+
+        let mut serialized = protocol::document_list_header(stored.len()).to_vec();
+        for document in stored.iter() {
+            serialized.extend_from_slice(&document.serialized);
+        }
+        serialized.extend_from_slice(&bincode::serialize(&signed.signature).unwrap());
+        assert_eq!(serialized, bincode::serialize(&signed).unwrap());
+        assert!(bincode::deserialize::<Signed<Message>>(&serialized)
+            .unwrap()
+            .verify());
+    }
+}
@@ -1,5 +1,6 @@
-use crypto::Sha256Hasher;
+use crypto::{Sha256, Sha256Hasher};
 use drand::Beacon;
+use rayon::iter::{IntoParallelIterator, ParallelIterator as _};
 
 #[macro_use]
 pub mod protocol;
@@ -9,11 +10,13 @@ pub mod client;
 pub mod deaddrop;
 mod deaddrop_conn;
 mod document;
+mod document_log;
+mod document_store;
 mod rle;
 pub mod stats;
 
-pub(crate) use deaddrop_conn::DeaddropConn;
 pub use deaddrop_conn::{DeaddropAddr, InvalidDeaddropAddr};
+pub(crate) use deaddrop_conn::{DeaddropConn, DeaddropPool};
 
 #[derive(Debug)]
 pub struct InvalidModeOfOperation;
@@ -59,30 +62,30 @@ impl std::str::FromStr for ModeOfOperation {
     }
 }
 
+/// Nonces a thread tries one after the other before looking for more work
+const CRYPTO_PUZZLE_CHUNK: u32 = 4096;
+
 #[doc(hidden)]
 pub fn crypto_puzzle_solve(data: &[u8], beacon: &Beacon, difficulty: u8) -> u32 {
-    let mut nonce: u32 = 0;
-
-    loop {
-        let mut hasher = Sha256Hasher::default();
-        hasher.update(data);
-        hasher.update(&beacon.signature);
+    // the data and the beacon are only hashed once, each nonce then hashes its own bytes
+    let mut prefix = Sha256Hasher::default();
+    prefix.update(data);
+    prefix.update(&beacon.signature);
+    let solves = |nonce: u32| {
+        let mut hasher = prefix.clone();
         hasher.update(&nonce.to_le_bytes());
-        let result = hasher.finalize();
-        let mut counter = difficulty;
-        for byte in result.as_bytes() {
-            if counter == 0 {
-                return nonce;
-            }
-            let to_verify = 8.min(counter);
-            counter -= to_verify;
-            let compare = 0b11111111 >> (8 - to_verify);
-            if byte & compare != 0 {
-                break;
-            }
-        }
-        nonce += 1;
-    }
+        crypto_puzzle_solved(&hasher.finalize(), difficulty)
+    };
+
+    // idle threads steal chunks, the first chunk with a solution wins so the solution is the
+    // smallest nonce, as when trying them one after the other
+    (0..=u32::MAX / CRYPTO_PUZZLE_CHUNK)
+        .into_par_iter()
+        .find_map_first(|chunk| {
+            let start = chunk * CRYPTO_PUZZLE_CHUNK;
+            (start..=start + (CRYPTO_PUZZLE_CHUNK - 1)).find(|&nonce| solves(nonce))
+        })
+        .expect("a nonce should solve the puzzle")
 }
 
 #[doc(hidden)]
@@ -91,9 +94,13 @@ pub fn crypto_puzzle_verify(data: &[u8], beacon: &Beacon, difficulty: u8, soluti
     hasher.update(data);
     hasher.update(&beacon.signature);
     hasher.update(&solution.to_le_bytes());
-    let result = hasher.finalize();
+    crypto_puzzle_solved(&hasher.finalize(), difficulty)
+}
+
+/// Whether the first `difficulty` bits of the hash are zero
+fn crypto_puzzle_solved(hash: &Sha256, difficulty: u8) -> bool {
     let mut counter = difficulty;
-    for byte in result.as_bytes() {
+    for byte in hash.as_bytes() {
         if counter == 0 {
             return true;
         }
@@ -1,4 +1,4 @@
-use crypto::{PrivateKey, PublicKey, Ring, RingPrivateKey, RingPublicKey};
+use crypto::{PreparedRing, PrivateKey, PublicKey, RingPrivateKey, RingPublicKey, Sha256};
 use serde::{Deserialize, Serialize};
 
 use crate::document::{DocumentId, SignedDocument};
@@ -51,9 +51,9 @@ impl<T: Signable> Signed<T> {
         }
     }
 
-    pub fn ring_sign(key: &RingPrivateKey, ring: &Ring, content: T) -> Self {
+    pub fn ring_sign(key: &RingPrivateKey, ring: &PreparedRing, content: T) -> Self {
         let serialized = content.serialize_for_signature();
-        let signature = crypto::ring_sign(key, ring, &serialized);
+        let signature = ring.sign(key, &serialized);
         Self {
             content,
             signature: Signature::RingAsymmetric { signature },
@@ -95,13 +95,13 @@ impl<T: Signable> Signed<T> {
         crypto::verify(key, &serialized, signature)
     }
 
-    pub fn ring_verify(&self, ring: &Ring) -> bool {
+    pub fn ring_verify(&self, ring: &PreparedRing) -> bool {
         let signature = match self.signature {
             Signature::RingAsymmetric { ref signature } => signature,
             _ => return false,
         };
         let serialized = self.content.serialize_for_signature();
-        crypto::ring_verify(ring, &serialized, signature)
+        ring.verify(&serialized, signature)
     }
 }
 
@@ -117,6 +117,22 @@ pub enum Message {
     RetrieveKeys,
 }
 
+impl Message {
+    /// Name of the message type, used in the traces
+    pub fn name(&self) -> &'static str {
+        match self {
+            Message::Success => "success",
+            Message::RetrieveDocumentIds(_) => "retrieve_document_ids",
+            Message::RetrieveDocuments(_) => "retrieve_documents",
+            Message::PublishDocument(_) => "publish_document",
+            Message::DocumentIdList(_) => "document_id_list",
+            Message::DocumentList(_) => "document_list",
+            Message::UpdateAllowedKeys(_) => "update_allowed_keys",
+            Message::RetrieveKeys => "retrieve_keys",
+        }
+    }
+}
+
 impl Signable for Message {
     fn serialize_for_signature(&self) -> Vec<u8> {
         match self {
@@ -162,7 +178,37 @@ impl_signable_serde!(DocumentIdList);
 pub struct DocumentList {
     pub documents: Vec<SignedDocument>,
 }
-impl_signable_serde!(DocumentList);
+
+// the signature covers the digest of each serialized document, so the deaddrop can sign the
+// documents it keeps serialized without encoding them again
+impl Signable for DocumentList {
+    fn serialize_for_signature(&self) -> Vec<u8> {
+        document_list_signature_data(
+            self.documents
+                .iter()
+                .map(|document| crypto::sha256(&bincode::serialize(document).unwrap())),
+        )
+    }
+}
+
+pub fn document_list_signature_data(digests: impl IntoIterator<Item = Sha256>) -> Vec<u8> {
+    let mut data = Vec::new();
+    for digest in digests {
+        data.extend_from_slice(digest.as_bytes());
+    }
+    data
+}
+
+/// Start of the bincode encoding of a `Signed<Message>` holding a `Message::DocumentList` of
+/// `count` documents. It is followed by the serialized documents and then by the signature.
+pub fn document_list_header(count: usize) -> [u8; 12] {
+    // bincode encodes enum variants as u32 and sequence lengths as u64, little endian
+    const DOCUMENT_LIST_VARIANT: u32 = 5;
+    let mut header = [0u8; 12];
+    header[..4].copy_from_slice(&DOCUMENT_LIST_VARIANT.to_le_bytes());
+    header[4..].copy_from_slice(&(count as u64).to_le_bytes());
+    header
+}
 
 #[derive(Debug, Clone, Serialize, Deserialize)]
 pub struct UpdateAllowedKeys {
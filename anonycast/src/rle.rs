@@ -1,70 +1,125 @@
-use std::io::{Read, Write};
+use std::io::{IoSlice, Read, Write};
 
 use serde::{de::DeserializeOwned, Serialize};
 use tokio::io::{AsyncRead, AsyncReadExt as _, AsyncWrite, AsyncWriteExt as _};
+use tracing::Instrument as _;
 
-// run length encoding
-pub fn write<W: Write>(mut stream: W, data: &[u8]) -> std::io::Result<()> {
-    let size = u32::to_be_bytes(data.len().try_into().unwrap());
-    stream.write_all(&size)?;
+// run length encoding, every frame starts with the length of its data and the id of the request
+// it belongs to, a response carries the id of its request so that a connection can have several
+// requests in flight that complete in any order
+const HEADER_SIZE: usize = 8;
+
+fn header(id: u32, len: usize) -> [u8; HEADER_SIZE] {
+    let mut header = [0u8; HEADER_SIZE];
+    header[..4].copy_from_slice(&u32::to_be_bytes(len.try_into().unwrap()));
+    header[4..].copy_from_slice(&id.to_be_bytes());
+    header
+}
+
+fn parse_header(header: [u8; HEADER_SIZE]) -> (u32, u32) {
+    let size = u32::from_be_bytes(header[..4].try_into().unwrap());
+    let id = u32::from_be_bytes(header[4..].try_into().unwrap());
+    (id, size)
+}
+
+pub fn write<W: Write>(mut stream: W, id: u32, data: &[u8]) -> std::io::Result<()> {
+    stream.write_all(&header(id, data.len()))?;
     stream.write_all(data)?;
     stream.flush()?;
-    tracing::debug!("wrote {} bytes", data.len());
+    tracing::debug!("wrote {} bytes for request {id}", data.len());
     Ok(())
 }
 
-pub async fn async_write<W: AsyncWrite + Unpin>(mut stream: W, data: &[u8]) -> std::io::Result<()> {
-    let size = u32::to_be_bytes(data.len().try_into().unwrap());
-    stream.write_all(&size).await?;
+pub async fn async_write<W: AsyncWrite + Unpin>(
+    mut stream: W,
+    id: u32,
+    data: &[u8],
+) -> std::io::Result<()> {
+    stream.write_all(&header(id, data.len())).await?;
     stream.write_all(data).await?;
     stream.flush().await?;
-    tracing::debug!("wrote {} bytes", data.len());
+    tracing::debug!("wrote {} bytes for request {id}", data.len());
+    Ok(())
+}
+
+/// Write a message made of several buffers with vectored writes, without copying them into a
+/// single buffer first.
+pub async fn async_write_vectored<W: AsyncWrite + Unpin>(
+    mut stream: W,
+    id: u32,
+    parts: &[&[u8]],
+) -> std::io::Result<()> {
+    let len = parts.iter().map(|part| part.len()).sum::<usize>();
+    let header = header(id, len);
+    let mut slices = Vec::with_capacity(parts.len() + 1);
+    slices.push(IoSlice::new(&header));
+    slices.extend(parts.iter().map(|part| IoSlice::new(part)));
+
+    let mut slices = slices.as_mut_slice();
+    while !slices.is_empty() {
+        let written = stream.write_vectored(slices).await?;
+        if written == 0 {
+            return Err(std::io::ErrorKind::WriteZero.into());
+        }
+        IoSlice::advance_slices(&mut slices, written);
+    }
+    stream.flush().await?;
+    tracing::debug!("wrote {} bytes for request {id}", len);
     Ok(())
 }
 
-pub fn read<R: Read>(mut stream: R) -> std::io::Result<Vec<u8>> {
-    let mut size = [0u8; 4];
-    stream.read_exact(&mut size)?;
-    let size = u32::from_be_bytes(size);
+pub fn read<R: Read>(mut stream: R) -> std::io::Result<(u32, Vec<u8>)> {
+    let mut header = [0u8; HEADER_SIZE];
+    stream.read_exact(&mut header)?;
+    let (id, size) = parse_header(header);
     let mut data = vec![0u8; size as usize];
     stream.read_exact(&mut data)?;
-    tracing::debug!("read {size} bytes");
-    Ok(data)
+    tracing::debug!("read {size} bytes for request {id}");
+    Ok((id, data))
 }
 
-pub async fn async_read<R: AsyncRead + Unpin>(mut stream: R) -> std::io::Result<Vec<u8>> {
-    let mut size = [0u8; 4];
-    stream.read_exact(&mut size).await?;
-    let size = u32::from_be_bytes(size);
+pub async fn async_read<R: AsyncRead + Unpin>(mut stream: R) -> std::io::Result<(u32, Vec<u8>)> {
+    let mut header = [0u8; HEADER_SIZE];
+    stream.read_exact(&mut header).await?;
+    let (id, size) = parse_header(header);
     let mut data = vec![0u8; size as usize];
-    stream.read_exact(&mut data).await?;
-    tracing::debug!("read {size} bytes");
-    Ok(data)
+    // from the header on, waiting for the next frame is not traced
+    stream
+        .read_exact(&mut data)
+        .instrument(tracing::debug_span!("read_frame", size))
+        .await?;
+    tracing::debug!("read {size} bytes for request {id}");
+    Ok((id, data))
 }
 
-pub fn serialize_and_write<T: Serialize, W: Write>(stream: W, data: &T) -> std::io::Result<()> {
+pub fn serialize_and_write<T: Serialize, W: Write>(
+    stream: W,
+    id: u32,
+    data: &T,
+) -> std::io::Result<()> {
     let serialized = bincode::serialize(data).unwrap();
-    write(stream, &serialized)
+    write(stream, id, &serialized)
 }
 
 #[tracing::instrument(skip_all)]
 pub async fn async_serialize_and_write<T: Serialize, W: AsyncWrite + Unpin>(
     stream: W,
+    id: u32,
     data: &T,
 ) -> std::io::Result<()> {
     let serialized = bincode::serialize(data).unwrap();
-    async_write(stream, &serialized).await
+    async_write(stream, id, &serialized).await
 }
 
-pub fn deserialize_and_read<T: DeserializeOwned, R: Read>(stream: R) -> std::io::Result<T> {
-    let data = read(stream)?;
-    Ok(bincode::deserialize::<T>(&data).unwrap())
+pub fn deserialize_and_read<T: DeserializeOwned, R: Read>(stream: R) -> std::io::Result<(u32, T)> {
+    let (id, data) = read(stream)?;
+    Ok((id, bincode::deserialize::<T>(&data).unwrap()))
 }
 
-#[tracing::instrument(skip_all)]
 pub async fn async_deserialize_and_read<T: DeserializeOwned, R: AsyncRead + Unpin>(
     stream: R,
-) -> std::io::Result<T> {
-    let data = async_read(stream).await?;
-    Ok(bincode::deserialize::<T>(&data).unwrap())
+) -> std::io::Result<(u32, T)> {
+    let (id, data) = async_read(stream).await?;
+    let _span = tracing::debug_span!("deserialize", size = data.len()).entered();
+    Ok((id, bincode::deserialize::<T>(&data).unwrap()))
 }
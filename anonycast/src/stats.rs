@@ -1,17 +1,32 @@
 use std::io::Write;
 use std::{
-    collections::HashMap,
-    fs::OpenOptions,
-    ops::DerefMut,
-    sync::{Mutex, OnceLock},
-    time::{Duration, Instant},
+    fs::{File, OpenOptions},
+    path::Path,
+    sync::{
+        atomic::{AtomicBool, AtomicU64, Ordering},
+        Arc, Mutex,
+    },
+    thread::JoinHandle,
+    time::{Duration, Instant, SystemTime, UNIX_EPOCH},
 };
 
-static STATS: OnceLock<Mutex<Stats>> = OnceLock::new();
+/// Every value is stored in one of 2^SUB_BUCKET_BITS linear buckets of its power of two,
+/// the relative error of a recorded duration is below 2^-SUB_BUCKET_BITS.
+pub const SUB_BUCKET_BITS: u32 = 4;
+const SUB_BUCKETS: u64 = 1 << SUB_BUCKET_BITS;
+/// Number of buckets needed to hold any u64 nanoseconds value.
+pub const BUCKETS: usize = ((64 - SUB_BUCKET_BITS + 1) as usize) << SUB_BUCKET_BITS;
 
-#[derive(Debug, Default)]
-struct Stats {
-    operations: HashMap<String, Vec<Duration>>,
+/// Shards of the threads that recorded a value, they are never removed so the values
+/// recorded by threads that exited are kept.
+static SHARDS: Mutex<Vec<Arc<Shard>>> = Mutex::new(Vec::new());
+
+thread_local! {
+    static SHARD: Arc<Shard> = {
+        let shard = Arc::new(Shard::new());
+        SHARDS.lock().unwrap().push(shard.clone());
+        shard
+    };
 }
 
 #[derive(Debug, Clone, Copy, PartialEq, Eq, Hash)]
@@ -21,6 +36,18 @@ pub enum Operation {
     BuildCircuits,
 }
 
+impl Operation {
+    pub const ALL: [Operation; 3] = [
+        Operation::Send,
+        Operation::Retrieve,
+        Operation::BuildCircuits,
+    ];
+
+    fn index(self) -> usize {
+        self as usize
+    }
+}
+
 impl std::fmt::Display for Operation {
     fn fmt(&self, f: &mut std::fmt::Formatter<'_>) -> std::fmt::Result {
         f.write_str(match self {
@@ -31,15 +58,196 @@ impl std::fmt::Display for Operation {
     }
 }
 
-pub fn log(operation: impl std::fmt::Display, dur: Duration) {
-    get_stats()
-        .operations
-        .entry(operation.to_string())
-        .or_default()
-        .push(dur);
+/// Fixed size log-linear histogram of nanoseconds, only written by the thread owning it.
+#[derive(Debug)]
+struct Histogram {
+    buckets: Box<[AtomicU64]>,
+    count: AtomicU64,
+    sum: AtomicU64,
+    min: AtomicU64,
+    max: AtomicU64,
+}
+
+impl Histogram {
+    fn new() -> Self {
+        Self {
+            buckets: (0..BUCKETS).map(|_| AtomicU64::new(0)).collect(),
+            count: AtomicU64::new(0),
+            sum: AtomicU64::new(0),
+            min: AtomicU64::new(u64::MAX),
+            max: AtomicU64::new(0),
+        }
+    }
+
+    fn record(&self, nanos: u64) {
+        self.buckets[bucket_index(nanos)].fetch_add(1, Ordering::Relaxed);
+        self.count.fetch_add(1, Ordering::Relaxed);
+        self.sum.fetch_add(nanos, Ordering::Relaxed);
+        self.min.fetch_min(nanos, Ordering::Relaxed);
+        self.max.fetch_max(nanos, Ordering::Relaxed);
+    }
+}
+
+#[derive(Debug)]
+struct Shard {
+    histograms: [Histogram; Operation::ALL.len()],
+}
+
+impl Shard {
+    fn new() -> Self {
+        Self {
+            histograms: std::array::from_fn(|_| Histogram::new()),
+        }
+    }
+}
+
+fn bucket_index(nanos: u64) -> usize {
+    if nanos < SUB_BUCKETS {
+        return nanos as usize;
+    }
+    let exponent = 63 - nanos.leading_zeros();
+    let sub = (nanos >> (exponent - SUB_BUCKET_BITS)) & (SUB_BUCKETS - 1);
+    (((exponent - SUB_BUCKET_BITS + 1) as usize) << SUB_BUCKET_BITS) | sub as usize
+}
+
+/// Smallest value and width of a bucket, in nanoseconds.
+fn bucket_bounds(index: usize) -> (u64, u64) {
+    let bucket = (index >> SUB_BUCKET_BITS) as u32;
+    let sub = index as u64 & (SUB_BUCKETS - 1);
+    if bucket == 0 {
+        (sub, 1)
+    } else {
+        ((SUB_BUCKETS + sub) << (bucket - 1), 1 << (bucket - 1))
+    }
+}
+
+/// Merged values of an operation from every thread.
+#[derive(Debug, Clone)]
+pub struct HistogramSnapshot {
+    buckets: Vec<u64>,
+    count: u64,
+    sum: u64,
+    min: u64,
+    max: u64,
+}
+
+impl Default for HistogramSnapshot {
+    fn default() -> Self {
+        Self {
+            buckets: vec![0; BUCKETS],
+            count: 0,
+            sum: 0,
+            min: u64::MAX,
+            max: 0,
+        }
+    }
+}
+
+impl HistogramSnapshot {
+    fn add(&mut self, histogram: &Histogram) {
+        for (total, bucket) in self.buckets.iter_mut().zip(histogram.buckets.iter()) {
+            *total += bucket.load(Ordering::Relaxed);
+        }
+        self.count += histogram.count.load(Ordering::Relaxed);
+        self.sum += histogram.sum.load(Ordering::Relaxed);
+        self.min = self.min.min(histogram.min.load(Ordering::Relaxed));
+        self.max = self.max.max(histogram.max.load(Ordering::Relaxed));
+    }
+
+    pub fn count(&self) -> u64 {
+        self.count
+    }
+
+    pub fn min(&self) -> Duration {
+        Duration::from_nanos(if self.count == 0 { 0 } else { self.min })
+    }
+
+    pub fn max(&self) -> Duration {
+        Duration::from_nanos(self.max)
+    }
+
+    pub fn mean(&self) -> Duration {
+        Duration::from_nanos(self.sum.checked_div(self.count).unwrap_or_default())
+    }
+
+    /// Midpoint of the bucket holding the `q` quantile, clamped to the recorded range.
+    pub fn quantile(&self, q: f64) -> Duration {
+        if self.count == 0 {
+            return Duration::ZERO;
+        }
+        let rank = ((q * self.count as f64).ceil() as u64).max(1);
+        let mut seen = 0;
+        for (index, count) in self.buckets.iter().enumerate() {
+            seen += count;
+            if seen >= rank {
+                let (low, width) = bucket_bounds(index);
+                let mid = low + width / 2;
+                return Duration::from_nanos(mid.max(self.min).min(self.max));
+            }
+        }
+        self.max()
+    }
+
+    /// Values recorded since `previous`, min and max are not per interval.
+    fn since(&self, previous: &HistogramSnapshot) -> HistogramSnapshot {
+        HistogramSnapshot {
+            buckets: self
+                .buckets
+                .iter()
+                .zip(previous.buckets.iter())
+                .map(|(a, b)| a - b)
+                .collect(),
+            count: self.count - previous.count,
+            sum: self.sum - previous.sum,
+            min: self.min,
+            max: self.max,
+        }
+    }
+
+    fn to_json(&self) -> serde_json::Value {
+        let buckets = self
+            .buckets
+            .iter()
+            .enumerate()
+            .filter(|(_, count)| **count > 0)
+            .map(|(index, count)| [index as u64, *count])
+            .collect::<Vec<_>>();
+        serde_json::json!({
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": buckets,
+        })
+    }
+}
+
+#[derive(Debug, Clone, Default)]
+pub struct Snapshot {
+    histograms: [HistogramSnapshot; Operation::ALL.len()],
+}
+
+impl Snapshot {
+    pub fn operation(&self, operation: Operation) -> &HistogramSnapshot {
+        &self.histograms[operation.index()]
+    }
+}
+
+/// Merge the histograms of every thread.
+pub fn snapshot() -> Snapshot {
+    let mut snapshot = Snapshot::default();
+    for shard in SHARDS.lock().unwrap().iter() {
+        for (total, histogram) in snapshot.histograms.iter_mut().zip(&shard.histograms) {
+            total.add(histogram);
+        }
+    }
+    snapshot
+}
+
+pub fn log(operation: Operation, dur: Duration) {
+    let nanos = u64::try_from(dur.as_nanos()).unwrap_or(u64::MAX);
+    SHARD.with(|shard| shard.histograms[operation.index()].record(nanos));
 }
 
-pub fn log_with<R>(operation: impl std::fmt::Display, f: impl FnOnce() -> R) -> R {
+pub fn log_with<R>(operation: Operation, f: impl FnOnce() -> R) -> R {
     let start = Instant::now();
     let value = f();
     let dur = start.elapsed();
@@ -48,51 +256,173 @@ pub fn log_with<R>(operation: impl std::fmt::Display, f: impl FnOnce() -> R) ->
 }
 
 pub fn print() {
-    let stats = get_stats();
+    let stats = snapshot();
 
-    for (op, times) in stats.operations.iter() {
-        let min = times
-            .iter()
-            .min()
-            .copied()
-            .unwrap_or_default()
-            .as_secs_f64();
-        let max = times
-            .iter()
-            .max()
-            .copied()
-            .unwrap_or_default()
-            .as_secs_f64();
-        let avg = times.iter().copied().sum::<Duration>().as_secs_f64() / times.len() as f64;
+    for op in Operation::ALL {
+        let h = stats.operation(op);
+        if h.count() == 0 {
+            continue;
+        }
+        let min = h.min().as_secs_f64();
+        let avg = h.mean().as_secs_f64();
+        let max = h.max().as_secs_f64();
+        let p50 = h.quantile(0.5).as_secs_f64();
+        let p99 = h.quantile(0.99).as_secs_f64();
+        let p999 = h.quantile(0.999).as_secs_f64();
 
-        println!("{op} {min} {avg} {max}");
+        println!("{op} {min} {avg} {max} {p50} {p99} {p999}");
     }
 }
 
 pub fn print_to_file() {
     let path = std::env::current_dir().unwrap().join("test_logs.txt");
     let mut file = OpenOptions::new().append(true).open(&path).unwrap();
-    let stats = get_stats();
+    let stats = snapshot();
 
-    for (op, times) in stats.operations.iter() {
-        let min = times
-            .iter()
-            .min()
-            .copied()
-            .unwrap_or_default()
-            .as_secs_f64();
-        let max = times
-            .iter()
-            .max()
-            .copied()
+    for op in Operation::ALL {
+        let h = stats.operation(op);
+        if h.count() == 0 {
+            continue;
+        }
+        let min = h.min().as_secs_f64();
+        let avg = h.mean().as_secs_f64();
+        let max = h.max().as_secs_f64();
+        let p50 = h.quantile(0.5).as_secs_f64();
+        let p99 = h.quantile(0.99).as_secs_f64();
+
+        writeln!(
+            file,
+            "{op}: min = {min}, avg = {avg}, max = {max}, p50 = {p50}, p99 = {p99}"
+        )
+        .unwrap();
+    }
+}
+
+/// Writes the values recorded during each interval to a file, one json object per line.
+///
+/// The first line holds the bucket layout, every following line holds the count, sum and
+/// non empty buckets `[index, count]` of each operation recorded during the interval.
+/// A last line is written when the writer is dropped.
+pub struct SnapshotWriter {
+    stop: Arc<AtomicBool>,
+    handle: Option<JoinHandle<()>>,
+}
+
+impl SnapshotWriter {
+    pub fn spawn(path: &Path, interval: Duration) -> std::io::Result<Self> {
+        if let Some(parent) = path.parent() {
+            std::fs::create_dir_all(parent)?;
+        }
+        let mut file = File::create(path)?;
+        write_json_line(
+            &mut file,
+            &serde_json::json!({
+                "sub_bucket_bits": SUB_BUCKET_BITS,
+                "interval": interval.as_secs_f64(),
+            }),
+        )?;
+
+        let stop = Arc::new(AtomicBool::new(false));
+        let handle = std::thread::Builder::new()
+            .name("stats-snapshot".to_string())
+            .spawn({
+                let stop = stop.clone();
+                move || snapshot_loop(file, interval, &stop)
+            })?;
+
+        Ok(Self {
+            stop,
+            handle: Some(handle),
+        })
+    }
+}
+
+impl Drop for SnapshotWriter {
+    fn drop(&mut self) {
+        self.stop.store(true, Ordering::Release);
+        if let Some(handle) = self.handle.take() {
+            handle.thread().unpark();
+            let _ = handle.join();
+        }
+    }
+}
+
+fn snapshot_loop(mut file: File, interval: Duration, stop: &AtomicBool) {
+    let start = Instant::now();
+    let mut deadline = start + interval;
+    let mut previous = snapshot();
+    loop {
+        loop {
+            let now = Instant::now();
+            if stop.load(Ordering::Acquire) || now >= deadline {
+                break;
+            }
+            std::thread::park_timeout(deadline - now);
+        }
+        let stopping = stop.load(Ordering::Acquire);
+
+        let current = snapshot();
+        let mut operations = serde_json::Map::new();
+        for op in Operation::ALL {
+            let delta = current.operation(op).since(previous.operation(op));
+            if delta.count() > 0 {
+                operations.insert(op.to_string(), delta.to_json());
+            }
+        }
+        let timestamp = SystemTime::now()
+            .duration_since(UNIX_EPOCH)
             .unwrap_or_default()
             .as_secs_f64();
-        let avg = times.iter().copied().sum::<Duration>().as_secs_f64() / times.len() as f64;
+        let line = serde_json::json!({
+            "timestamp": timestamp,
+            "elapsed": start.elapsed().as_secs_f64(),
+            "operations": operations,
+        });
+        if let Err(err) = write_json_line(&mut file, &line) {
+            tracing::warn!("failed to write stats snapshot: {err}");
+        }
+        previous = current;
 
-        writeln!(file, "{op}: min = {min}, avg = {avg}, max = {max}").unwrap();
+        if stopping {
+            break;
+        }
+        deadline += interval;
     }
 }
 
-fn get_stats() -> impl DerefMut<Target = Stats> {
-    STATS.get_or_init(Default::default).lock().unwrap()
+fn write_json_line(file: &mut File, value: &serde_json::Value) -> std::io::Result<()> {
+    let mut line = serde_json::to_vec(value)?;
+    line.push(b'\n');
+    file.write_all(&line)
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+
+    #[test]
+    fn bucket_bounds_contain_value() {
+        for nanos in (0..100_000).chain([u64::MAX / 3, u64::MAX - 1, u64::MAX]) {
+            let index = bucket_index(nanos);
+            assert!(index < BUCKETS);
+            let (low, width) = bucket_bounds(index);
+            assert!(low <= nanos && nanos - low < width, "{nanos} {low} {width}");
+        }
+    }
+
+    #[test]
+    fn quantiles_have_bounded_error() {
+        let mut histogram = HistogramSnapshot::default();
+        let shard = Shard::new();
+        for micros in 1..=1000 {
+            shard.histograms[0].record(micros * 1000);
+        }
+        histogram.add(&shard.histograms[0]);
+        assert_eq!(histogram.count(), 1000);
+        for (q, expected) in [(0.5, 500_000.0), (0.99, 990_000.0)] {
+            let value = histogram.quantile(q).as_nanos() as f64;
+            assert!((value - expected).abs() / expected < 1.0 / SUB_BUCKETS as f64);
+        }
+        assert_eq!(histogram.max(), Duration::from_millis(1));
+    }
 }
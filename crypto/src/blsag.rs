@@ -1,16 +1,23 @@
-use curve25519_dalek::{ristretto::CompressedRistretto, RistrettoPoint, Scalar};
+use std::collections::HashMap;
+
+use curve25519_dalek::{
+    constants::RISTRETTO_BASEPOINT_POINT,
+    ristretto::{CompressedRistretto, VartimeRistrettoPrecomputation},
+    traits::VartimePrecomputedMultiscalarMul,
+    RistrettoPoint, Scalar,
+};
 use nazgul::{
     blsag::BLSAG,
     traits::{Sign, Verify},
 };
 use rand::rngs::OsRng;
 use serde::{Deserialize, Deserializer, Serialize, Serializer};
-use sha2::Sha512;
+use sha2::{Digest, Sha512};
 
 // TODO: ???
 const SECRET_INDEX: usize = 1;
 
-#[derive(Debug, Default, Clone, Serialize, Deserialize)]
+#[derive(Debug, Default, Clone, PartialEq, Eq, Serialize, Deserialize)]
 pub struct Ring(Vec<RingPublicKey>);
 
 impl From<Vec<RingPublicKey>> for Ring {
@@ -254,6 +261,273 @@ pub fn ring_verify(ring: &Ring, data: &[u8], signature: &RingSignature) -> bool
     BLSAG::verify::<Sha512>(signature.0, &data)
 }
 
+/// A ring prepared for signing and verifying many messages, build it again when the ring changes.
+///
+/// `ring_sign` and `ring_verify` hash every member to a point and decompress it for every
+/// message, this keeps the hashes and precomputed multiplication tables of every member. Produces
+/// and accepts the same signatures as `ring_sign` and `ring_verify`.
+pub struct PreparedRing {
+    ring: Ring,
+    members: Vec<PreparedMember>,
+    /// `encode_points` of each member to its index in `members`
+    index: HashMap<[u8; 32], usize>,
+}
+
+impl PreparedRing {
+    pub fn new(ring: &Ring) -> Self {
+        let members = ring
+            .0
+            .iter()
+            .map(|pk| PreparedMember::new(pk.0))
+            .collect::<Vec<_>>();
+        let mut index = HashMap::with_capacity(members.len());
+        for (i, encoded) in encode_points(members.iter().map(|m| &m.key))
+            .into_iter()
+            .enumerate()
+        {
+            index.entry(encoded).or_insert(i);
+        }
+        Self {
+            ring: ring.clone(),
+            members,
+            index,
+        }
+    }
+
+    pub fn ring(&self) -> &Ring {
+        &self.ring
+    }
+
+    /// Same as `ring_sign` with this ring.
+    pub fn sign(&self, key: &RingPrivateKey, data: &[u8]) -> RingSignature {
+        let mut csprng = OsRng;
+        let signer_pk = key.public_key().0;
+        let signer_prepared;
+        let signer = match self.members.iter().find(|m| m.key == signer_pk) {
+            Some(signer) => signer,
+            None => {
+                signer_prepared = PreparedMember::new(signer_pk);
+                &signer_prepared
+            }
+        };
+
+        // same order as nazgul: the other members with the signer inserted at SECRET_INDEX
+        let mut members = self
+            .members
+            .iter()
+            .filter(|m| m.key != signer_pk)
+            .collect::<Vec<_>>();
+        members.insert(SECRET_INDEX, signer);
+        let n = members.len();
+
+        let key_image = key.0 * signer.key_hash;
+        let message_hash = Sha512::new_with_prefix(data);
+        let a = Scalar::random(&mut csprng);
+        let mut responses = (0..n)
+            .map(|_| Scalar::random(&mut csprng))
+            .collect::<Vec<_>>();
+        let mut challenges = vec![Scalar::ZERO; n];
+
+        // the secret nonce does not go through the variable time tables
+        challenges[(SECRET_INDEX + 1) % n] = challenge_hash(
+            &message_hash,
+            &RistrettoPoint::mul_base(&a).compress(),
+            &(a * signer.key_hash).compress(),
+        );
+        for step in 1..n {
+            let i = (SECRET_INDEX + step) % n;
+            challenges[(i + 1) % n] =
+                members[i].next_challenge(&message_hash, responses[i], challenges[i], &key_image);
+        }
+        responses[SECRET_INDEX] = a - challenges[SECRET_INDEX] * key.0;
+
+        RingSignature(BLSAG {
+            challenge: challenges[0],
+            responses,
+            ring: members.iter().map(|m| m.key).collect(),
+            key_image,
+        })
+    }
+
+    /// Same as `ring_verify` with this ring.
+    pub fn verify(&self, data: &[u8], signature: &RingSignature) -> bool {
+        self.verify_batch(&[(data, signature)])[0]
+    }
+
+    /// Verify signatures that must all be made with this ring, returns whether each one is valid.
+    ///
+    /// The members of all the signatures are looked up at once: points are compared by the
+    /// encoding of their double, which is computed for the whole batch with a single field
+    /// inversion. The signatures of this ring then all have as many steps, each step is taken for
+    /// the whole batch and its commitments are compressed together, with a single field inversion
+    /// instead of two per signature.
+    pub fn verify_batch(&self, items: &[(&[u8], &RingSignature)]) -> Vec<bool> {
+        let encoded = encode_points(items.iter().flat_map(|(_, sig)| sig.0.ring.iter()));
+        let mut offset = 0;
+        let mut batch = Vec::with_capacity(items.len());
+        for (i, &(_, signature)) in items.iter().enumerate() {
+            let len = signature.0.ring.len();
+            let members = self.members_of(&encoded[offset..offset + len]);
+            offset += len;
+            // an empty ring would accept any challenge
+            match members {
+                Some(members)
+                    if !members.is_empty() && signature.0.responses.len() == members.len() =>
+                {
+                    batch.push((i, members))
+                }
+                _ => {}
+            }
+        }
+
+        let message_hashes = batch
+            .iter()
+            .map(|&(i, _)| Sha512::new_with_prefix(items[i].0))
+            .collect::<Vec<_>>();
+        let mut challenges = batch
+            .iter()
+            .map(|&(i, _)| items[i].1 .0.challenge)
+            .collect::<Vec<_>>();
+        let mut halves = Vec::with_capacity(2 * batch.len());
+        for step in 0..self.members.len() {
+            halves.clear();
+            for ((i, members), challenge) in batch.iter().zip(challenges.iter()) {
+                let signature = &items[*i].1 .0;
+                halves.extend(members[step].half_commitments(
+                    signature.responses[step],
+                    *challenge,
+                    &signature.key_image,
+                ));
+            }
+            let commitments = RistrettoPoint::double_and_compress_batch(&halves);
+            for (j, challenge) in challenges.iter_mut().enumerate() {
+                *challenge = challenge_hash(
+                    &message_hashes[j],
+                    &commitments[2 * j],
+                    &commitments[2 * j + 1],
+                );
+            }
+        }
+
+        let mut valid = vec![false; items.len()];
+        for ((i, _), challenge) in batch.iter().zip(challenges) {
+            valid[*i] = challenge == items[*i].1 .0.challenge;
+        }
+        valid
+    }
+
+    /// Prepared members of a signature ring, None unless it has as many members as this ring and
+    /// contains all of them, like `ring_verify` checks.
+    fn members_of(&self, encoded: &[[u8; 32]]) -> Option<Vec<&PreparedMember>> {
+        if encoded.len() != self.members.len() {
+            return None;
+        }
+        let mut seen = vec![false; self.members.len()];
+        let mut distinct = 0;
+        let mut members = Vec::with_capacity(encoded.len());
+        for encoded in encoded {
+            let i = *self.index.get(encoded)?;
+            if !std::mem::replace(&mut seen[i], true) {
+                distinct += 1;
+            }
+            members.push(&self.members[i]);
+        }
+        (distinct == self.index.len()).then_some(members)
+    }
+}
+
+impl Default for PreparedRing {
+    fn default() -> Self {
+        Self::new(&Ring::default())
+    }
+}
+
+impl std::fmt::Debug for PreparedRing {
+    fn fmt(&self, f: &mut std::fmt::Formatter<'_>) -> std::fmt::Result {
+        f.debug_tuple("PreparedRing").field(&self.ring).finish()
+    }
+}
+
+struct PreparedMember {
+    key: RistrettoPoint,
+    /// Base of the key image of the member
+    key_hash: RistrettoPoint,
+    /// r·G + c·key
+    key_table: VartimeRistrettoPrecomputation,
+    /// r·key_hash + c·I, the key image I is the one of the signer
+    key_hash_table: VartimeRistrettoPrecomputation,
+}
+
+impl PreparedMember {
+    fn new(key: RistrettoPoint) -> Self {
+        let key_hash = RistrettoPoint::hash_from_bytes::<Sha512>(key.compress().as_bytes());
+        Self {
+            key,
+            key_hash,
+            key_table: VartimeRistrettoPrecomputation::new([RISTRETTO_BASEPOINT_POINT, key]),
+            key_hash_table: VartimeRistrettoPrecomputation::new([key_hash]),
+        }
+    }
+
+    /// Challenge of the next member from the response and challenge of this one, all of them
+    /// end up in the signature so variable time is fine.
+    fn next_challenge(
+        &self,
+        message_hash: &Sha512,
+        response: Scalar,
+        challenge: Scalar,
+        key_image: &RistrettoPoint,
+    ) -> Scalar {
+        let l = self
+            .key_table
+            .vartime_multiscalar_mul([response, challenge]);
+        let r =
+            self.key_hash_table
+                .vartime_mixed_multiscalar_mul([response], [challenge], [key_image]);
+        challenge_hash(message_hash, &l.compress(), &r.compress())
+    }
+
+    /// Halves of the commitments L and R of `next_challenge`, for `double_and_compress_batch`.
+    /// The scalars are halved rather than the points, it costs the same as L and R.
+    fn half_commitments(
+        &self,
+        response: Scalar,
+        challenge: Scalar,
+        key_image: &RistrettoPoint,
+    ) -> [RistrettoPoint; 2] {
+        let half = Scalar::from(2u64).invert();
+        let (response, challenge) = (response * half, challenge * half);
+        let l = self
+            .key_table
+            .vartime_multiscalar_mul([response, challenge]);
+        let r =
+            self.key_hash_table
+                .vartime_mixed_multiscalar_mul([response], [challenge], [key_image]);
+        [l, r]
+    }
+}
+
+/// H(m, L, R) from the hash state after the message, the message is only hashed once per
+/// signature.
+fn challenge_hash(
+    message_hash: &Sha512,
+    l: &CompressedRistretto,
+    r: &CompressedRistretto,
+) -> Scalar {
+    let mut hash = message_hash.clone();
+    hash.update(l.as_bytes());
+    hash.update(r.as_bytes());
+    Scalar::from_hash(hash)
+}
+
+/// Encodings of the doubles of the points, injective since the ristretto group has prime order.
+fn encode_points<'a>(points: impl IntoIterator<Item = &'a RistrettoPoint>) -> Vec<[u8; 32]> {
+    RistrettoPoint::double_and_compress_batch(points)
+        .into_iter()
+        .map(|p| p.to_bytes())
+        .collect()
+}
+
 #[cfg(test)]
 mod test {
     use super::*;
@@ -293,6 +567,59 @@ mod test {
         }
     }
 
+    #[test]
+    fn prepared_ring() {
+        let keys = (0..5).map(|_| ring_generate()).collect::<Vec<_>>();
+        let ring = Ring::from(keys[..4].iter().map(|(pk, _)| *pk).collect::<Vec<_>>());
+        let prepared = PreparedRing::new(&ring);
+
+        // the prepared ring and nazgul accept each other's signatures
+        for (_, key) in keys.iter().take(4) {
+            let sig = prepared.sign(key, DATA_0);
+            assert!(ring_verify(&ring, DATA_0, &sig));
+            assert!(!ring_verify(&ring, DATA_1, &sig));
+
+            let sig = ring_sign(key, &ring, DATA_0);
+            assert!(prepared.verify(DATA_0, &sig));
+            assert!(!prepared.verify(DATA_1, &sig));
+        }
+
+        // a signer outside of the ring signs with another ring
+        let sig = prepared.sign(&keys[4].1, DATA_0);
+        assert!(!ring_verify(&ring, DATA_0, &sig));
+        assert!(!prepared.verify(DATA_0, &sig));
+
+        assert!(!PreparedRing::default().verify(DATA_0, &sig));
+    }
+
+    #[test]
+    fn verify_batch() {
+        let keys = (0..4).map(|_| ring_generate()).collect::<Vec<_>>();
+        let ring = Ring::from(keys.iter().map(|(pk, _)| *pk).collect::<Vec<_>>());
+        let other_ring = Ring::from(keys[1..].iter().map(|(pk, _)| *pk).collect::<Vec<_>>());
+        let prepared = PreparedRing::new(&ring);
+
+        let signatures = [
+            ring_sign(&keys[0].1, &ring, DATA_0),
+            prepared.sign(&keys[1].1, DATA_1),
+            ring_sign(&keys[2].1, &ring, DATA_1),
+            ring_sign(&keys[1].1, &other_ring, DATA_0),
+        ];
+        let items = [
+            (DATA_0, &signatures[0]),
+            (DATA_1, &signatures[1]),
+            (DATA_0, &signatures[2]),
+            (DATA_0, &signatures[3]),
+        ];
+        let expected = items
+            .iter()
+            .map(|&(data, sig)| ring_verify(&ring, data, sig))
+            .collect::<Vec<_>>();
+        assert_eq!(expected, vec![true, true, false, false]);
+        assert_eq!(prepared.verify_batch(&items), expected);
+        assert!(prepared.verify_batch(&[]).is_empty());
+    }
+
     #[test]
     fn from_str() {
         let (pub0, priv0) = ring_generate();
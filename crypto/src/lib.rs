@@ -23,6 +23,32 @@ mod test {
         assert_eq!(&data[..], decrypted.as_slice());
     }
 
+    #[test]
+    fn test_verify_batch() {
+        let (pub0, priv0) = generate();
+        let (pub1, priv1) = generate();
+        let data = [&b"hello"[..], &b"world"[..], &b"again"[..]];
+        let sigs = [
+            sign(&priv0, data[0]),
+            sign(&priv1, data[1]),
+            sign(&priv0, data[2]),
+        ];
+        let items = [
+            (&pub0, data[0], &sigs[0]),
+            (&pub1, data[1], &sigs[1]),
+            (&pub0, data[2], &sigs[2]),
+        ];
+        assert!(verify_batch(&items));
+        assert!(verify_batch(&[]));
+
+        // a valid signature for another message or under another key fails the whole batch
+        let mut invalid = items;
+        invalid[2] = (&pub0, data[1], &sigs[2]);
+        assert!(!verify_batch(&invalid));
+        invalid[2] = (&pub1, data[2], &sigs[2]);
+        assert!(!verify_batch(&invalid));
+    }
+
     #[test]
     fn test_symmetric_encrypt_decrypt() {
         let key = symmetric_generate();
@@ -1,7 +1,9 @@
-use rsa::{Pkcs1v15Encrypt, Pkcs1v15Sign, RsaPrivateKey, RsaPublicKey};
+use rsa::{
+    traits::PublicKeyParts, BigUint, Pkcs1v15Encrypt, Pkcs1v15Sign, RsaPrivateKey, RsaPublicKey,
+};
 use serde::{Deserialize, Serialize};
 
-use crate::sha256;
+use crate::{sha256, Sha256};
 
 #[derive(Debug)]
 pub struct InvalidPrivateKey;
@@ -131,6 +133,52 @@ pub fn verify(key: &PublicKey, data: &[u8], sig: &Signature) -> bool {
         .is_ok()
 }
 
+/// Verify several signatures at once, true only if all of them are valid.
+///
+/// Signatures made with the same key are screened together: (s_1 ⋯ s_n)^e = m_1 ⋯ m_n mod N, where
+/// m_i is the padded digest of the i-th message, which takes one exponentiation per key instead of
+/// one per signature. Passing the screening proves that the owner of the key signed every message,
+/// not that every signature is valid on its own, so it should only be used for signatures that
+/// are not stored or forwarded. When it fails, the signatures have to be verified one by one to
+/// find the invalid ones.
+pub fn verify_batch(items: &[(&PublicKey, &[u8], &Signature)]) -> bool {
+    let mut keys: Vec<(&PublicKey, BigUint, BigUint)> = Vec::new();
+    for &(key, data, sig) in items {
+        let n = key.0.n();
+        let size = key.0.size();
+        if sig.0.len() != size {
+            return false;
+        }
+        let s = BigUint::from_bytes_be(&sig.0);
+        if &s >= n {
+            return false;
+        }
+        let m = BigUint::from_bytes_be(&pkcs1v15_unprefixed_padding(&sha256(data), size));
+
+        match keys.iter_mut().find(|(k, _, _)| *k == key) {
+            Some((_, signatures, messages)) => {
+                *signatures = (&*signatures * &s) % n;
+                *messages = (&*messages * &m) % n;
+            }
+            None => keys.push((key, s, m)),
+        }
+    }
+    keys.into_iter()
+        .all(|(key, signatures, messages)| signatures.modpow(key.0.e(), key.0.n()) == messages)
+}
+
+/// EMSA-PKCS1-v1_5 encoding without a digest info prefix, what `Pkcs1v15Sign::new_unprefixed`
+/// signs: 00 01 ff .. ff 00 digest
+fn pkcs1v15_unprefixed_padding(digest: &Sha256, size: usize) -> Vec<u8> {
+    let digest = digest.as_bytes();
+    let mut em = vec![0xff; size];
+    em[0] = 0x00;
+    em[1] = 0x01;
+    em[size - digest.len() - 1] = 0x00;
+    em[size - digest.len()..].copy_from_slice(digest);
+    em
+}
+
 pub fn encrypt(key: &PublicKey, data: &[u8]) -> Vec<u8> {
     let mut rng = rand::thread_rng();
     key.0.encrypt(&mut rng, Pkcs1v15Encrypt, data).unwrap()
@@ -1,8 +1,9 @@
 use std::{
     borrow::Cow,
-    collections::HashMap,
-    sync::Arc,
-    time::{Instant, SystemTime, UNIX_EPOCH},
+    collections::{HashMap, HashSet},
+    str::FromStr,
+    sync::{Arc, Mutex, OnceLock, Weak},
+    time::{Duration, SystemTime, UNIX_EPOCH},
 };
 
 use drand_client_rs::verify::{verify_on_g1, verify_on_g2};
@@ -10,7 +11,10 @@ use serde::{Deserialize, Serialize};
 use sha2::{Digest, Sha256};
 
 pub use drand_client_rs::verify::VerificationError;
-use tokio::sync::{Mutex, MutexGuard};
+
+mod local;
+
+pub use local::{LocalChain, Recording, LOCAL_CHAIN};
 
 pub const DEFAULT_API_URL: &'static str = "https://api.drand.sh";
 
@@ -23,6 +27,9 @@ pub enum SchemeId {
     PedersenBlsUnchained,
     UnchainedOnG1,
     UnchainedOnG1RFC9380,
+    /// Beacons of a chain synthesized by `LocalChain`, the signature is the sha256 of the public
+    /// key and the round. Only meant for benchmarks without network access.
+    LocalSha256,
 }
 
 impl From<drand_client_rs::verify::SchemeID> for SchemeId {
@@ -149,6 +156,13 @@ impl Beacon {
                 &self.signature,
                 DST_G1,
             ),
+            SchemeId::LocalSha256 => {
+                if self.signature == local::local_signature(public_key, self.round_number) {
+                    Ok(())
+                } else {
+                    Err(VerificationError::SignatureFailedVerification)
+                }
+            }
         }
     }
 
@@ -230,123 +244,339 @@ impl BasicClient {
         let beacon: drand_client_rs::verify::Beacon = response.json().await?;
         Ok(beacon.into())
     }
+
+    /// Record the last `rounds` beacons of a chain, to replay them with `LocalChain`
+    pub async fn record(&self, chain: &str, rounds: u64) -> Result<Recording, ClientError> {
+        let info = self.chain_info(chain).await?;
+        let latest = self.chain_latest_randomness(chain).await?;
+        let first = (latest.round_number + 1).saturating_sub(rounds).max(1);
+        let mut beacons = Vec::new();
+        for round in first..latest.round_number {
+            beacons.push(self.chain_randomness(chain, round).await?);
+        }
+        beacons.push(latest);
+        Ok(Recording {
+            chain: chain.to_string(),
+            info,
+            beacons,
+        })
+    }
 }
 
+/// Where the chain info and the beacons come from
 #[derive(Debug, Clone)]
-struct CacheBeaconEntry {
-    timestamp: Instant,
-    beacon: Beacon,
-    ttl: u64,
+pub enum Source {
+    /// The HTTP API of a drand network
+    Http(BasicClient),
+    /// A chain simulated in process, see `LocalChain`
+    Local(Arc<LocalChain>),
+}
+
+impl Default for Source {
+    fn default() -> Self {
+        Source::Http(BasicClient::new(DEFAULT_API_URL))
+    }
+}
+
+impl FromStr for Source {
+    type Err = ClientError;
+
+    /// `local` or `local:<period in seconds>` for a synthesized chain, `replay:<path>` or
+    /// `replay:<path>@<unix start time>` for a recording made with `BasicClient::record` replayed
+    /// from now or from the start time, anything else is the url of a drand HTTP API.
+    fn from_str(s: &str) -> Result<Self, Self::Err> {
+        if s == LOCAL_CHAIN {
+            return Ok(Source::Local(Arc::new(LocalChain::synthesized(3))));
+        }
+        if let Some(period) = s.strip_prefix("local:") {
+            let period = period.parse().map_err(|e| ClientError(Box::new(e)))?;
+            if period == 0 {
+                return Err(ClientError("the period must be at least one second".into()));
+            }
+            return Ok(Source::Local(Arc::new(LocalChain::synthesized(period))));
+        }
+        if let Some(replay) = s.strip_prefix("replay:") {
+            // processes that replay from the same start time agree on the round
+            let (path, start_time) = match replay.rsplit_once('@') {
+                Some((path, start)) => match start.parse() {
+                    Ok(start) => (path, start),
+                    Err(_) => (replay, local::unix_now()),
+                },
+                None => (replay, local::unix_now()),
+            };
+            return Ok(Source::Local(Arc::new(LocalChain::load(path, start_time)?)));
+        }
+        Ok(Source::Http(BasicClient::new(s.to_string())))
+    }
+}
+
+impl Source {
+    pub async fn chain_list(&self) -> Result<Vec<String>, ClientError> {
+        match self {
+            Source::Http(client) => client.chain_list().await,
+            Source::Local(local) => Ok(vec![local.name().to_string()]),
+        }
+    }
+
+    pub async fn chain_info(&self, chain: &str) -> Result<ChainInfo, ClientError> {
+        match self {
+            Source::Http(client) => client.chain_info(chain).await,
+            Source::Local(local) => local.chain_info(chain),
+        }
+    }
+
+    pub async fn chain_randomness(&self, chain: &str, round: u64) -> Result<Beacon, ClientError> {
+        match self {
+            Source::Http(client) => client.chain_randomness(chain, round).await,
+            Source::Local(local) => local.chain_randomness(chain, round),
+        }
+    }
+
+    pub async fn chain_latest_randomness(&self, chain: &str) -> Result<Beacon, ClientError> {
+        match self {
+            Source::Http(client) => client.chain_latest_randomness(chain).await,
+            Source::Local(local) => local.chain_latest_randomness(chain),
+        }
+    }
+}
+
+static DEFAULT_SOURCE: OnceLock<(Source, bool)> = OnceLock::new();
+
+/// Source and prefetch mode of the default `CachingClient` and of the free functions, the HTTP
+/// API at `DEFAULT_API_URL` without prefetching unless set. Can only be set once, before the first
+/// use.
+pub fn set_default_source(source: Source, prefetch: bool) -> Result<(), ClientError> {
+    DEFAULT_SOURCE
+        .set((source, prefetch))
+        .map_err(|_| ClientError("the default drand source is already set".into()))
+}
+
+pub fn default_source() -> &'static Source {
+    &DEFAULT_SOURCE.get_or_init(Default::default).0
 }
 
 #[derive(Debug, Clone)]
-struct CachedInfoEntry {
-    info: ChainInfo,
+struct CacheBeaconEntry {
+    beacon: Beacon,
+    /// Unix time at which the next round is published
+    next_round: u64,
+    period_seconds: u64,
 }
 
 #[derive(Debug, Default)]
 struct Cache {
     beacon: HashMap<String, CacheBeaconEntry>,
-    info: HashMap<String, CachedInfoEntry>,
+    info: HashMap<String, ChainInfo>,
+    /// Chains with a running prefetch task
+    prefetching: HashSet<String>,
 }
 
+/// Client that keeps the chain info and the latest beacon of each chain until the next round.
+///
+/// The cache lock is never held while fetching. Callers that miss the cache wait for a single fetch
+/// of the latest beacon instead of each making their own. With prefetching, a task fetches each
+/// round of a chain as soon as it is published, and until then the previous round is served for at
+/// most one period, so callers never wait on the network once the chain is cached.
 #[derive(Debug, Clone)]
 pub struct CachingClient {
-    client: BasicClient,
+    source: Source,
+    prefetch: bool,
     cache: Arc<Mutex<Cache>>,
+    fetch: Arc<tokio::sync::Mutex<()>>,
+}
+
+impl Default for CachingClient {
+    /// Client of the default source, see `set_default_source`
+    fn default() -> Self {
+        let (source, prefetch) = DEFAULT_SOURCE.get_or_init(Default::default);
+        Self::from_source(source.clone(), *prefetch)
+    }
 }
 
 impl CachingClient {
     pub fn new(base_url: impl Into<Cow<'static, str>>) -> Self {
+        Self::from_source(Source::Http(BasicClient::new(base_url)), false)
+    }
+
+    pub fn from_source(source: Source, prefetch: bool) -> Self {
         Self {
-            client: BasicClient::new(base_url),
+            source,
+            prefetch,
             cache: Default::default(),
+            fetch: Default::default(),
         }
     }
 
     pub async fn chain_list(&self) -> Result<Vec<String>, ClientError> {
-        self.client.chain_list().await
+        self.source.chain_list().await
     }
 
     pub async fn chain_info(&self, chain: &str) -> Result<ChainInfo, ClientError> {
-        let mut cache = self.cache.lock().await;
-        self.chain_info_lk(chain, &mut cache).await
+        if let Some(info) = self.cache.lock().unwrap().info.get(chain) {
+            return Ok(info.clone());
+        }
+        let info = self.source.chain_info(chain).await?;
+        self.cache
+            .lock()
+            .unwrap()
+            .info
+            .insert(chain.to_string(), info.clone());
+        Ok(info)
     }
 
     pub async fn chain_randomness(&self, chain: &str, round: u64) -> Result<Beacon, ClientError> {
-        self.client.chain_randomness(chain, round).await
+        self.source.chain_randomness(chain, round).await
     }
 
     pub async fn chain_latest_randomness(&self, chain: &str) -> Result<Beacon, ClientError> {
-        let mut cache = self.cache.lock().await;
-        if let Some(entry) = cache.beacon.get(chain) {
-            if entry.timestamp.elapsed().as_secs() > entry.ttl {
-                cache.beacon.remove(chain);
-            } else {
-                return Ok(entry.beacon.clone());
-            }
+        if let Source::Local(local) = &self.source {
+            // nothing to save by caching
+            return local.chain_latest_randomness(chain);
+        }
+        if let Some(beacon) = self.cached_beacon(chain) {
+            return Ok(beacon);
         }
 
-        let info = self.chain_info_lk(chain, &mut cache).await?;
-        let beacon = self.client.chain_latest_randomness(chain).await?;
-        let unix_now = SystemTime::now()
-            .duration_since(UNIX_EPOCH)
+        let _fetch = self.fetch.lock().await;
+        // fetched by another caller while this one waited
+        if let Some(beacon) = self.cached_beacon(chain) {
+            return Ok(beacon);
+        }
+        let info = self.chain_info(chain).await?;
+        let beacon = self.source.chain_latest_randomness(chain).await?;
+        store_beacon(&self.cache, chain, &info, beacon.clone());
+        if self.prefetch {
+            self.start_prefetch(chain, info);
+        }
+        Ok(beacon)
+    }
+
+    fn cached_beacon(&self, chain: &str) -> Option<Beacon> {
+        let cache = self.cache.lock().unwrap();
+        let entry = cache.beacon.get(chain)?;
+        let mut valid_until = entry.next_round;
+        if cache.prefetching.contains(chain) {
+            valid_until += entry.period_seconds;
+        }
+        (unix_now() < valid_until).then(|| entry.beacon.clone())
+    }
+
+    fn start_prefetch(&self, chain: &str, info: ChainInfo) {
+        if !self
+            .cache
+            .lock()
             .unwrap()
-            .as_secs();
-        let ttl = (unix_now - info.genesis_time) % info.period_seconds as u64;
-        cache.beacon.insert(
+            .prefetching
+            .insert(chain.to_string())
+        {
+            return;
+        }
+        tracing::debug!("prefetching the rounds of chain {chain}");
+        tokio::spawn(prefetch(
+            self.source.clone(),
+            Arc::downgrade(&self.cache),
             chain.to_string(),
-            CacheBeaconEntry {
-                timestamp: Instant::now(),
-                beacon: beacon.clone(),
-                ttl,
-            },
-        );
-        Ok(beacon)
+            info,
+        ));
     }
+}
 
-    async fn chain_info_lk(
-        &self,
-        chain: &str,
-        cache: &mut MutexGuard<'_, Cache>,
-    ) -> Result<ChainInfo, ClientError> {
-        if let Some(entry) = cache.info.get(chain) {
-            return Ok(entry.info.clone());
+/// Fetch each round of `chain` when it is published, until every client of the cache is dropped.
+async fn prefetch(source: Source, cache: Weak<Mutex<Cache>>, chain: String, info: ChainInfo) {
+    let period = info.period_seconds as u64;
+    loop {
+        let Some(next_round) = cache.upgrade().and_then(|cache| {
+            let cache = cache.lock().unwrap();
+            cache.beacon.get(&chain).map(|entry| entry.next_round)
+        }) else {
+            break;
+        };
+        let now = unix_now();
+        if next_round > now {
+            tokio::time::sleep(Duration::from_secs(next_round - now)).await;
         }
 
-        let info = self.client.chain_info(chain).await?;
-        let entry = CachedInfoEntry { info: info.clone() };
-        cache.info.insert(chain.to_string(), entry);
-        Ok(info)
+        // the round at `next_round` is only known up to the clock skew with the drand network,
+        // asking for the latest beacon also catches up after missed rounds
+        let mut delay = Duration::from_millis(100);
+        let beacon = loop {
+            match source.chain_latest_randomness(&chain).await {
+                Ok(beacon) if beacon.round_number * period + info.genesis_time > next_round => {
+                    break Some(beacon)
+                }
+                Ok(_) => {}
+                Err(e) => tracing::warn!("failed to prefetch a round of chain {chain}: {e}"),
+            }
+            if delay.as_secs() >= period {
+                break None;
+            }
+            tokio::time::sleep(delay).await;
+            delay *= 2;
+        };
+
+        let Some(cache) = cache.upgrade() else {
+            break;
+        };
+        match beacon {
+            Some(beacon) => store_beacon(&cache, &chain, &info, beacon),
+            None => {
+                // callers fetch the latest beacon again, which restarts prefetching
+                cache.lock().unwrap().prefetching.remove(&chain);
+                break;
+            }
+        }
     }
 }
 
+fn store_beacon(cache: &Mutex<Cache>, chain: &str, info: &ChainInfo, beacon: Beacon) {
+    let mut cache = cache.lock().unwrap();
+    if let Some(entry) = cache.beacon.get(chain) {
+        if entry.beacon.round_number >= beacon.round_number {
+            return;
+        }
+    }
+    // round 1 is published at genesis
+    let period_seconds = info.period_seconds as u64;
+    let next_round = info.genesis_time + beacon.round_number * period_seconds;
+    cache.beacon.insert(
+        chain.to_string(),
+        CacheBeaconEntry {
+            beacon,
+            next_round,
+            period_seconds,
+        },
+    );
+}
+
+fn unix_now() -> u64 {
+    SystemTime::now()
+        .duration_since(UNIX_EPOCH)
+        .unwrap()
+        .as_secs()
+}
+
 pub async fn chain_list() -> Result<Vec<String>, ClientError> {
-    BasicClient::new(DEFAULT_API_URL).chain_list().await
+    default_source().chain_list().await
 }
 
 pub async fn chain_info(chain: &str) -> Result<ChainInfo, ClientError> {
-    BasicClient::new(DEFAULT_API_URL).chain_info(chain).await
+    default_source().chain_info(chain).await
 }
 
 pub async fn chain_randomness(chain: &str, round: u64) -> Result<Beacon, ClientError> {
-    BasicClient::new(DEFAULT_API_URL)
-        .chain_randomness(chain, round)
-        .await
+    default_source().chain_randomness(chain, round).await
 }
 
 pub async fn chain_latest_randomness(chain: &str) -> Result<Beacon, ClientError> {
-    BasicClient::new(DEFAULT_API_URL)
-        .chain_latest_randomness(chain)
-        .await
+    default_source().chain_latest_randomness(chain).await
 }
 
 pub async fn get_beacon_from_first_chain() -> Result<Beacon, ClientError> {
-    let client = BasicClient::new(DEFAULT_API_URL);
-    let mut chains = client.chain_list().await?;
+    let source = default_source();
+    let mut chains = source.chain_list().await?;
     chains.sort();
     let chain = chains
         .first()
         .ok_or_else(|| ClientError("no chain".into()))?;
-    client.chain_latest_randomness(chain).await
+    source.chain_latest_randomness(chain).await
 }
@@ -0,0 +1,258 @@
+use std::{
+    path::Path,
+    time::{SystemTime, UNIX_EPOCH},
+};
+
+use serde::{Deserialize, Serialize};
+use sha2::{Digest, Sha256};
+
+use crate::{Beacon, ChainInfo, ChainInfoMetadata, ClientError, SchemeId};
+
+/// Name of the synthesized chain
+pub const LOCAL_CHAIN: &str = "local";
+
+/// Genesis of the synthesized chains, fixed so that every process agrees on the current round
+const LOCAL_GENESIS_TIME: u64 = 1_700_000_000;
+
+/// Consecutive beacons of a chain, see `BasicClient::record`
+#[derive(Debug, Clone, Serialize, Deserialize)]
+pub struct Recording {
+    pub chain: String,
+    pub info: ChainInfo,
+    pub beacons: Vec<Beacon>,
+}
+
+/// A drand chain simulated in process, for benchmarks without network access.
+///
+/// Rounds follow the period of the chain from a start time, so every process with the same chain
+/// and start agrees on the current round. Beacons are either replayed from a recording of a real
+/// chain, which keeps the cost of verifying them, or synthesized with the `SchemeId::LocalSha256`
+/// scheme.
+///
+/// A replayed chain starts at its first recorded round and has no latest beacon once the wall
+/// clock is past its last one. Its beacons are signed with their round so it cannot loop over
+/// them, rounds going back would make the deaddrop drop every new document as expired.
+#[derive(Debug)]
+pub struct LocalChain {
+    name: String,
+    info: ChainInfo,
+    /// Empty for a synthesized chain
+    recorded: Vec<Beacon>,
+    /// Unix time the first round is published at, the genesis time of a synthesized chain
+    start_time: u64,
+}
+
+impl LocalChain {
+    pub fn synthesized(period_seconds: u32) -> Self {
+        assert!(period_seconds > 0);
+        let public_key = Sha256::digest(b"anonycast local drand chain").to_vec();
+        let mut hasher = Sha256::default();
+        hasher.update(&public_key);
+        hasher.update(period_seconds.to_be_bytes());
+        Self {
+            name: LOCAL_CHAIN.to_string(),
+            info: ChainInfo {
+                scheme_id: SchemeId::LocalSha256,
+                public_key,
+                chain_hash: hasher.finalize().to_vec(),
+                group_hash: Default::default(),
+                genesis_time: LOCAL_GENESIS_TIME,
+                period_seconds,
+                metadata: ChainInfoMetadata {
+                    beacon_id: LOCAL_CHAIN.to_string(),
+                },
+            },
+            recorded: Default::default(),
+            start_time: LOCAL_GENESIS_TIME,
+        }
+    }
+
+    /// Replay a recording from `start_time`, the processes of a run must share it to agree on
+    /// the current round
+    pub fn replay(mut recording: Recording, start_time: u64) -> Result<Self, ClientError> {
+        recording.beacons.sort_by_key(|beacon| beacon.round_number);
+        if recording.beacons.is_empty() || recording.info.period_seconds == 0 {
+            return Err(ClientError("empty recording".into()));
+        }
+        Ok(Self {
+            name: recording.chain,
+            info: recording.info,
+            recorded: recording.beacons,
+            start_time,
+        })
+    }
+
+    pub fn load(path: impl AsRef<Path>, start_time: u64) -> Result<Self, ClientError> {
+        let file = std::fs::File::open(path).map_err(|e| ClientError(Box::new(e)))?;
+        let recording = serde_json::from_reader(std::io::BufReader::new(file))
+            .map_err(|e| ClientError(Box::new(e)))?;
+        Self::replay(recording, start_time)
+    }
+
+    pub fn name(&self) -> &str {
+        &self.name
+    }
+
+    pub fn info(&self) -> &ChainInfo {
+        &self.info
+    }
+
+    /// Round published at `unix_time`, the first round is published at the start time
+    pub fn round_at(&self, unix_time: u64) -> u64 {
+        let first = self
+            .recorded
+            .first()
+            .map_or(1, |beacon| beacon.round_number);
+        unix_time.saturating_sub(self.start_time) / self.info.period_seconds as u64 + first
+    }
+
+    /// Beacon of a round, a replayed chain only has the recorded rounds
+    pub fn beacon(&self, round: u64) -> Option<Beacon> {
+        if self.recorded.is_empty() {
+            return Some(Beacon {
+                round_number: round,
+                randomness: Sha256::digest(local_signature(&self.info.public_key, round)).to_vec(),
+                signature: local_signature(&self.info.public_key, round),
+                previous_signature: local_signature(&self.info.public_key, round.saturating_sub(1)),
+            });
+        }
+        let first = self.recorded[0].round_number;
+        let i = round.checked_sub(first)? as usize;
+        self.recorded
+            .get(i)
+            .filter(|beacon| beacon.round_number == round)
+            .cloned()
+    }
+
+    /// Beacon of the current round, None once a replayed chain is past its recording
+    pub fn latest(&self) -> Option<Beacon> {
+        self.latest_at(unix_now())
+    }
+
+    fn latest_at(&self, unix_time: u64) -> Option<Beacon> {
+        self.beacon(self.round_at(unix_time))
+    }
+
+    fn check_chain(&self, chain: &str) -> Result<(), ClientError> {
+        if chain != self.name {
+            return Err(ClientError(format!("unknown chain {chain}").into()));
+        }
+        Ok(())
+    }
+
+    pub fn chain_info(&self, chain: &str) -> Result<ChainInfo, ClientError> {
+        self.check_chain(chain)?;
+        Ok(self.info.clone())
+    }
+
+    pub fn chain_randomness(&self, chain: &str, round: u64) -> Result<Beacon, ClientError> {
+        self.check_chain(chain)?;
+        self.beacon(round)
+            .ok_or_else(|| ClientError(format!("round {round} was not recorded").into()))
+    }
+
+    pub fn chain_latest_randomness(&self, chain: &str) -> Result<Beacon, ClientError> {
+        self.check_chain(chain)?;
+        self.latest().ok_or_else(|| {
+            let last = self.recorded.last().map_or(0, |beacon| beacon.round_number);
+            ClientError(
+                format!(
+                    "the recording of chain {chain} ended at round {last}, record more rounds \
+                     with drand-record"
+                )
+                .into(),
+            )
+        })
+    }
+}
+
+pub(crate) fn unix_now() -> u64 {
+    SystemTime::now()
+        .duration_since(UNIX_EPOCH)
+        .unwrap()
+        .as_secs()
+}
+
+/// Signature of a round of a synthesized chain, empty before the first round
+pub(crate) fn local_signature(public_key: &[u8], round: u64) -> Vec<u8> {
+    if round == 0 {
+        return Default::default();
+    }
+    let mut hasher = Sha256::default();
+    hasher.update(public_key);
+    hasher.update(round.to_be_bytes());
+    hasher.finalize().to_vec()
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+
+    #[test]
+    fn synthesized_beacons() {
+        let chain = LocalChain::synthesized(3);
+        let info = chain.chain_info(LOCAL_CHAIN).unwrap();
+        assert_eq!(chain.round_at(LOCAL_GENESIS_TIME), 1);
+        assert_eq!(chain.round_at(LOCAL_GENESIS_TIME + 7), 3);
+
+        let beacon = chain.latest().unwrap();
+        assert!(beacon.verify(info.scheme_id, &info.public_key).is_ok());
+        let next = chain
+            .chain_randomness(LOCAL_CHAIN, beacon.round_number + 1)
+            .unwrap();
+        assert_eq!(next.previous_signature, beacon.signature);
+
+        let mut forged = beacon.clone();
+        forged.round_number += 1;
+        assert!(forged.verify(info.scheme_id, &info.public_key).is_err());
+        assert!(chain.chain_info("other").is_err());
+    }
+
+    #[test]
+    fn replayed_beacons() {
+        let synthesized = LocalChain::synthesized(1);
+        let recording = Recording {
+            chain: "recorded".to_string(),
+            info: synthesized.info.clone(),
+            beacons: (10..20)
+                .rev()
+                .map(|round| synthesized.beacon(round).unwrap())
+                .collect(),
+        };
+        let start = unix_now();
+        let chain = LocalChain::replay(recording, start).unwrap();
+        assert_eq!(
+            chain.chain_randomness("recorded", 12).unwrap().round_number,
+            12
+        );
+        assert!(chain.chain_randomness("recorded", 20).is_err());
+        assert!(chain.chain_randomness("recorded", 9).is_err());
+        let round = chain.latest().unwrap().round_number;
+        assert!((10..12).contains(&round));
+    }
+
+    #[test]
+    fn replay_ends_with_recording() {
+        let synthesized = LocalChain::synthesized(2);
+        let recording = Recording {
+            chain: "recorded".to_string(),
+            info: synthesized.info.clone(),
+            beacons: (10..20)
+                .map(|round| synthesized.beacon(round).unwrap())
+                .collect(),
+        };
+        let chain = LocalChain::replay(recording, 1_000).unwrap();
+
+        // rounds only move forward until the last recorded one, even past one recording length
+        let rounds = (0..30)
+            .map_while(|t| chain.latest_at(1_000 + t).map(|beacon| beacon.round_number))
+            .collect::<Vec<_>>();
+        assert_eq!(rounds.len(), 20);
+        assert_eq!(rounds[0], 10);
+        assert_eq!(*rounds.last().unwrap(), 19);
+        assert!(rounds.windows(2).all(|w| w[0] <= w[1]));
+        assert_eq!(chain.latest_at(999).unwrap().round_number, 10);
+        assert!(chain.latest_at(1_020).is_none());
+        assert!(chain.latest_at(1_000_000).is_none());
+    }
+}
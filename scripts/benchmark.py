@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
 
+import csv
+import math
+import time
 import logging
 import os
 import argparse
+import shutil
 import asyncio
+import functools
+import contextlib
 
-from lib import tor
+from lib import catalog, cluster, process, procstat, provenance, results, sweep, tor, tor_sim
+from typing import Optional
 from dataclasses import dataclass
 
 MODE_OPEN = "open"
@@ -16,14 +23,42 @@ MODES = [MODE_OPEN,MODE_SENDER_RESTRICTED, MODE_RECEIVER_RESTRICTED, MODE_RESTRI
 
 ANONYCAST_BINARY = "./bin/anonycast"
 
+PUBLISH_MESSAGE_SIZES = [128, 1024, 128 * 1024, 512 * 1024, 1024 * 1024]
+PUBLISH_MAX_CLIENTS = 600
+RETREIVE_MESSAGE_SIZES = [128, 1024, 128 * 1024, 512 * 1024, 1024 * 1024]
+RETREIVE_MESSAGE_COUNTS = [1, 10, 100, 1000]
+RETREIVE_MAX_CLIENTS = 800
+# documents of the fetched topic from older rounds already stored by the deaddrop, see
+# --background
+RETREIVE_BACKGROUND_DOCUMENTS = [10**4, 10**5, 10**6]
+# message counts the pipelined fetches are compared at, see --pipeline
+RETREIVE_PIPELINE_MESSAGE_COUNTS = [1, 10, 100]
+
+# schedules of the open-loop clients, see rate-sweep
+ARRIVAL_FIXED = "fixed"
+ARRIVAL_POISSON = "poisson"
+ARRIVALS = [ARRIVAL_FIXED, ARRIVAL_POISSON]
+
+# ports used by the first job slot, every other slot is shifted by SLOT_PORT_STRIDE
+DEADDROP_BASE_PORT = 5000
+SLOT_PORT_STRIDE = 100
+# first socks port handed out by the tor pool
+SOCKS_BASE_PORT = 9000
+
 
 @dataclass(kw_only=True, frozen=True)
 class PublishConfig:
     clients: int
     message_size: int
+    # requests per second of each client of an open-loop run
+    client_rate: Optional[float] = None
+    arrival: str = ARRIVAL_FIXED
 
     def id(self) -> str:
-        return f"c{self.clients}_ms{self.message_size}"
+        id = f"c{self.clients}_ms{self.message_size}"
+        if self.client_rate is not None:
+            id += f"_cr{self.client_rate:g}_{self.arrival}"
+        return id
 
 
 @dataclass(kw_only=True, frozen=True)
@@ -31,9 +66,22 @@ class RetreiveConfig:
     clients: int
     message_count: int
     message_size: int
+    background_documents: int = 0
+    # fetches each client keeps in flight at the same time
+    pipeline: int = 1
+    # requests per second of each client of an open-loop run
+    client_rate: Optional[float] = None
+    arrival: str = ARRIVAL_FIXED
 
     def id(self) -> str:
-        return f"c{self.clients}_m{self.message_count}_s{self.message_size}"
+        id = f"c{self.clients}_m{self.message_count}_s{self.message_size}"
+        if self.background_documents != 0:
+            id += f"_bg{self.background_documents}"
+        if self.pipeline != 1:
+            id += f"_p{self.pipeline}"
+        if self.client_rate is not None:
+            id += f"_cr{self.client_rate:g}_{self.arrival}"
+        return id
 
 
 @dataclass(kw_only=True, frozen=True)
@@ -83,12 +131,11 @@ def generate_publish_configs() -> list[PublishConfig]:
         450,
         500,
         550,
-        600,
+        PUBLISH_MAX_CLIENTS,
     ]
-    message_sizes = [128, 1024, 128 * 1024, 512 * 1024, 1024 * 1024]
 
     configs = []
-    for message_size in message_sizes:
+    for message_size in PUBLISH_MESSAGE_SIZES:
         for nclients in clients:
             configs.append(
                 PublishConfig(
@@ -119,14 +166,12 @@ def generate_retreive_configs() -> list[RetreiveConfig]:
         200,
         400,
         600,
-        800,
+        RETREIVE_MAX_CLIENTS,
     ]
-    message_counts = [1, 10, 100, 1000]
-    message_sizes = [128, 1024, 128 * 1024, 512 * 1024, 1024 * 1024]
 
     configs = []
-    for size in message_sizes:
-        for n_messages in message_counts:
+    for size in RETREIVE_MESSAGE_SIZES:
+        for n_messages in RETREIVE_MESSAGE_COUNTS:
             for n_clients in clients:
                 configs.append(
                     RetreiveConfig(
@@ -136,6 +181,42 @@ def generate_retreive_configs() -> list[RetreiveConfig]:
     return configs
 
 
+def generate_background_configs() -> list[RetreiveConfig]:
+    """
+    Retrieve runs against a deaddrop that stores an increasing number of documents of
+    the fetched topic from rounds before the fetched ones, the latency should not depend
+    on it
+    """
+    configs = []
+    for background_documents in [0, *RETREIVE_BACKGROUND_DOCUMENTS]:
+        for n_clients in [1, 10, 100]:
+            configs.append(
+                RetreiveConfig(
+                    clients=n_clients,
+                    message_count=10,
+                    message_size=1024,
+                    background_documents=background_documents,
+                )
+            )
+    return configs
+
+
+def generate_pipeline_configs(pipeline: int) -> list[RetreiveConfig]:
+    """
+    A single client fetching one at a time and with `pipeline` fetches in flight
+    """
+    return [
+        RetreiveConfig(
+            clients=1,
+            message_count=message_count,
+            message_size=1024,
+            pipeline=p,
+        )
+        for message_count in RETREIVE_PIPELINE_MESSAGE_COUNTS
+        for p in sorted({1, pipeline})
+    ]
+
+
 def generate_latency_configs() -> list[LatencyConfig]:
     deaddrops = [3, 5, 7,9]
     allowed_receivers = [1, 2, 4, 8, 16, 32, 64, 128]
@@ -170,12 +251,17 @@ def generate_latency_configs() -> list[LatencyConfig]:
     return configs
 
 
-def cluster_machines() -> list[str]:
+def cluster_nodes(args) -> list[str]:
     """
-    Return the list machine hostnames in the current job
+    Return the hostnames of the nodes of a cluster run, the deaddrop runs on the
+    first one and the clients are split over the other ones.
+    `--nodes` takes precedence over the machines of the current job, a hostname
+    may then be given several times, e.g. localhost,localhost,localhost.
     """
+    if args.nodes is not None:
+        return args.nodes.split(",")
     with open(os.environ["OAR_NODEFILE"], "r") as f:
-        return list(set([l.strip() for l in f.readlines()]))
+        return sorted(set([l.strip() for l in f.readlines()]))
 
 
 def cluster_hostname() -> str:
@@ -183,246 +269,844 @@ def cluster_hostname() -> str:
         return f.read().strip()
 
 
-def cluster_remote_machine() -> str:
+# file extension of the results for each --output-format
+RESULT_EXTENSIONS = {"json": "json", "columnar": "bin"}
+
+
+def benchmark_filepath(bench: str, id: str, extension: str = "json") -> str:
+    return os.path.abspath(f"benchmark/{bench}/{id}.{extension}")
+
+
+@dataclass(kw_only=True, frozen=True)
+class Slot:
     """
-    Assuming only 2 machines in the job, return the hostname of the machine that is not the one this script is currently running on
+    A job slot of the scheduler, every job running in a slot gets its own ports and cpus
     """
-    machines = cluster_machines()
-    hostname = cluster_hostname()
-    assert len(machines) == 2, "expected 2 machines in the job"
-    assert (
-        hostname in machines
-    ), f"expected current machine to be part of the job: {machines}"
-    return [x for x in machines if x != hostname][0]
 
+    index: int
+    cpus: tuple[int, ...]
 
-def benchmark_filepath(bench: str, id: str) -> str:
-    return os.path.abspath(f"benchmark/{bench}/{id}.json")
+    def port(self, offset: int = 0) -> int:
+        return DEADDROP_BASE_PORT + self.index * SLOT_PORT_STRIDE + offset
 
+    def pin(self, argv: list[str]) -> list[str]:
+        """
+        Prefix a command so that it only runs on the cpus of this slot
+        """
+        if len(self.cpus) == 0:
+            return argv
+        return ["taskset", "--cpu-list", ",".join(map(str, self.cpus)), *argv]
 
-async def benchmark_publish_troughput(args):
-    for config in generate_publish_configs():
-        filepath = benchmark_filepath("publish", config.id())
-        if os.path.exists(filepath):
-            print(f"skipping: {config}")
-            continue
-        else:
-            print(f"running: {config}")
-
-        acceptance_window = str(2**32)
-
-        dd_args = []
-        dd_args += ["deaddrop"]
-        dd_args += ["--mode", "open"]
-        dd_args += ["--difficulty", "8"]
-        dd_args += ["--acceptance-window", acceptance_window]
-
-        bench_args = []
-        bench_args += ["benchmark", "publish-troughput"]
-        bench_args += ["--clients", str(config.clients)]
-        bench_args += ["--runtime", "15"]
-        bench_args += ["--difficulty", "8"]
-        bench_args += ["--message-size", str(config.message_size)]
-        bench_args += ["--prepared-messages", str(30 * 5000)]
-        bench_args += ["--acceptance-window", acceptance_window]
-        bench_args += ["--output", filepath]
 
-        if args.cluster:
-            local = cluster_hostname()
-            remote = cluster_remote_machine()
+def make_slots(jobs: int) -> list[Slot]:
+    """
+    Split the cpus available to this process in `jobs` disjoint sets.
+    With a single job nothing is pinned to keep the sequential behaviour.
+    """
+    if jobs == 1:
+        return [Slot(index=0, cpus=())]
+    cpus = sorted(os.sched_getaffinity(0))
+    per_slot = len(cpus) // jobs
+    assert per_slot >= 1, f"not enough cpus ({len(cpus)}) for {jobs} jobs"
+    return [
+        Slot(index=i, cpus=tuple(cpus[i * per_slot : (i + 1) * per_slot]))
+        for i in range(jobs)
+    ]
 
-            dd_args += ["--address", f"0.0.0.0:5000"]
-            bench_args += ["--deaddrop-address", f"{remote}:5000"]
 
-            await (
-                await asyncio.create_subprocess_shell(
-                    f"oarsh {local} killall anonycast"
-                )
-            ).wait()
-            await (
-                await asyncio.create_subprocess_shell(
-                    f"oarsh {remote} killall anonycast"
-                )
-            ).wait()
+def make_slot_queue(jobs: int) -> asyncio.Queue[Slot]:
+    slots: asyncio.Queue[Slot] = asyncio.Queue()
+    for slot in make_slots(jobs):
+        slots.put_nowait(slot)
+    return slots
 
-            binary = os.path.abspath("./bin/anonycast")
 
-            await asyncio.create_subprocess_shell(
-                f"oarsh {remote} {binary} {' '.join(dd_args)}"
-            )
-            await asyncio.sleep(2)
-            bench_proc = await asyncio.create_subprocess_shell(
-                f"{binary} {' '.join(bench_args)}",
-                stderr=asyncio.subprocess.STDOUT,
-            )
+async def run_in_slot(args, slots: asyncio.Queue[Slot], runner, job):
+    """
+    Run `runner(args, job, slot)` once a slot is free, holding it for the whole run
+    """
+    slot = await slots.get()
+    try:
+        await runner(args, job, slot)
+    finally:
+        slots.put_nowait(slot)
 
-            status = await bench_proc.wait()
-            if status != 0:
-                raise Exception("failed to run benchmark")
 
-            await asyncio.create_subprocess_shell(f"oarsh {local} killall anonycast")
-            await asyncio.create_subprocess_shell(f"oarsh {remote} killall anonycast")
-        else:
-            dd_args += ["--address", "127.0.0.1:5000"]
-            bench_args += ["--deaddrop-address", "127.0.0.1:5000"]
+async def run_tasks(coroutines: list):
+    tasks = [asyncio.create_task(c) for c in coroutines]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-            dd_proc = await asyncio.create_subprocess_exec(
-                ANONYCAST_BINARY, *dd_args, stderr=asyncio.subprocess.STDOUT
-            )
-            await asyncio.sleep(1)
-            bench_proc = await asyncio.create_subprocess_exec(
-                ANONYCAST_BINARY, *bench_args, stderr=asyncio.subprocess.STDOUT
+
+async def run_scheduled(args, jobs: list, runner):
+    """
+    Run `runner(args, job, slot)` for every job, at most `args.jobs` at the same time.
+    """
+    slots = make_slot_queue(args.jobs)
+    await run_tasks([run_in_slot(args, slots, runner, job) for job in jobs])
+
+
+async def run_adaptive(
+    args, bench: str, groups: list[tuple], make_config, runner, max_clients: int
+):
+    """
+    Search the saturation knee of every group instead of running every client count.
+    `make_config(group, clients)` builds the config of a run of the group, the
+    groups are searched concurrently and share the slots.
+    """
+    slots = make_slot_queue(args.jobs)
+    search = sweep.KneeSearch(
+        max_clients=max_clients,
+        gain=args.adaptive_gain,
+        tolerance=args.adaptive_tolerance,
+    )
+
+    async def measure(group: tuple, clients: int) -> sweep.Point:
+        config = make_config(group, clients)
+        await run_in_slot(args, slots, runner, config)
+        with catalog.Catalog("benchmark") as c:
+            row = c.get(result_filepath(args, bench, config))
+        # a run without any completed operation did not scale at all
+        return sweep.Point(
+            clients=clients,
+            throughput=row["throughput"] or 0.0,
+            latency=row["latency_mean"] or float("inf"),
+        )
+
+    knees: dict[tuple, sweep.Knee] = {}
+
+    async def search_group(group: tuple):
+        knees[group] = await sweep.find_knee(
+            search, lambda clients: measure(group, clients)
+        )
+        knee = knees[group]
+        print(
+            f"knee {group}: {knee.clients} clients, {knee.throughput:.2f} ops/s,"
+            f" latency knee at {knee.latency_clients} clients, {len(knee.points)} runs"
+        )
+
+    await run_tasks([search_group(group) for group in groups])
+
+    with open(os.path.abspath(f"benchmark/{bench}/knees.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["group", "clients", "throughput", "latency_clients", "runs"])
+        for group, knee in knees.items():
+            writer.writerow(
+                [
+                    "_".join(str(g) for g in group),
+                    knee.clients,
+                    knee.throughput,
+                    knee.latency_clients,
+                    len(knee.points),
+                ]
             )
-            status = await bench_proc.wait()
-            dd_proc.terminate()
-            if status != 0:
-                raise Exception("failed to run benchmark")
 
 
-async def benchmark_retreive_troughput(args):
-    for config in generate_retreive_configs():
-        filepath = benchmark_filepath("retreive", config.id())
-        if os.path.exists(filepath):
-            print(f"skipping: {config}")
-            continue
-        else:
-            print(f"running: {config}")
-
-        dd_args = []
-        dd_args += ["deaddrop"]
-        dd_args += ["--mode", "open"]
-        dd_args += ["--difficulty", "8"]
-        dd_args += ["--acceptance-window", "100"]
-
-        bench_args = []
-        bench_args += ["benchmark", "retreive-troughput"]
-        bench_args += ["--clients", str(config.clients)]
-        bench_args += ["--runtime", "15"]
-        bench_args += ["--difficulty", "8"]
-        bench_args += ["--message-size", str(config.message_size)]
-        bench_args += ["--message-count", str(config.message_count)]
-        bench_args += ["--acceptance-window", "100"]
-        bench_args += ["--output", filepath]
+def benchmark_logpath(bench: str, id: str, process: str) -> str:
+    return os.path.abspath(f"benchmark/{bench}/logs/{id}.{process}.log")
 
-        if args.cluster:
-            local = cluster_hostname()
-            remote = cluster_remote_machine()
 
-            dd_args += ["--address", f"0.0.0.0:5000"]
-            bench_args += ["--deaddrop-address", f"{local}:5000"]
+def benchmark_resourcespath(bench: str, id: str) -> str:
+    return os.path.abspath(f"benchmark/{bench}/{id}.resources.csv")
+
+
+def benchmark_statspath(bench: str, id: str) -> str:
+    return os.path.abspath(f"benchmark/{bench}/stats/{id}.jsonl")
+
+
+def benchmark_futexpath(bench: str, id: str, extension: str) -> str:
+    return os.path.abspath(f"benchmark/{bench}/futex/{id}.{extension}")
+
+
+def drand_source(drand: str) -> str:
+    """
+    --drand of the processes of a run, a recording is replayed from the start of the run
+    by all of them so that they agree on the round
+    """
+    if drand.startswith("replay:"):
+        return f"{drand}@{int(time.time())}"
+    return drand
+
+
+def populated_since_round(log_path: str) -> Optional[int]:
+    """
+    Round the clients fetch since, printed by a retrieve run that published background
+    documents
+    """
+    with open(log_path, "r") as f:
+        for line in f:
+            if line.startswith("since round "):
+                return int(line.split()[-1])
+    return None
+
+
+def benchmark_tracepath(bench: str, id: str, process: str) -> str:
+    path = os.path.abspath(f"benchmark/{bench}/traces/{id}.{process}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
 
-            await (
-                await asyncio.create_subprocess_shell(
-                    f"oarsh {local} killall anonycast"
-                )
-            ).wait()
-            await (
-                await asyncio.create_subprocess_shell(
-                    f"oarsh {remote} killall anonycast"
-                )
-            ).wait()
 
-            binary = os.path.abspath("./bin/anonycast")
+def benchmark_documentlogpath(bench: str, id: str) -> str:
+    return os.path.abspath(f"benchmark/{bench}/documents/{id}")
 
-            await asyncio.create_subprocess_shell(
-                f"{binary} {' '.join(dd_args)}",
-                stderr=asyncio.subprocess.STDOUT,
+
+def futex_tracer(bench: str, id: str, pid: int) -> process.ManagedProcess:
+    """
+    strace of the futex calls of the deaddrop workers, to be analyzed with
+    scripts/strace-futex.py benchmark/<bench>/futex/<id>.trace --tids benchmark/<bench>/futex/<id>.tids
+    """
+    tids = procstat.worker_tids(pid)
+    tids_path = benchmark_futexpath(bench, id, "tids")
+    os.makedirs(os.path.dirname(tids_path), exist_ok=True)
+    with open(tids_path, "w") as f:
+        f.writelines(f"{tid}\n" for tid in tids)
+
+    argv = ["strace", *[f"-p{tid}" for tid in tids]]
+    argv += ["-e", "trace=futex", "-T"]
+    argv += ["--stack-trace=source", "--stack-trace-frame-limit=24"]
+    argv += ["-o", benchmark_futexpath(bench, id, "trace")]
+    return process.ManagedProcess(argv, log_path=benchmark_logpath(bench, id, "strace"))
+
+
+def result_filepath(args, bench: str, config) -> str:
+    return benchmark_filepath(bench, config.id(), RESULT_EXTENSIONS[args.output_format])
+
+
+def runtime_seconds(args) -> int:
+    return 15 if args.convergence is None else args.max_runtime
+
+
+def runtime_args(args) -> list[str]:
+    """
+    Fixed runtime, or run until convergence with the runtime as a maximum
+    """
+    if args.convergence is None:
+        return ["--runtime", str(runtime_seconds(args))]
+    return [
+        "--runtime",
+        str(runtime_seconds(args)),
+        "--tolerance",
+        str(args.convergence),
+    ]
+
+
+def open_loop_args(config) -> list[str]:
+    """
+    Schedule of the clients of an open-loop config, closed loop otherwise
+    """
+    if config.client_rate is None:
+        return []
+    return ["--client-rate", str(config.client_rate), "--arrival", config.arrival]
+
+
+def record_run(filepath: str) -> dict:
+    """
+    Add a finished run to the catalog used by the notebooks, returns its row
+    """
+    with catalog.Catalog("benchmark") as c:
+        return c.get(filepath)
+
+
+def run_stamp(args, argv: list[str]) -> provenance.Stamp:
+    """
+    Provenance of a run with `argv`, plus the global options that change its results
+    """
+    argv = list(argv)
+    if args.drand is not None:
+        argv += ["--drand", args.drand]
+    if args.document_log:
+        argv += ["--document-log"]
+    if args.trace:
+        argv += ["--trace"]
+    nodes = cluster_nodes(args) if args.cluster else ["localhost"]
+    return provenance.stamp(ANONYCAST_BINARY, argv, nodes, args.jobs)
+
+
+def previous_run(
+    args, config, filepath: str, stamp: provenance.Stamp
+) -> tuple[bool, Optional[str]]:
+    """
+    Whether a config has to run, and where its previous results were moved.
+    Results are reused when they have the same stamp and are kept under
+    benchmark/previous/<binary> otherwise. With --rerun-changed only the
+    configs that already have results are run.
+    """
+    if not os.path.exists(filepath):
+        if args.rerun_changed:
+            print(f"skipping: {config} (no previous results)")
+            return False, None
+        print(f"running: {config}")
+        return True, None
+
+    previous = provenance.read(filepath)
+    if previous is not None and previous.key() == stamp.key():
+        print(f"skipping: {config}")
+        return False, None
+
+    binary = previous.binary if previous is not None else provenance.UNKNOWN_BINARY
+    bench = os.path.basename(os.path.dirname(filepath))
+    directory = os.path.abspath(f"benchmark/previous/{binary[:12]}/{bench}")
+    moved = os.path.join(directory, os.path.basename(filepath))
+    resources = os.path.splitext(filepath)[0] + ".resources.csv"
+    for src, dst in [
+        (filepath, moved),
+        (resources, os.path.join(directory, os.path.basename(resources))),
+        (provenance.sidecar_path(filepath), provenance.sidecar_path(moved)),
+    ]:
+        if os.path.exists(src):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(src, dst)
+    print(f"running: {config} (stale results moved to {moved})")
+    return True, moved
+
+
+def finish_run(filepath: str, stamp: provenance.Stamp, previous: Optional[str]) -> dict:
+    """
+    Stamp and catalog a finished run, compared to the results it replaced
+    """
+    provenance.write(filepath, stamp)
+    row = record_run(filepath)
+    if previous is not None:
+        before = catalog.summarize(previous)
+        for field in ["throughput", "latency_mean"]:
+            if before[field] and row[field] is not None:
+                change = row[field] / before[field] - 1
+                print(f"{field}: {before[field]:.4f} -> {row[field]:.4f} ({change:+.1%})")
+    return row
+
+
+def benchmark_nodepath(bench: str, id: str, node: int, extension: str) -> str:
+    return os.path.abspath(f"benchmark/{bench}/nodes/{id}.node{node}.{extension}")
+
+
+async def run_with_deaddrop(
+    args,
+    slot: Slot,
+    bench: str,
+    id: str,
+    dd_args: list[str],
+    bench_args: list[str],
+    clients: int,
+    filepath: str,
+    populate: bool = False,
+):
+    """
+    Run a benchmark against a freshly started deaddrop and write its results to `filepath`.
+    In cluster mode the deaddrop runs on the first node and the clients are split over
+    the other ones, which all start at the same time. Their results are then merged with
+    the timestamps moved to the clock of this machine.
+    With `populate` the documents fetched by the clients are published once beforehand.
+    """
+    binary = os.path.abspath(ANONYCAST_BINARY)
+    port = slot.port()
+
+    if args.cluster:
+        nodes = cluster_nodes(args)
+        assert (
+            len(nodes) >= 2
+        ), f"expected a deaddrop node and at least one load generator node: {nodes}"
+    else:
+        nodes = ["localhost", "localhost"]
+    dd_node, generators = nodes[0], nodes[1:]
+    shares = cluster.client_shares(generators, clients)
+
+    def host(node: str) -> Optional[str]:
+        return None if cluster.is_local(node) else node
+
+    def deaddrop_host(node: str) -> str:
+        """
+        Hostname of the deaddrop node as seen from `node`
+        """
+        if node == dd_node or (cluster.is_local(node) and cluster.is_local(dd_node)):
+            return "127.0.0.1"
+        if cluster.is_local(dd_node):
+            return cluster_hostname()
+        return dd_node
+
+    listen = "127.0.0.1" if all(cluster.is_local(n) for n in nodes) else "0.0.0.0"
+    dd_args = dd_args + ["--address", f"{listen}:{port}"]
+    if args.drand is not None:
+        drand = drand_source(args.drand)
+        dd_args += ["--drand", drand]
+        bench_args = bench_args + ["--drand", drand]
+    if args.trace:
+        dd_args += ["--trace", benchmark_tracepath(bench, id, "deaddrop")]
+    document_log = benchmark_documentlogpath(bench, id)
+    if args.document_log:
+        # the deaddrop would serve the documents of a previous run
+        shutil.rmtree(document_log, ignore_errors=True)
+        dd_args += ["--document-log", document_log]
+
+    if args.cluster:
+        extension = RESULT_EXTENSIONS[args.output_format]
+        node_ids = [f"{id}.node{i}" for i in range(len(shares))]
+        outputs = [
+            benchmark_nodepath(bench, id, i, extension) for i in range(len(shares))
+        ]
+    else:
+        node_ids = [id]
+        outputs = [filepath]
+
+    async with process.DeaddropProcess(
+        slot.pin([binary, *dd_args]),
+        host=host(dd_node),
+        address=(deaddrop_host("localhost"), port),
+        log_path=benchmark_logpath(bench, id, "deaddrop"),
+    ) as dd_proc:
+        if populate and args.cluster:
+            argv = [*bench_args, "--clients", "1", "--populate-only"]
+            argv += ["--deaddrop-address", f"{deaddrop_host(shares[0].node)}:{port}"]
+            async with process.ManagedProcess(
+                slot.pin([binary, *argv]),
+                host=host(shares[0].node),
+                log_path=benchmark_logpath(bench, id, "populate"),
+            ) as populate_proc:
+                if await populate_proc.wait() != 0:
+                    raise Exception(
+                        f"failed to populate the deaddrop, see {populate_proc.log_path}"
+                    )
+            bench_args = bench_args + ["--skip-populate"]
+            since_round = populated_since_round(populate_proc.log_path)
+            if since_round is not None:
+                bench_args += ["--since-round", str(since_round)]
+
+        offsets = {}
+        start_at = None
+        if args.cluster:
+            unique_nodes = sorted(set(share.node for share in shares))
+            offsets = dict(
+                zip(
+                    unique_nodes,
+                    await asyncio.gather(*map(cluster.clock_offset, unique_nodes)),
+                )
             )
-            await asyncio.sleep(2)
-            bench_proc = await asyncio.create_subprocess_shell(
-                f"oarsh {remote} {binary} {' '.join(bench_args)}"
+            # clients connect 50ms apart, leave them the time to all be connected
+            max_share = max(share.clients for share in shares)
+            start_at = time.time() + args.start_delay + 0.05 * max_share
+
+        def bench_argv(i: int, share: cluster.Share) -> list[str]:
+            argv = [*bench_args, "--clients", str(share.clients)]
+            argv += ["--deaddrop-address", f"{deaddrop_host(share.node)}:{port}"]
+            argv += ["--output", outputs[i]]
+            if args.stats_snapshot:
+                argv += ["--stats-snapshot", benchmark_statspath(bench, node_ids[i])]
+            if start_at is not None:
+                argv += ["--client-offset", str(share.client_offset)]
+                argv += ["--start-at", f"{start_at + offsets[share.node]:.6f}"]
+            return slot.pin([binary, *argv])
+
+        async with contextlib.AsyncExitStack() as stack:
+            sampler = await stack.enter_async_context(
+                procstat.Sampler(benchmark_resourcespath(bench, id), args.sample_interval)
             )
+            bench_procs = []
+            for i, share in enumerate(shares):
+                bench_proc = await stack.enter_async_context(
+                    process.ManagedProcess(
+                        bench_argv(i, share),
+                        host=host(share.node),
+                        log_path=benchmark_logpath(bench, node_ids[i], "benchmark"),
+                    )
+                )
+                bench_procs.append(bench_proc)
+                # /proc of remote machines cannot be sampled
+                if bench_proc.host is None:
+                    name = f"benchmark{i}" if args.cluster else "benchmark"
+                    sampler.watch(name, bench_proc.pid)
+            if dd_proc.host is None:
+                sampler.watch("deaddrop", dd_proc.pid)
+                if args.futex_trace:
+                    await stack.enter_async_context(futex_tracer(bench, id, dd_proc.pid))
+
+            statuses = await asyncio.gather(*(p.wait() for p in bench_procs))
+            for bench_proc, status in zip(bench_procs, statuses):
+                if status != 0:
+                    raise Exception(
+                        f"failed to run benchmark, see {bench_proc.log_path}"
+                    )
+
+    if args.document_log:
+        shutil.rmtree(document_log, ignore_errors=True)
+
+    if args.cluster:
+        parts = [
+            (results.read(output), offsets[share.node])
+            for share, output in zip(shares, outputs)
+        ]
+        results.write(
+            filepath, cluster.merge(parts), columnar=args.output_format == "columnar"
+        )
+
+
+async def run_publish_troughput(args, config: PublishConfig, slot: Slot):
+    filepath = result_filepath(args, "publish", config)
+    acceptance_window = str(2**32)
+    prepared_messages = 30 * 5000
+    if config.client_rate is not None:
+        # open-loop clients keep sending at their rate for the whole run
+        offered = config.client_rate * config.clients * runtime_seconds(args)
+        prepared_messages = max(prepared_messages, math.ceil(1.1 * offered))
+
+    dd_args = []
+    dd_args += ["deaddrop"]
+    dd_args += ["--mode", "open"]
+    dd_args += ["--difficulty", "8"]
+    dd_args += ["--acceptance-window", acceptance_window]
+
+    bench_args = []
+    bench_args += ["benchmark", "publish-troughput"]
+    bench_args += runtime_args(args)
+    bench_args += ["--difficulty", "8"]
+    bench_args += ["--message-size", str(config.message_size)]
+    bench_args += ["--prepared-messages", str(prepared_messages)]
+    bench_args += ["--acceptance-window", acceptance_window]
+    bench_args += open_loop_args(config)
+    bench_args += ["--output-format", args.output_format]
+
+    stamp = run_stamp(args, [*dd_args, *bench_args])
+    should_run, previous = previous_run(args, config, filepath, stamp)
+    if not should_run:
+        return
+
+    await run_with_deaddrop(
+        args, slot, "publish", config.id(), dd_args, bench_args, config.clients, filepath
+    )
+    run = finish_run(filepath, stamp, previous)
+    if run["preparation_time"] is not None:
+        print(f"preparation: {run['preparation_time']:.2f} s")
 
-            status = await bench_proc.wait()
-            if status != 0:
-                raise Exception("failed to run benchmark")
 
-            await asyncio.create_subprocess_shell(f"oarsh {local} killall anonycast")
-            await asyncio.create_subprocess_shell(f"oarsh {remote} killall anonycast")
-        else:
-            dd_args += ["--address", "127.0.0.1:5000"]
-            bench_args += ["--deaddrop-address", "127.0.0.1:5000"]
+async def benchmark_publish_troughput(args):
+    if args.adaptive:
+        await run_adaptive(
+            args,
+            "publish",
+            [(size,) for size in PUBLISH_MESSAGE_SIZES],
+            lambda group, clients: PublishConfig(clients=clients, message_size=group[0]),
+            run_publish_troughput,
+            PUBLISH_MAX_CLIENTS,
+        )
+    else:
+        await run_scheduled(args, generate_publish_configs(), run_publish_troughput)
+
+
+async def run_retreive_troughput(args, config: RetreiveConfig, slot: Slot):
+    filepath = result_filepath(args, "retreive", config)
+
+    # background documents come from the prepared messages cache and keep the round they
+    # were prepared in
+    acceptance_window = "100" if config.background_documents == 0 else str(2**32)
+
+    dd_args = []
+    dd_args += ["deaddrop"]
+    dd_args += ["--mode", "open"]
+    dd_args += ["--difficulty", "8"]
+    dd_args += ["--acceptance-window", acceptance_window]
+
+    bench_args = []
+    bench_args += ["benchmark", "retreive-troughput"]
+    bench_args += runtime_args(args)
+    bench_args += ["--difficulty", "8"]
+    bench_args += ["--message-size", str(config.message_size)]
+    bench_args += ["--message-count", str(config.message_count)]
+    bench_args += ["--acceptance-window", acceptance_window]
+    bench_args += ["--background-documents", str(config.background_documents)]
+    bench_args += ["--pipeline", str(config.pipeline)]
+    bench_args += open_loop_args(config)
+    bench_args += ["--output-format", args.output_format]
+
+    stamp = run_stamp(args, [*dd_args, *bench_args])
+    should_run, previous = previous_run(args, config, filepath, stamp)
+    if not should_run:
+        return
+
+    await run_with_deaddrop(
+        args,
+        slot,
+        "retreive",
+        config.id(),
+        dd_args,
+        bench_args,
+        config.clients,
+        filepath,
+        populate=True,
+    )
+    run = finish_run(filepath, stamp, previous)
+    if run["throughput"] is not None:
+        print(f"throughput: {run['throughput']:.2f} ops/s")
+    if run["deaddrop_rss_kb"] is not None:
+        print(f"deaddrop peak rss: {run['deaddrop_rss_kb'] / 1024:.1f} MiB")
+
 
-            dd_proc = await asyncio.create_subprocess_exec(
-                ANONYCAST_BINARY, *dd_args, stderr=asyncio.subprocess.STDOUT
+async def benchmark_retreive_troughput(args):
+    if args.pipeline is not None:
+        configs = generate_pipeline_configs(args.pipeline)
+        await run_scheduled(args, configs, run_retreive_troughput)
+        print_pipeline_gain(args, configs)
+    elif args.background:
+        await run_scheduled(args, generate_background_configs(), run_retreive_troughput)
+    elif args.adaptive:
+        await run_adaptive(
+            args,
+            "retreive",
+            [
+                (size, count)
+                for size in RETREIVE_MESSAGE_SIZES
+                for count in RETREIVE_MESSAGE_COUNTS
+            ],
+            lambda group, clients: RetreiveConfig(
+                clients=clients, message_size=group[0], message_count=group[1]
+            ),
+            run_retreive_troughput,
+            RETREIVE_MAX_CLIENTS,
+        )
+    else:
+        await run_scheduled(args, generate_retreive_configs(), run_retreive_troughput)
+
+
+def print_pipeline_gain(args, configs: list[RetreiveConfig]):
+    """
+    Throughput per client of the pipelined runs relative to the sequential ones
+    """
+    throughput = {}
+    with catalog.Catalog("benchmark") as c:
+        for config in configs:
+            # not every config runs with --rerun-changed
+            filepath = result_filepath(args, "retreive", config)
+            throughput[(config.message_count, config.pipeline)] = (
+                c.get(filepath)["throughput"] if os.path.exists(filepath) else None
             )
-            await asyncio.sleep(1)
-            bench_proc = await asyncio.create_subprocess_exec(
-                ANONYCAST_BINARY, *bench_args, stderr=asyncio.subprocess.STDOUT
+    for message_count in RETREIVE_PIPELINE_MESSAGE_COUNTS:
+        sequential = throughput[(message_count, 1)]
+        pipelined = throughput[(message_count, args.pipeline)]
+        if sequential is None or pipelined is None:
+            print(f"{message_count} messages: no completed fetch")
+            continue
+        print(
+            f"{message_count} messages: {sequential:.2f} -> {pipelined:.2f} ops/s per client"
+            f" with {args.pipeline} fetches in flight (x{pipelined / sequential:.2f})"
+        )
+
+
+async def benchmark_rate_sweep(args):
+    """
+    Open-loop runs of a single config at an increasing offered load, until past
+    saturation. The offered load is shared by the clients and the latency
+    percentiles of every step are written to benchmark/<bench>/rate-sweep_<id>.csv
+    """
+    if args.bench == "publish":
+        make_config = lambda client_rate: PublishConfig(
+            clients=args.clients,
+            message_size=args.message_size,
+            client_rate=client_rate,
+            arrival=args.arrival,
+        )
+        runner = run_publish_troughput
+    else:
+        make_config = lambda client_rate: RetreiveConfig(
+            clients=args.clients,
+            message_count=args.message_count,
+            message_size=args.message_size,
+            client_rate=client_rate,
+            arrival=args.arrival,
+        )
+        runner = run_retreive_troughput
+
+    slots = make_slot_queue(1)
+    search = sweep.RateSweep(
+        start_rate=args.start_rate,
+        max_rate=args.max_rate,
+        factor=args.rate_factor,
+        tolerance=args.saturation_tolerance,
+        past_saturation=args.past_saturation,
+    )
+
+    async def measure(rate: float) -> sweep.RatePoint:
+        config = make_config(rate / args.clients)
+        await run_in_slot(args, slots, runner, config)
+        with catalog.Catalog("benchmark") as c:
+            row = c.get(result_filepath(args, args.bench, config))
+        point = sweep.RatePoint(
+            rate=rate,
+            goodput=row["goodput"] or 0.0,
+            latency_p50=row["latency_p50"] or float("inf"),
+            latency_p99=row["latency_p99"] or float("inf"),
+            latency_p999=row["latency_p999"] or float("inf"),
+            unfinished=row["unfinished"] or 0,
+        )
+        print(
+            f"offered {rate:.2f} ops/s: goodput {point.goodput:.2f} ops/s,"
+            f" p50 {point.latency_p50:.4f} s, p99 {point.latency_p99:.4f} s,"
+            f" p99.9 {point.latency_p999:.4f} s, {point.unfinished} unfinished"
+        )
+        return point
+
+    points = await sweep.sweep_rate(search, measure)
+    saturation = next((p.rate for p in points if search.saturated(p)), None)
+    if saturation is None:
+        print(f"not saturated at {points[-1].rate:.2f} ops/s")
+    else:
+        print(f"saturated at {saturation:.2f} ops/s")
+
+    id = make_config(None).id()
+    path = os.path.abspath(f"benchmark/{args.bench}/rate-sweep_{id}_{args.arrival}.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["rate", "goodput", "latency_p50", "latency_p99", "latency_p999", "unfinished"]
+        )
+        for p in points:
+            writer.writerow(
+                [
+                    p.rate,
+                    p.goodput,
+                    p.latency_p50,
+                    p.latency_p99,
+                    p.latency_p999,
+                    p.unfinished,
+                ]
             )
-            status = await bench_proc.wait()
-            dd_proc.terminate()
+
+
+async def run_latency(args, job: tuple[LatencyConfig, int], slot: Slot, pool: tor.TorPool):
+    config, repetition = job
+    bench = f"latency-offline{repetition}" if args.offline else f"latency{repetition}"
+    filepath = benchmark_filepath(bench, config.id())
+
+    config_args = []
+    config_args += ["--deaddrops", str(config.deaddrops)]
+    config_args += ["--allowed-receivers", str(config.allowed_receivers)]
+    config_args += ["--allowed-senders", str(config.allowed_senders)]
+    config_args += ["--difficulty", str(config.difficulty)]
+    config_args += ["--mode", config.mode]
+    config_args += ["--acceptance-window", "100"]
+
+    network = ["--tor"]
+    if args.offline:
+        network = ["--hop-latency", str(args.hop_latency)]
+        network += ["--hop-jitter", str(args.hop_jitter)]
+        network += ["--bandwidth", str(args.bandwidth)]
+        network += ["--seed", str(args.seed)]
+    stamp = run_stamp(args, ["benchmark", "latency", *config_args, *network])
+    should_run, previous = previous_run(args, config, filepath, stamp)
+    if not should_run:
+        return
+
+    tor_instances = await pool.acquire_all(
+        [{80: slot.port(i)} for i in range(config.deaddrops)] + [{}]
+    )
+
+    try:
+        deaddrops_tor = tor_instances[: len(tor_instances) - 1]
+        client_tor = tor_instances[-1]
+
+        binary = os.path.abspath("./bin/anonycast")
+        bench_args = ["benchmark", "latency"]
+        if args.drand is not None:
+            bench_args += ["--drand", drand_source(args.drand)]
+        for t in deaddrops_tor:
+            addr = f"127.0.0.1:{t.services[80].local_port}"
+            bench_args += ["--deaddrop-listen-address", addr]
+            bench_args += ["--deaddrop-onion-address", t.services[80].address]
+        bench_args += ["--client-tor-proxy", f"127.0.0.1:{client_tor.socks_port}"]
+        bench_args += config_args
+        bench_args += ["--output", filepath]
+        if args.trace:
+            # the deaddrops run inside the benchmark process
+            bench_args += ["--trace", benchmark_tracepath(bench, config.id(), "benchmark")]
+
+        print(" ".join(bench_args))
+        async with process.ManagedProcess(
+            slot.pin([binary, *bench_args]),
+            log_path=benchmark_logpath(bench, config.id(), "benchmark"),
+        ) as bench_proc, procstat.Sampler(
+            benchmark_resourcespath(bench, config.id()), args.sample_interval
+        ) as sampler:
+            # the deaddrops run inside the benchmark process
+            sampler.watch("benchmark", bench_proc.pid)
+            try:
+                status = await asyncio.wait_for(bench_proc.wait(), timeout=500)
+            except asyncio.TimeoutError:
+                raise Exception("Benchmark execution exceeded 15 minutes and will restart")
+
             if status != 0:
-                raise Exception("failed to run benchmark")
+                raise Exception(
+                    f"failed to run latency benchmark, see {bench_proc.log_path}"
+                )
+    finally:
+        for instance in tor_instances:
+            pool.release(instance)
+    finish_run(filepath, stamp, previous)
 
 
 async def benchmark_latency(args):
+    jobs = []
     for config in generate_latency_configs():
         if args.mode is not None and config.mode != args.mode:  # type: ignore
             continue
-
-        for i in range(5):
-            filepath = benchmark_filepath(f"latency{i}", config.id())
-            if os.path.exists(filepath):
-                print(f"skipping: {config}")
-                continue
-            else:
-                print(f"running: {config}")
-
-            await (await asyncio.create_subprocess_shell("killall tor")).wait()
-            await asyncio.sleep(2)
-
-            keep = True
-            while keep:
-                socks_port = 9000
-                tor_instance_co = []
-                for i in range(config.deaddrops):
-                    tor_instance_co.append(
-                        tor.spawn(socks_port=socks_port, service_ports={80: 5000 + i})
-                    )
-                    socks_port += 1
-                tor_instance_co.append(tor.spawn(socks_port=socks_port))
-
-                try:
-                    tor_instances: list[tor.TorInstance] = await asyncio.wait_for(asyncio.gather(*tor_instance_co), timeout=20)
-                    keep = False 
-                except asyncio.TimeoutError:
-                    print("Refreshing Tor instances")
-                    await (await asyncio.create_subprocess_shell("killall tor")).wait()
-                    await asyncio.sleep(2)
-
-            try:
-                deaddrops_tor = tor_instances[: len(tor_instances) - 1]
-                client_tor = tor_instances[-1]
-
-                binary = os.path.abspath("./bin/anonycast")
-                args = ["benchmark", "latency"]
-                args += ["--deaddrops", str(config.deaddrops)]
-                for t in deaddrops_tor:
-                    addr = f"127.0.0.1:{t.services[80].local_port}"
-                    args += ["--deaddrop-listen-address", addr]
-                    args += ["--deaddrop-onion-address", t.services[80].address]
-                args += ["--client-tor-proxy", f"127.0.0.1:{client_tor.socks_port}"]
-                args += ["--allowed-receivers", str(config.allowed_receivers)]
-                args += ["--allowed-senders", str(config.allowed_senders)]
-                args += ["--difficulty", str(config.difficulty)]
-                args += ["--mode", config.mode]
-                args += ["--acceptance-window", "100"]
-                args += ["--output", filepath]
-
-                print(" ".join(args))
-                proc = await asyncio.create_subprocess_shell(f"{binary} {' '.join(args)}")
-
-                try:
-                    await asyncio.wait_for(proc.wait(), timeout=500)
-                except asyncio.TimeoutError:
-                    raise Exception("Benchmark execution exceeded 15 minutes and will restart")
-                
-                if await proc.wait() != 0:
-                    raise Exception("failed to run latency benchmark")
-            finally:
-                for instance in tor_instances:
-                    instance.close()
+        for i in range(args.repetitions):
+            jobs.append((config, i))
+
+    spawn = tor.spawn
+    if args.offline:
+        model = tor_sim.CircuitModel(
+            hop_latency=args.hop_latency,
+            hop_jitter=args.hop_jitter,
+            bandwidth=args.bandwidth,
+            seed=args.seed,
+        )
+        spawn = functools.partial(tor_sim.spawn, model=model)
+
+    with tor.TorPool(socks_port=SOCKS_BASE_PORT, spawn=spawn) as pool:
+        await run_scheduled(
+            args, jobs, lambda args, job, slot: run_latency(args, job, slot, pool)
+        )
+
+
+def add_convergence_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--convergence",
+        type=float,
+        metavar="TOLERANCE",
+        help="stop each run once the throughput and latency confidence intervals are within this fraction of their mean",
+    )
+    parser.add_argument(
+        "--max-runtime",
+        type=int,
+        default=60,
+        help="runtime in seconds of runs that do not converge",
+    )
+
+
+def add_adaptive_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        default=False,
+        help="search the client count where throughput stops scaling instead of running every count",
+    )
+    parser.add_argument(
+        "--adaptive-gain",
+        type=float,
+        default=sweep.KneeSearch.gain,
+        help="throughput gain needed when doubling the clients to keep scaling",
+    )
+    parser.add_argument(
+        "--adaptive-tolerance",
+        type=float,
+        default=sweep.KneeSearch.tolerance,
+        help="the knee is the smallest client count within this fraction of the plateau",
+    )
+
+
+async def refresh_catalog(args):
+    with catalog.Catalog("benchmark") as c:
+        parsed = c.refresh()
+    print(f"cataloged {parsed} new or changed results")
 
 
 async def main():
@@ -430,21 +1114,200 @@ async def main():
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--cluster", action="store_true", default=False)
+    parser.add_argument(
+        "--nodes",
+        default=None,
+        help="comma separated hostnames used instead of the job machines, implies --cluster. The deaddrop runs on the first one and the clients are split over the other ones, localhost can be repeated",
+    )
+    parser.add_argument(
+        "--start-delay",
+        type=float,
+        default=10.0,
+        help="seconds between starting the load generator nodes and the start shared by their clients, on top of the time the clients take to connect",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of configs to run at the same time, each on its own ports and cpus",
+    )
+    parser.add_argument(
+        "--sample-interval",
+        type=float,
+        default=0.5,
+        help="seconds between samples of the cpu/memory of the local processes, 0 to disable",
+    )
+    parser.add_argument(
+        "--futex-trace",
+        action="store_true",
+        default=False,
+        help="strace the futex calls of local deaddrop workers to benchmark/<bench>/futex",
+    )
+    parser.add_argument(
+        "--document-log",
+        action="store_true",
+        default=False,
+        help="keep the published documents of the deaddrop in a log under benchmark/<bench>/documents instead of in memory, removed after each run",
+    )
+    parser.add_argument(
+        "--drand",
+        default=None,
+        help="drand source of the deaddrops and clients, `local` to run without network access or `replay:<path>` for a recording made with `anonycast drand-record`, replayed from the start of every run and long enough for one (the path must exist on every node)",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        default=False,
+        help="record the spans of the deaddrop requests to benchmark/<bench>/traces, see scripts/trace-stages.py",
+    )
+    parser.add_argument(
+        "--rerun-changed",
+        action="store_true",
+        default=False,
+        help="only run the configs whose results were produced by another binary, arguments or host, the previous results are kept under benchmark/previous/<binary> for comparison",
+    )
     subparsers = parser.add_subparsers(title="subcommand", required=True)
 
     publish_troughput_parser = subparsers.add_parser("publish-troughput")
+    publish_troughput_parser.add_argument(
+        "--output-format", choices=list(RESULT_EXTENSIONS), default="json"
+    )
+    publish_troughput_parser.add_argument(
+        "--stats-snapshot",
+        action="store_true",
+        default=False,
+        help="record latency percentiles of every second to benchmark/<bench>/stats",
+    )
+    add_adaptive_arguments(publish_troughput_parser)
+    add_convergence_arguments(publish_troughput_parser)
     publish_troughput_parser.set_defaults(entry=benchmark_publish_troughput)
 
     retreive_troughput_parser = subparsers.add_parser("retreive-troughput")
+    retreive_troughput_parser.add_argument(
+        "--output-format", choices=list(RESULT_EXTENSIONS), default="json"
+    )
+    retreive_troughput_parser.add_argument(
+        "--stats-snapshot",
+        action="store_true",
+        default=False,
+        help="record latency percentiles of every second to benchmark/<bench>/stats",
+    )
+    retreive_troughput_parser.add_argument(
+        "--background",
+        action="store_true",
+        default=False,
+        help="only run configs where the deaddrop already stores many documents of older rounds of the fetched topic",
+    )
+    retreive_troughput_parser.add_argument(
+        "--pipeline",
+        type=int,
+        default=None,
+        help="compare a client with this many fetches in flight to one fetching one at a time, at 1, 10 and 100 messages",
+    )
+    add_adaptive_arguments(retreive_troughput_parser)
+    add_convergence_arguments(retreive_troughput_parser)
     retreive_troughput_parser.set_defaults(entry=benchmark_retreive_troughput)
 
     latency_parser = subparsers.add_parser("latency")
     latency_parser.add_argument("--mode", type=str)
+    latency_parser.add_argument("--repetitions", type=int, default=5)
+    latency_parser.add_argument(
+        "--offline",
+        action="store_true",
+        default=False,
+        help="use a simulated tor network instead of tor, results go to benchmark/latency-offline*",
+    )
+    latency_parser.add_argument(
+        "--hop-latency", type=float, default=tor_sim.CircuitModel.hop_latency
+    )
+    latency_parser.add_argument(
+        "--hop-jitter", type=float, default=tor_sim.CircuitModel.hop_jitter
+    )
+    latency_parser.add_argument(
+        "--bandwidth", type=float, default=tor_sim.CircuitModel.bandwidth
+    )
+    latency_parser.add_argument("--seed", type=int)
     latency_parser.set_defaults(entry=benchmark_latency)
 
+    rate_sweep_parser = subparsers.add_parser(
+        "rate-sweep",
+        help="open-loop runs at an increasing offered load, until past saturation",
+    )
+    rate_sweep_parser.add_argument(
+        "--bench", choices=["publish", "retreive"], default="retreive"
+    )
+    rate_sweep_parser.add_argument(
+        "--clients",
+        type=int,
+        default=16,
+        help="clients sharing the offered load",
+    )
+    rate_sweep_parser.add_argument("--message-size", type=int, default=1024)
+    rate_sweep_parser.add_argument(
+        "--message-count",
+        type=int,
+        default=10,
+        help="messages returned by each retrieval",
+    )
+    rate_sweep_parser.add_argument(
+        "--arrival", choices=ARRIVALS, default=ARRIVAL_POISSON
+    )
+    rate_sweep_parser.add_argument(
+        "--start-rate",
+        type=float,
+        default=100.0,
+        help="offered requests per second of the first step",
+    )
+    rate_sweep_parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=10.0**6,
+        help="offered requests per second after which the sweep stops even if not saturated",
+    )
+    rate_sweep_parser.add_argument(
+        "--rate-factor",
+        type=float,
+        default=sweep.RateSweep.factor,
+        help="each step multiplies the offered load by this factor",
+    )
+    rate_sweep_parser.add_argument(
+        "--saturation-tolerance",
+        type=float,
+        default=sweep.RateSweep.tolerance,
+        help="a step is saturated when its goodput is below the offered load by more than this fraction, or when requests are still in flight at the end",
+    )
+    rate_sweep_parser.add_argument(
+        "--past-saturation",
+        type=int,
+        default=sweep.RateSweep.past_saturation,
+        help="steps to run after the first saturated one",
+    )
+    rate_sweep_parser.add_argument(
+        "--output-format", choices=list(RESULT_EXTENSIONS), default="json"
+    )
+    rate_sweep_parser.add_argument(
+        "--stats-snapshot",
+        action="store_true",
+        default=False,
+        help="record latency percentiles of every second to benchmark/<bench>/stats",
+    )
+    add_convergence_arguments(rate_sweep_parser)
+    rate_sweep_parser.set_defaults(entry=benchmark_rate_sweep)
+
+    catalog_parser = subparsers.add_parser(
+        "catalog", help="index the results that are not in the catalog yet"
+    )
+    catalog_parser.set_defaults(entry=refresh_catalog)
+
     while True:
         try:
             args = parser.parse_args()
+            args.cluster = args.cluster or args.nodes is not None
+            if args.rerun_changed and getattr(args, "adaptive", False):
+                parser.error("--rerun-changed cannot search the knee with --adaptive")
+            if args.rerun_changed and args.entry is benchmark_rate_sweep:
+                parser.error("--rerun-changed cannot step the offered load of rate-sweep")
+            await process.reap_orphans()
             await args.entry(args)
             break
         except Exception as e:
@@ -453,4 +1316,3 @@ async def main():
 
 if __name__ == "__main__":
     asyncio.run(main())
-
@@ -0,0 +1,144 @@
+import os
+import dataclasses
+
+import numpy as np
+import pandas as pd
+
+from typing import Optional
+
+from lib import results
+
+PERCENTILES = {"p50": 50.0, "p99": 99.0, "p999": 99.9}
+
+
+def duration(r: results.Results) -> float:
+    if len(r) == 0:
+        return 0.0
+    return float(r.timestamp.max() - r.timestamp.min())
+
+
+def throughput(r: results.Results) -> float:
+    """
+    Rows per second over the span of the timestamps
+    """
+    d = duration(r)
+    return len(r) / d if d > 0 else float("nan")
+
+
+def windowed_throughput(r: results.Results, window: float = 1.0) -> pd.Series:
+    """
+    Rows per second in consecutive windows of `window` seconds, indexed by the
+    start of the window relative to the first timestamp
+    """
+    if len(r) == 0:
+        return pd.Series(dtype=float)
+    offsets = r.timestamp - r.timestamp.min()
+    counts = np.bincount((offsets // window).astype(np.int64))
+    return pd.Series(counts / window, index=np.arange(len(counts)) * window)
+
+
+def latency_percentiles(r: results.Results) -> dict[str, float]:
+    if len(r) == 0:
+        return {k: float("nan") for k in PERCENTILES}
+    values = np.percentile(r.latency, list(PERCENTILES.values()))
+    return dict(zip(PERCENTILES, values.tolist()))
+
+
+def fairness(r: results.Results) -> float:
+    """
+    Jain's fairness index of the rows per client, 1 when every client got the
+    same share and 1/n when a single client got everything
+    """
+    clients = int(r.meta.get("clients", 0))
+    counts = np.bincount(r.client, minlength=clients).astype(np.float64)
+    if counts.sum() == 0:
+        return float("nan")
+    return float(counts.sum() ** 2 / (len(counts) * (counts**2).sum()))
+
+
+def trim_warmup(
+    r: results.Results,
+    seconds: Optional[float] = None,
+    window: float = 1.0,
+    threshold: float = 0.9,
+) -> results.Results:
+    """
+    Drop the rows of the first `seconds` of the run. When `seconds` is None the
+    warm-up end recorded by a run until convergence is used, otherwise warm-up
+    ends with the first window reaching `threshold` times the median windowed
+    throughput.
+    """
+    if len(r) == 0:
+        return r
+    if seconds is None and r.meta.get("warmup_end") is not None:
+        seconds = r.meta["warmup_end"] - float(r.timestamp.min())
+    if seconds is None:
+        rates = windowed_throughput(r, window)
+        steady = rates.to_numpy() >= threshold * rates.median()
+        seconds = float(rates.index[np.argmax(steady)])
+    keep = r.timestamp >= r.timestamp.min() + seconds
+    return dataclasses.replace(
+        r,
+        client=r.client[keep],
+        index=r.index[keep],
+        timestamp=r.timestamp[keep],
+        latency=r.latency[keep],
+    )
+
+
+def summarize(r: results.Results) -> dict:
+    """
+    Config fields and aggregates of a run, one row of `read_summaries`
+    """
+    summary = dict(r.meta)
+    summary["rows"] = len(r)
+    summary["duration"] = duration(r)
+    summary["throughput"] = throughput(r)
+    if len(r) > 0:
+        summary["latency_mean"] = float(r.latency.mean())
+        summary["latency_min"] = float(r.latency.min())
+        summary["latency_max"] = float(r.latency.max())
+        summary["fairness"] = fairness(r)
+    summary.update(latency_percentiles(r))
+    return summary
+
+
+def read_summaries(directory: str, warmup: Optional[float] = 0.0) -> pd.DataFrame:
+    """
+    Summaries of every result in `directory`, `warmup` is passed to `trim_warmup`
+    """
+    rows = []
+    for filename in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(filename)
+        if extension not in [".json", ".bin"]:
+            continue
+        r = results.read(os.path.join(directory, filename))
+        if warmup != 0.0:
+            r = trim_warmup(r, warmup)
+        rows.append({"id": stem, **summarize(r)})
+    return pd.DataFrame(rows)
+
+
+def pivot(
+    df: pd.DataFrame, x: str, y: str, z: str, aggfunc="mean", fill_value=None
+) -> pd.DataFrame:
+    """
+    Values of `z` with one row per value of `y` and one column per value of `x`
+    """
+    return df.pivot_table(
+        index=y, columns=x, values=z, aggfunc=aggfunc, fill_value=fill_value
+    ).sort_index(axis=0).sort_index(axis=1)
+
+
+def surface(
+    coordinates: list[tuple], fill_value=0.0
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Meshgrid X, Y and matching Z of a list of (x, y, z), as expected by
+    `plot_surface`. Missing points are set to `fill_value` and the last z wins
+    when a point appears more than once.
+    """
+    df = pd.DataFrame(coordinates, columns=["x", "y", "z"])
+    table = pivot(df, "x", "y", "z", aggfunc="last", fill_value=fill_value)
+    X, Y = np.meshgrid(table.columns.to_numpy(), table.index.to_numpy())
+    return X, Y, table.to_numpy()
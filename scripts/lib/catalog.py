@@ -0,0 +1,253 @@
+import os
+import re
+import sqlite3
+
+import numpy as np
+
+from typing import Optional
+
+from lib import procstat, provenance, results
+
+CATALOG_FILENAME = "catalog.sqlite"
+
+# bump when the schema or the aggregates change, the catalog is then rebuilt
+SCHEMA_VERSION = 8
+
+# fields of PublishConfig, RetreiveConfig and LatencyConfig, read from the results
+CONFIG_FIELDS = {
+    "clients": "INTEGER",
+    "message_size": "INTEGER",
+    "message_count": "INTEGER",
+    "background_documents": "INTEGER",
+    "pipeline": "INTEGER",
+    "mode": "TEXT",
+    "deaddrops": "INTEGER",
+    "allowed_receivers": "INTEGER",
+    "allowed_senders": "INTEGER",
+    "difficulty": "INTEGER",
+    # open-loop runs only
+    "client_rate": "REAL",
+    "arrival": "TEXT",
+}
+
+AGGREGATE_FIELDS = {
+    "rows": "INTEGER",
+    "duration": "REAL",
+    "throughput": "REAL",
+    "latency_mean": "REAL",
+    "latency_min": "REAL",
+    "latency_max": "REAL",
+    "latency_p50": "REAL",
+    "latency_p99": "REAL",
+    "latency_p999": "REAL",
+    # rows over the span from the first send to the last completion, below the
+    # offered load of an open-loop run once the deaddrop saturates
+    "goodput": "REAL",
+    # requests of an open-loop run still in flight at its end
+    "unfinished": "INTEGER",
+    "publish_latency": "REAL",
+    "retreive_latency": "REAL",
+    # seconds spent preparing the messages of publish runs, before the measured phase
+    "preparation_time": "REAL",
+    # only set for runs until convergence
+    "warmup_end": "REAL",
+    "converged": "INTEGER",
+    # from the resources sampled next to the results, see procstat
+    "deaddrop_rss_kb": "INTEGER",
+    # sha256 of the binary of the run, see provenance
+    "binary": "TEXT",
+}
+
+RESULT_EXTENSIONS = [".json", ".bin"]
+
+# per process logs, stats snapshots, futex and span traces, document logs of the
+# deaddrop, results of the load generator nodes that are merged into a single results
+# file, provenance stamps and the results replaced by a run with another stamp
+SKIPPED_DIRS = [
+    "logs",
+    "stats",
+    "futex",
+    "traces",
+    "documents",
+    "nodes",
+    "provenance",
+    "previous",
+]
+
+# latency3 -> (latency, 3)
+_REPETITION_RE = re.compile(r"^(.*?)(\d+)$")
+
+
+class Catalog:
+    """
+    SQLite index of the results under a benchmark directory. Every result file is
+    one row of the `runs` table with its config fields and precomputed aggregates,
+    a file is only parsed again when its size or mtime changes.
+    """
+
+    def __init__(self, root: str = "benchmark"):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(self.root, CATALOG_FILENAME))
+        self.connection.row_factory = sqlite3.Row
+        self._create_schema()
+
+    def update(self, path: str) -> bool:
+        """
+        Add or refresh the row of a results file, returns whether it was parsed
+        """
+        path = os.path.abspath(path)
+        key = os.path.relpath(path, self.root)
+        stat = os.stat(path)
+        row = self.connection.execute(
+            "SELECT mtime_ns, size FROM runs WHERE path = ?", (key,)
+        ).fetchone()
+        if row is not None and (row["mtime_ns"], row["size"]) == (
+            stat.st_mtime_ns,
+            stat.st_size,
+        ):
+            return False
+
+        directory = os.path.basename(os.path.dirname(path))
+        bench, repetition = directory, None
+        match = _REPETITION_RE.match(directory)
+        if match is not None:
+            bench, repetition = match.group(1), int(match.group(2))
+
+        r = results.read(path)
+        values = {
+            "path": key,
+            "bench": bench,
+            "repetition": repetition,
+            "config_id": os.path.splitext(os.path.basename(path))[0],
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+        }
+        values.update({k: r.meta.get(k) for k in CONFIG_FIELDS})
+        values.update(_aggregates(r))
+        values["deaddrop_rss_kb"] = procstat.read_peak_rss_kb(
+            os.path.splitext(path)[0] + ".resources.csv", "deaddrop"
+        )
+        stamp = provenance.read(path)
+        values["binary"] = stamp.binary if stamp is not None else None
+
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" for _ in values)
+        with self.connection:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO runs ({columns}) VALUES ({placeholders})",
+                list(values.values()),
+            )
+        return True
+
+    def get(self, path: str) -> dict:
+        """
+        Row of a results file, parsed first if it is not up to date
+        """
+        self.update(path)
+        key = os.path.relpath(os.path.abspath(path), self.root)
+        return self.query("SELECT * FROM runs WHERE path = ?", (key,))[0]
+
+    def refresh(self) -> int:
+        """
+        Bring the catalog in sync with the results on disk, returns the number of
+        files that were parsed
+        """
+        seen = set()
+        parsed = 0
+        for directory, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d not in SKIPPED_DIRS]
+            for filename in filenames:
+                if os.path.splitext(filename)[1] not in RESULT_EXTENSIONS:
+                    continue
+                path = os.path.join(directory, filename)
+                seen.add(os.path.relpath(path, self.root))
+                try:
+                    parsed += self.update(path)
+                except Exception as e:
+                    print(f"failed to catalog {path}: {e}")
+
+        stale = [
+            row["path"]
+            for row in self.connection.execute("SELECT path FROM runs")
+            if row["path"] not in seen
+        ]
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM runs WHERE path = ?", [(p,) for p in stale]
+            )
+        return parsed
+
+    def query(self, sql: str, parameters=()) -> list[dict]:
+        return [dict(row) for row in self.connection.execute(sql, parameters)]
+
+    def close(self):
+        self.connection.close()
+
+    def _create_schema(self):
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        with self.connection:
+            if version != SCHEMA_VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS runs")
+            fields = {**CONFIG_FIELDS, **AGGREGATE_FIELDS}
+            self.connection.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS runs (
+                    path TEXT PRIMARY KEY,
+                    bench TEXT NOT NULL,
+                    repetition INTEGER,
+                    config_id TEXT NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    {", ".join(f"{k} {t}" for k, t in fields.items())}
+                )
+                """
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS runs_size ON runs (bench, message_size, clients)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS runs_config ON runs (bench, config_id)"
+            )
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def summarize(path: str) -> dict[str, Optional[float]]:
+    """
+    Aggregates of a results file without adding it to a catalog
+    """
+    return _aggregates(results.read(path))
+
+
+def _aggregates(r: results.Results) -> dict[str, Optional[float]]:
+    aggregates: dict[str, Optional[float]] = {k: None for k in AGGREGATE_FIELDS}
+    aggregates["rows"] = len(r)
+    aggregates["publish_latency"] = r.meta.get("publish_latency")
+    aggregates["retreive_latency"] = r.meta.get("retreive_latency")
+    aggregates["preparation_time"] = r.meta.get("preparation_time")
+    aggregates["warmup_end"] = r.meta.get("warmup_end")
+    aggregates["converged"] = r.meta.get("converged")
+    aggregates["unfinished"] = r.meta.get("unfinished")
+    if len(r) == 0:
+        return aggregates
+
+    # same definition as the notebooks: rows over the span of their timestamps
+    duration = float(np.max(r.timestamp) - np.min(r.timestamp))
+    aggregates["duration"] = duration
+    aggregates["throughput"] = len(r) / duration if duration > 0 else None
+    aggregates["latency_mean"] = float(np.mean(r.latency))
+    aggregates["latency_min"] = float(np.min(r.latency))
+    aggregates["latency_max"] = float(np.max(r.latency))
+    p50, p99, p999 = np.percentile(r.latency, [50, 99, 99.9])
+    aggregates["latency_p50"] = float(p50)
+    aggregates["latency_p99"] = float(p99)
+    aggregates["latency_p999"] = float(p999)
+    span = float(np.max(r.timestamp + r.latency) - np.min(r.timestamp))
+    aggregates["goodput"] = len(r) / span if span > 0 else None
+    return aggregates
@@ -0,0 +1,113 @@
+import time
+import socket
+import asyncio
+
+import numpy as np
+
+from dataclasses import dataclass
+
+from lib import results
+
+# hostnames that run on this machine without oarsh, several localhost nodes can be
+# given to test a distributed run on a single machine
+LOCAL_HOSTS = {"localhost", "127.0.0.1"}
+
+
+def is_local(node: str) -> bool:
+    return node in LOCAL_HOSTS or node == socket.gethostname()
+
+
+@dataclass(kw_only=True, frozen=True)
+class Share:
+    node: str
+    # global id of the first client of the node
+    client_offset: int
+    clients: int
+
+
+def client_shares(nodes: list[str], clients: int) -> list[Share]:
+    """
+    Split the clients over the load generator nodes, the first nodes get one more
+    client when they do not divide evenly. Nodes without clients are left out.
+    """
+    per_node, remainder = divmod(clients, len(nodes))
+    shares = []
+    offset = 0
+    for i, node in enumerate(nodes):
+        count = per_node + (1 if i < remainder else 0)
+        if count > 0:
+            shares.append(Share(node=node, client_offset=offset, clients=count))
+        offset += count
+    return shares
+
+
+async def clock_offset(node: str, rounds: int = 8) -> float:
+    """
+    Offset in seconds of the clock of `node` relative to the local clock, estimated
+    NTP style from the round with the smallest round trip time
+    """
+    if is_local(node):
+        return 0.0
+
+    process = await asyncio.create_subprocess_exec(
+        "oarsh",
+        node,
+        "while read _; do date +%s.%N; done",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+    )
+    assert process.stdin is not None and process.stdout is not None
+    try:
+        best = None
+        for _ in range(rounds):
+            sent = time.time()
+            process.stdin.write(b"\n")
+            await process.stdin.drain()
+            line = await process.stdout.readline()
+            received = time.time()
+            if len(line) == 0:
+                raise Exception(f"failed to read the clock of {node}")
+            remote = float(line.decode("utf-8"))
+            rtt = received - sent
+            if best is None or rtt < best[0]:
+                best = (rtt, remote - (sent + received) / 2)
+        assert best is not None
+        return best[1]
+    finally:
+        process.stdin.close()
+        await process.wait()
+
+
+def merge(parts: list[tuple[results.Results, float]]) -> results.Results:
+    """
+    Merge the results of the load generator nodes of a run, each with the clock
+    offset of its node. Timestamps are moved to the local clock and clients keep
+    the global ids they were started with.
+    """
+    assert len(parts) > 0
+    meta = dict(parts[0][0].meta)
+    meta["clients"] = sum(r.meta["clients"] for r, _ in parts)
+
+    warmup_ends = [
+        r.meta["warmup_end"] - offset
+        for r, offset in parts
+        if r.meta.get("warmup_end") is not None
+    ]
+    if "warmup_end" in meta:
+        meta["warmup_end"] = max(warmup_ends) if len(warmup_ends) > 0 else None
+    if "converged" in meta:
+        meta["converged"] = all(r.meta.get("converged") for r, _ in parts)
+    if "unfinished" in meta:
+        meta["unfinished"] = sum(r.meta.get("unfinished") or 0 for r, _ in parts)
+
+    timestamp = np.concatenate([r.timestamp - offset for r, offset in parts])
+    order = np.argsort(timestamp, kind="stable")
+    return results.Results(
+        meta=meta,
+        columns=parts[0][0].columns,
+        client=np.concatenate([r.client for r, _ in parts])[order],
+        index=np.concatenate([r.index for r, _ in parts])[order],
+        timestamp=timestamp[order],
+        latency=np.concatenate([r.latency for r, _ in parts])[order],
+    )
+
@@ -0,0 +1,79 @@
+import math
+
+from typing import Optional
+
+
+class LogHistogram:
+    """
+    Histogram with `sub_buckets` linear buckets per power of two, the relative
+    error of a quantile is at most 1 / (2 * sub_buckets). Memory only depends on
+    the range of the values, not on how many were recorded.
+    """
+
+    def __init__(self, sub_buckets: int = 16):
+        self.sub_buckets = sub_buckets
+        self.buckets: dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def record(self, value: float, count: int = 1):
+        if value < 0:
+            raise Exception(f"negative value in histogram: {value}")
+        if value == 0:
+            self.zeros += count
+        else:
+            key = self._key(value)
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "LogHistogram"):
+        assert self.sub_buckets == other.sub_buckets
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        for v in [other.min, other.max]:
+            if v is not None:
+                self.min = v if self.min is None else min(self.min, v)
+                self.max = v if self.max is None else max(self.max, v)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else float("nan")
+
+    def quantile(self, q: float) -> float:
+        """
+        Midpoint of the bucket holding the `q` quantile, clamped to min/max
+        """
+        if self.count == 0:
+            return float("nan")
+        assert self.min is not None and self.max is not None
+        rank = max(1, math.ceil(q * self.count))
+        seen = self.zeros
+        if seen >= rank:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen >= rank:
+                low, high = self._bounds(key)
+                return min(max((low + high) / 2, self.min), self.max)
+        return self.max
+
+    def _key(self, value: float) -> int:
+        # value = mantissa * 2**exponent with mantissa in [0.5, 1)
+        mantissa, exponent = math.frexp(value)
+        sub = min(int((mantissa - 0.5) * 2 * self.sub_buckets), self.sub_buckets - 1)
+        return exponent * self.sub_buckets + sub
+
+    def _bounds(self, key: int) -> tuple[float, float]:
+        exponent, sub = divmod(key, self.sub_buckets)
+        width = math.ldexp(0.5 / self.sub_buckets, exponent)
+        low = math.ldexp(0.5, exponent) + sub * width
+        return low, low + width
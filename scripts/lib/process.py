@@ -0,0 +1,210 @@
+import os
+import shlex
+import signal
+import asyncio
+import logging
+
+from typing import Optional
+
+# every spawned process leaves a file here until it has been reaped, so processes
+# leaked by a crashed run can be killed by pid on the next run
+PIDS_DIR = ".cache/pids"
+
+
+class ManagedProcess:
+    """
+    A process that is started on the local machine or, when `host` is set, on a
+    cluster machine through oarsh. Its output is written to `log_path` and it is
+    always stopped by pid when leaving the context manager.
+    """
+
+    def __init__(
+        self,
+        argv: list[str],
+        *,
+        host: Optional[str] = None,
+        log_path: Optional[str] = None,
+        stop_timeout: float = 5.0,
+    ):
+        self.argv = argv
+        self.host = host
+        self.log_path = log_path
+        self.stop_timeout = stop_timeout
+        self.pid: Optional[int] = None
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._log = None
+        self._pump: Optional[asyncio.Task] = None
+        self._pidfile: Optional[str] = None
+
+    async def start(self):
+        if self.log_path is not None:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            self._log = open(self.log_path, "wb")
+        output = self._log if self._log is not None else asyncio.subprocess.DEVNULL
+
+        if self.host is None:
+            self._process = await asyncio.create_subprocess_exec(
+                *self.argv, stdout=output, stderr=output
+            )
+            self.pid = self._process.pid
+        else:
+            # the remote shell prints its pid and then becomes the command
+            remote_cmd = f"echo $$; exec {shlex.join(self.argv)} 2>&1"
+            self._process = await asyncio.create_subprocess_exec(
+                "oarsh",
+                self.host,
+                remote_cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+            assert self._process.stdout is not None
+            line = await self._process.stdout.readline()
+            if len(line) == 0:
+                raise Exception(f"failed to start {self.argv[0]} on {self.host}")
+            self.pid = int(line.decode("utf-8").strip())
+            self._pump = asyncio.create_task(self._pump_output(self._process.stdout))
+
+        self._pidfile = _write_pidfile(self.host, self.pid, self.argv)
+        logging.debug(f"started {self.argv} on {self.host or 'localhost'}: pid {self.pid}")
+
+    async def wait(self) -> int:
+        assert self._process is not None
+        status = await self._process.wait()
+        if self._pump is not None:
+            await self._pump
+        return status
+
+    def running(self) -> bool:
+        return self._process is not None and self._process.returncode is None
+
+    async def stop(self):
+        """
+        Ask the process to terminate, kill it if it is still alive after `stop_timeout`
+        """
+        if self._process is None:
+            return
+        try:
+            if self.running():
+                await self._signal(signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(self._process.wait(), timeout=self.stop_timeout)
+                except asyncio.TimeoutError:
+                    logging.warning(f"pid {self.pid} did not terminate, killing it")
+                    await self._signal(signal.SIGKILL)
+                    await self._process.wait()
+            if self._pump is not None:
+                await self._pump
+        finally:
+            if self._log is not None:
+                self._log.close()
+            if self._pidfile is not None:
+                os.remove(self._pidfile)
+                self._pidfile = None
+
+    async def _signal(self, sig: signal.Signals):
+        assert self._process is not None
+        if self.host is None:
+            try:
+                self._process.send_signal(sig)
+            except ProcessLookupError:
+                pass
+        else:
+            await _run_quiet("oarsh", self.host, f"kill -{sig.name[3:]} {self.pid}")
+
+    async def _pump_output(self, stream: asyncio.StreamReader):
+        while True:
+            chunk = await stream.read(64 * 1024)
+            if len(chunk) == 0:
+                break
+            if self._log is not None:
+                self._log.write(chunk)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_):
+        await self.stop()
+
+
+class DeaddropProcess(ManagedProcess):
+    """
+    A deaddrop process that is only considered started once its listener accepts
+    connections on `address`
+    """
+
+    def __init__(
+        self,
+        argv: list[str],
+        *,
+        address: tuple[str, int],
+        ready_timeout: float = 30.0,
+        **kwargs,
+    ):
+        super().__init__(argv, **kwargs)
+        self.address = address
+        self.ready_timeout = ready_timeout
+
+    async def start(self):
+        await super().start()
+        try:
+            await asyncio.wait_for(self._wait_ready(), timeout=self.ready_timeout)
+        except BaseException:
+            await self.stop()
+            raise
+
+    async def _wait_ready(self):
+        host, port = self.address
+        while True:
+            if not self.running():
+                raise Exception(
+                    f"deaddrop exited before listening on {host}:{port}, see {self.log_path}"
+                )
+            try:
+                _reader, writer = await asyncio.open_connection(host, port)
+            except OSError:
+                await asyncio.sleep(0.05)
+                continue
+            writer.close()
+            await writer.wait_closed()
+            return
+
+
+async def reap_orphans():
+    """
+    Kill processes left behind by a previous run that did not stop them
+    """
+    if not os.path.isdir(PIDS_DIR):
+        return
+    for filename in os.listdir(PIDS_DIR):
+        path = os.path.join(PIDS_DIR, filename)
+        host, pid = filename.rsplit("-", 1)
+        with open(path, "r") as f:
+            name = os.path.basename(f.readline().strip())
+        # only kill the pid if it still belongs to the program we started
+        check_and_kill = f"grep -q {shlex.quote(name)} /proc/{pid}/cmdline && kill -KILL {pid}"
+        if host == "localhost":
+            await _run_quiet("sh", "-c", check_and_kill)
+        else:
+            await _run_quiet("oarsh", host, check_and_kill)
+        logging.info(f"reaped {name} with pid {pid} on {host}")
+        os.remove(path)
+
+
+def _write_pidfile(host: Optional[str], pid: int, argv: list[str]) -> str:
+    os.makedirs(PIDS_DIR, exist_ok=True)
+    program = argv[0]
+    # taskset execs into the actual program
+    if program == "taskset":
+        program = argv[3]
+    path = os.path.join(PIDS_DIR, f"{host or 'localhost'}-{pid}")
+    with open(path, "w") as f:
+        f.write(program + "\n")
+    return path
+
+
+async def _run_quiet(*argv: str) -> int:
+    proc = await asyncio.create_subprocess_exec(
+        *argv, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+    )
+    return await proc.wait()
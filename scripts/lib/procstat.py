@@ -0,0 +1,231 @@
+import os
+import csv
+import time
+import asyncio
+import logging
+
+from typing import Optional
+from dataclasses import dataclass
+
+# threads of the deaddrop that handle the requests, see anonycast/src/deaddrop.rs
+WORKER_THREAD = "deaddrop-worker"
+
+COLUMNS = [
+    "elapsed",
+    "process",
+    "threads",
+    "workers",
+    # cores used during the interval
+    "cpu",
+    "worker_cpu",
+    # busiest worker thread, close to 1 when a single worker is saturated
+    "worker_cpu_max",
+    "rss_kb",
+    "hwm_kb",
+    # context switches per second during the interval
+    "voluntary_switches",
+    "involuntary_switches",
+    "worker_voluntary_switches",
+]
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+@dataclass(kw_only=True, frozen=True)
+class ProcessSample:
+    time: float
+    threads: int
+    # cpu seconds of the process and of each worker thread by tid
+    cpu: float
+    worker_cpu: dict[int, float]
+    rss_kb: int
+    hwm_kb: int
+    voluntary_switches: int
+    involuntary_switches: int
+    worker_voluntary_switches: int
+
+
+def read_process(pid: int) -> ProcessSample:
+    """
+    Read the counters of a local process from /proc, raises OSError once it exited
+    """
+    now = time.monotonic()
+    _comm, stat = _read_stat(f"/proc/{pid}/stat")
+    status = _read_status(f"/proc/{pid}/status")
+
+    worker_cpu = {}
+    worker_voluntary_switches = 0
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            comm, task_stat = _read_stat(f"/proc/{pid}/task/{tid}/stat")
+            if comm != WORKER_THREAD:
+                continue
+            worker_cpu[int(tid)] = _cpu_seconds(task_stat)
+            task_status = _read_status(f"/proc/{pid}/task/{tid}/status")
+            worker_voluntary_switches += task_status["voluntary_ctxt_switches"]
+        except FileNotFoundError:
+            # the thread exited
+            continue
+
+    return ProcessSample(
+        time=now,
+        # fields are numbered from the state, see proc_pid_stat(5)
+        threads=int(stat[17]),
+        cpu=_cpu_seconds(stat),
+        worker_cpu=worker_cpu,
+        rss_kb=status.get("VmRSS", 0),
+        hwm_kb=status.get("VmHWM", 0),
+        voluntary_switches=status["voluntary_ctxt_switches"],
+        involuntary_switches=status["nonvoluntary_ctxt_switches"],
+        worker_voluntary_switches=worker_voluntary_switches,
+    )
+
+
+def worker_tids(pid: int) -> list[int]:
+    """
+    Thread ids of the deaddrop workers of a local process
+    """
+    tids = []
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            comm, _stat = _read_stat(f"/proc/{pid}/task/{tid}/stat")
+        except FileNotFoundError:
+            continue
+        if comm == WORKER_THREAD:
+            tids.append(int(tid))
+    return sorted(tids)
+
+
+class Sampler:
+    """
+    Periodically samples the cpu, memory and context switches of local processes
+    and appends them to a csv file, one row per process and interval.
+    Nothing is sampled when `interval` is 0.
+    """
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self.pids: dict[str, int] = {}
+        self.peak_rss_kb: dict[str, int] = {}
+        self._previous: dict[str, ProcessSample] = {}
+        self._start = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._file = None
+        self._writer = None
+
+    def watch(self, name: str, pid: Optional[int]):
+        if pid is None:
+            return
+        self.pids[name] = pid
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for name, rss_kb in self.peak_rss_kb.items():
+            print(f"peak rss {name}: {rss_kb / 1024:.1f} MiB")
+
+    async def _run(self):
+        while True:
+            self._sample()
+            await asyncio.sleep(self.interval)
+
+    def _sample(self):
+        assert self._writer is not None and self._file is not None
+        for name, pid in list(self.pids.items()):
+            try:
+                sample = read_process(pid)
+            except OSError:
+                logging.debug(f"stopped sampling {name}: pid {pid} exited")
+                del self.pids[name]
+                continue
+
+            self.peak_rss_kb[name] = max(self.peak_rss_kb.get(name, 0), sample.hwm_kb)
+            previous = self._previous.get(name)
+            self._previous[name] = sample
+            if previous is None:
+                continue
+
+            dt = sample.time - previous.time
+            worker_cpu = [
+                cpu - previous.worker_cpu.get(tid, 0.0)
+                for tid, cpu in sample.worker_cpu.items()
+            ]
+            self._writer.writerow(
+                [
+                    f"{sample.time - self._start:.3f}",
+                    name,
+                    sample.threads,
+                    len(sample.worker_cpu),
+                    f"{(sample.cpu - previous.cpu) / dt:.3f}",
+                    f"{sum(worker_cpu) / dt:.3f}",
+                    f"{max(worker_cpu, default=0.0) / dt:.3f}",
+                    sample.rss_kb,
+                    sample.hwm_kb,
+                    f"{(sample.voluntary_switches - previous.voluntary_switches) / dt:.1f}",
+                    f"{(sample.involuntary_switches - previous.involuntary_switches) / dt:.1f}",
+                    f"{(sample.worker_voluntary_switches - previous.worker_voluntary_switches) / dt:.1f}",
+                ]
+            )
+        self._file.flush()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *_):
+        await self.stop()
+
+
+def read_peak_rss_kb(path: str, process: str) -> Optional[int]:
+    """
+    Highest resident set size of a process in a csv written by a `Sampler`, None when
+    it was not sampled
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", newline="") as f:
+        peaks = [int(row["hwm_kb"]) for row in csv.DictReader(f) if row["process"] == process]
+    return max(peaks, default=None)
+
+
+def _read_stat(path: str) -> tuple[str, list[str]]:
+    with open(path, "r") as f:
+        content = f.read()
+    # the command name is between parentheses and may contain spaces
+    start = content.index("(")
+    end = content.rindex(")")
+    return content[start + 1 : end], content[end + 2 :].split()
+
+
+def _read_status(path: str) -> dict[str, int]:
+    fields = {}
+    with open(path, "r") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            value = value.split()
+            if len(value) > 0 and value[0].isdigit():
+                fields[key] = int(value[0])
+    return fields
+
+
+def _cpu_seconds(stat: list[str]) -> float:
+    # utime and stime
+    return (int(stat[11]) + int(stat[12])) / _CLOCK_TICKS
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import hashlib
+import platform
+import functools
+
+from typing import Optional
+from dataclasses import dataclass, asdict
+
+# binary of the results written before they were stamped
+UNKNOWN_BINARY = "unknown"
+
+# sidecar files next to the results, see `sidecar_path`
+PROVENANCE_DIR = "provenance"
+
+
+@dataclass(kw_only=True, frozen=True)
+class Stamp:
+    """
+    What a results file was produced with. The binary, arguments and host are
+    its key, a result is only reused by a run with the same key.
+    """
+
+    # sha256 of the anonycast binary
+    binary: str
+    # arguments of the run that change its results, without ports or output paths
+    argv: list[str]
+    # machine and nodes the run depends on
+    host: dict
+    # recorded but not part of the key
+    hostnames: list[str]
+    kernel: str
+    time: float
+
+    def key(self) -> str:
+        key = json.dumps([self.binary, self.argv, self.host], sort_keys=True)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def binary_hash(path: str) -> str:
+    """
+    sha256 of a file, only hashed again when its size or mtime changes
+    """
+    stat = os.stat(path)
+    return _hash_file(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache
+def _hash_file(path: str, _mtime_ns: int, _size: int) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stamp(binary: str, argv: list[str], nodes: list[str], jobs: int) -> Stamp:
+    """
+    Stamp of a run of `binary` with `argv` on `nodes`, `jobs` runs sharing the cpus
+    """
+    return Stamp(
+        binary=binary_hash(binary),
+        argv=argv,
+        host={
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "nodes": len(nodes),
+            "jobs": jobs,
+        },
+        hostnames=[platform.node(), *nodes],
+        kernel=platform.release(),
+        time=time.time(),
+    )
+
+
+def sidecar_path(result_path: str) -> str:
+    """
+    benchmark/<bench>/<id>.json -> benchmark/<bench>/provenance/<id>.json
+    """
+    directory, filename = os.path.split(result_path)
+    id = os.path.splitext(filename)[0]
+    return os.path.join(directory, PROVENANCE_DIR, f"{id}.json")
+
+
+def read(result_path: str) -> Optional[Stamp]:
+    """
+    Stamp of a results file, None when it was not stamped
+    """
+    try:
+        with open(sidecar_path(result_path), "r") as f:
+            return Stamp(**json.load(f))
+    except FileNotFoundError:
+        return None
+
+
+def write(result_path: str, s: Stamp):
+    path = sidecar_path(result_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(asdict(s), f, indent=2)
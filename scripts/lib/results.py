@@ -0,0 +1,123 @@
+import os
+import json
+import struct
+
+import numpy as np
+
+from dataclasses import dataclass
+
+# see write_columnar_result_to_output in anonycast/src/cli/benchmark.rs
+COLUMNAR_MAGIC = b"ANCRES01"
+_COLUMNAR_PREFIX = struct.Struct("<8sQQ")
+
+# keys holding the rows in the json results
+_ROW_KEYS = ["messages", "message_fetches"]
+
+
+@dataclass(frozen=True)
+class Results:
+    # every field of the results file except the rows
+    meta: dict
+    # name of the columns, the second one is the per client message/fetch number
+    columns: list[str]
+    client: np.ndarray
+    index: np.ndarray
+    timestamp: np.ndarray
+    latency: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+
+def read(path: str) -> Results:
+    """
+    Read a benchmark results file, either json or columnar
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(COLUMNAR_MAGIC))
+    if magic == COLUMNAR_MAGIC:
+        return read_columnar(path)
+    return read_json(path)
+
+
+def read_columnar(path: str) -> Results:
+    """
+    Memory map the columns of a columnar results file, the rows are never copied
+    """
+    with open(path, "rb") as f:
+        magic, header_len, rows = _COLUMNAR_PREFIX.unpack(f.read(_COLUMNAR_PREFIX.size))
+        if magic != COLUMNAR_MAGIC:
+            raise Exception(f"not a columnar results file: {path}")
+        header = json.loads(f.read(header_len))
+
+    meta = {k: v for k, v in header["results"].items() if k not in _ROW_KEYS}
+    offset = _COLUMNAR_PREFIX.size + header_len
+    offset += -offset % 8
+
+    def column(dtype: str, offset: int) -> np.ndarray:
+        if rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(rows,))
+
+    return Results(
+        meta=meta,
+        columns=header["columns"],
+        timestamp=column("<f8", offset),
+        latency=column("<f8", offset + 8 * rows),
+        client=column("<u4", offset + 16 * rows),
+        index=column("<u4", offset + 20 * rows),
+    )
+
+
+def read_json(path: str) -> Results:
+    with open(path, "r") as f:
+        d = json.load(f)
+
+    row_key = next((k for k in _ROW_KEYS if k in d), None)
+    rows = d.pop(row_key) if row_key is not None else []
+    index_key = "message" if row_key == "messages" else "fetch"
+
+    def column(key: str, dtype: str) -> np.ndarray:
+        return np.fromiter((r[key] for r in rows), dtype=dtype, count=len(rows))
+
+    return Results(
+        meta=d,
+        columns=["client", index_key, "timestamp", "latency"],
+        client=column("client", "<u4"),
+        index=column(index_key, "<u4"),
+        timestamp=column("timestamp", "<f8"),
+        latency=column("latency", "<f8"),
+    )
+
+
+def write(path: str, r: Results, columnar: bool):
+    """
+    Write results in the same format as the benchmark, see `read`
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    row_key = _ROW_KEYS[0] if r.columns[1] == "message" else _ROW_KEYS[1]
+    if columnar:
+        header = json.dumps({"columns": r.columns, "results": {**r.meta, row_key: []}})
+        header = header.encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(_COLUMNAR_PREFIX.pack(COLUMNAR_MAGIC, len(header), len(r)))
+            f.write(header)
+            f.write(bytes(-(_COLUMNAR_PREFIX.size + len(header)) % 8))
+            f.write(np.asarray(r.timestamp, dtype="<f8").tobytes())
+            f.write(np.asarray(r.latency, dtype="<f8").tobytes())
+            f.write(np.asarray(r.client, dtype="<u4").tobytes())
+            f.write(np.asarray(r.index, dtype="<u4").tobytes())
+    else:
+        rows = [
+            {
+                "client": int(client),
+                r.columns[1]: int(index),
+                "timestamp": float(timestamp),
+                "latency": float(latency),
+            }
+            for client, index, timestamp, latency in zip(
+                r.client, r.index, r.timestamp, r.latency
+            )
+        ]
+        with open(path, "w") as f:
+            json.dump({**r.meta, row_key: rows}, f)
@@ -0,0 +1,96 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass
+
+# see SnapshotWriter in anonycast/src/stats.rs
+PERCENTILES = {"p50": 50.0, "p99": 99.0, "p999": 99.9}
+
+
+@dataclass(kw_only=True, frozen=True)
+class BucketLayout:
+    sub_bucket_bits: int
+
+    def bounds(self, index: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Smallest value and width in nanoseconds of the buckets at `index`
+        """
+        index = index.astype(np.uint64)
+        sub_buckets = np.uint64(1 << self.sub_bucket_bits)
+        bucket = index >> np.uint64(self.sub_bucket_bits)
+        sub = index & (sub_buckets - np.uint64(1))
+        shift = np.where(bucket == 0, 0, bucket - np.uint64(1)).astype(np.uint64)
+        low = np.where(bucket == 0, sub, (sub_buckets + sub) << shift)
+        width = np.where(bucket == 0, 1, np.uint64(1) << shift)
+        return low.astype(np.float64), width.astype(np.float64)
+
+    def quantiles(self, buckets: dict[int, int], qs: list[float]) -> list[float]:
+        """
+        Midpoint in seconds of the buckets holding each quantile in `qs` (0-100)
+        """
+        if len(buckets) == 0:
+            return [float("nan")] * len(qs)
+        index = np.array(sorted(buckets), dtype=np.uint64)
+        counts = np.array([buckets[i] for i in sorted(buckets)], dtype=np.float64)
+        cumulative = np.cumsum(counts)
+        ranks = np.maximum(1, np.ceil(np.array(qs) / 100 * cumulative[-1]))
+        positions = np.searchsorted(cumulative, ranks)
+        low, width = self.bounds(index[positions])
+        return ((low + width / 2) / 1e9).tolist()
+
+
+def read_snapshots(path: str) -> pd.DataFrame:
+    """
+    One row per interval and operation with its count, mean and percentiles in
+    seconds, `elapsed` is the end of the interval relative to the start of the run
+    """
+    rows = []
+    with open(path, "r") as f:
+        layout = BucketLayout(sub_bucket_bits=json.loads(f.readline())["sub_bucket_bits"])
+        for line in f:
+            snapshot = json.loads(line)
+            for operation, h in snapshot["operations"].items():
+                buckets = {int(i): int(c) for i, c in h["buckets"]}
+                quantiles = layout.quantiles(buckets, list(PERCENTILES.values()))
+                rows.append(
+                    {
+                        "timestamp": snapshot["timestamp"],
+                        "elapsed": snapshot["elapsed"],
+                        "operation": operation,
+                        "count": h["count"],
+                        "mean": h["sum"] / h["count"] / 1e9,
+                        **dict(zip(PERCENTILES, quantiles)),
+                    }
+                )
+    return pd.DataFrame(rows)
+
+
+def read_totals(path: str) -> pd.DataFrame:
+    """
+    One row per operation with the count, mean and percentiles of the whole run
+    """
+    totals: dict[str, dict] = {}
+    with open(path, "r") as f:
+        layout = BucketLayout(sub_bucket_bits=json.loads(f.readline())["sub_bucket_bits"])
+        for line in f:
+            for operation, h in json.loads(line)["operations"].items():
+                total = totals.setdefault(operation, {"count": 0, "sum": 0, "buckets": {}})
+                total["count"] += h["count"]
+                total["sum"] += h["sum"]
+                for i, c in h["buckets"]:
+                    total["buckets"][i] = total["buckets"].get(i, 0) + c
+
+    rows = []
+    for operation, total in totals.items():
+        quantiles = layout.quantiles(total["buckets"], list(PERCENTILES.values()))
+        rows.append(
+            {
+                "operation": operation,
+                "count": total["count"],
+                "mean": total["sum"] / total["count"] / 1e9,
+                **dict(zip(PERCENTILES, quantiles)),
+            }
+        )
+    return pd.DataFrame(rows)
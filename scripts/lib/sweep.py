@@ -0,0 +1,151 @@
+from typing import Awaitable, Callable, Optional
+from dataclasses import dataclass, field
+
+
+@dataclass(kw_only=True, frozen=True)
+class Point:
+    clients: int
+    # ops/s
+    throughput: float
+    # mean latency in seconds
+    latency: float
+
+
+@dataclass(kw_only=True, frozen=True)
+class KneeSearch:
+    """
+    Parameters of the search for the client count where throughput stops scaling
+    """
+
+    min_clients: int = 1
+    max_clients: int
+    # doubling the clients must add this fraction of throughput to keep scaling
+    gain: float = 0.1
+    # the knee is the smallest client count within this fraction of the plateau
+    tolerance: float = 0.05
+    # bisection stops once the bracket is narrower than this fraction of its low end
+    resolution: float = 0.1
+    # the latency knee is where the latency exceeds this factor of the lowest latency
+    latency_factor: float = 2.0
+
+
+@dataclass(kw_only=True)
+class Knee:
+    # smallest measured client count reaching the throughput plateau, max_clients
+    # when throughput still scaled there
+    clients: int
+    throughput: float
+    # smallest measured client count whose latency knees, if any
+    latency_clients: Optional[int]
+    points: list[Point] = field(default_factory=list)
+
+
+async def find_knee(
+    search: KneeSearch, measure: Callable[[int], Awaitable[Point]]
+) -> Knee:
+    """
+    Double the clients until throughput stops scaling, then bisect between the
+    last point below the plateau and the first one on it
+    """
+    points: dict[int, Point] = {}
+
+    async def at(clients: int) -> Point:
+        if clients not in points:
+            points[clients] = await measure(clients)
+        return points[clients]
+
+    # bracketing
+    clients = search.min_clients
+    previous = await at(clients)
+    scaling = True
+    while scaling and clients < search.max_clients:
+        clients = min(clients * 2, search.max_clients)
+        point = await at(clients)
+        scaling = point.throughput >= (1 + search.gain) * previous.throughput
+        previous = point
+
+    # bisection, unless throughput still scales at max_clients
+    def plateau() -> float:
+        return max(p.throughput for p in points.values())
+
+    def on_plateau(p: Point) -> bool:
+        return p.throughput >= (1 - search.tolerance) * plateau()
+
+    high = clients
+    while not scaling:
+        measured = sorted(points)
+        high = next(c for c in measured if on_plateau(points[c]))
+        low = max((c for c in measured if c < high), default=None)
+        if low is None or high - low <= max(1, int(low * search.resolution)):
+            break
+        await at((low + high) // 2)
+
+    measured = [points[c] for c in sorted(points)]
+    lowest_latency = min(p.latency for p in measured)
+    latency_clients = next(
+        (
+            p.clients
+            for p in measured
+            if p.latency > search.latency_factor * lowest_latency
+        ),
+        None,
+    )
+    return Knee(
+        clients=high,
+        throughput=points[high].throughput,
+        latency_clients=latency_clients,
+        points=measured,
+    )
+
+
+@dataclass(kw_only=True, frozen=True)
+class RatePoint:
+    # offered requests per second of all the clients
+    rate: float
+    # completed requests per second, from the first send to the last completion
+    goodput: float
+    # seconds from the scheduled send time
+    latency_p50: float
+    latency_p99: float
+    latency_p999: float
+    # requests still in flight at the end of the run
+    unfinished: int
+
+
+@dataclass(kw_only=True, frozen=True)
+class RateSweep:
+    """
+    Parameters of the open-loop sweep of the offered load
+    """
+
+    start_rate: float
+    max_rate: float
+    # each step multiplies the offered load by this factor
+    factor: float = 1.5
+    # a step is saturated when its goodput is below the offered load by more than
+    # this fraction
+    tolerance: float = 0.05
+    # steps run after the first saturated one
+    past_saturation: int = 2
+
+    def saturated(self, p: RatePoint) -> bool:
+        return p.unfinished > 0 or p.goodput < (1 - self.tolerance) * p.rate
+
+
+async def sweep_rate(
+    search: RateSweep, measure: Callable[[float], Awaitable[RatePoint]]
+) -> list[RatePoint]:
+    """
+    Multiply the offered load until `past_saturation` steps after the first
+    saturated one, or until `max_rate`
+    """
+    points = []
+    rate = search.start_rate
+    saturated_steps = 0
+    while rate <= search.max_rate and saturated_steps <= search.past_saturation:
+        point = await measure(rate)
+        points.append(point)
+        if saturated_steps > 0 or search.saturated(point):
+            saturated_steps += 1
+        rate *= search.factor
+    return points
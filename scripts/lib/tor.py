@@ -4,6 +4,7 @@ import tempfile
 import asyncio
 import logging
 
+from typing import Optional
 from dataclasses import dataclass
 
 
@@ -23,10 +24,15 @@ class TorInstance:
     socks_port: int
     process: asyncio.subprocess.Process
     services: dict[int, TorService]
+    output_task: Optional[asyncio.Task] = None
+
+    def alive(self) -> bool:
+        return self.process.returncode is None
 
     def close(self):
-        self.process.kill()
-        shutil.rmtree(self.directory)
+        if self.alive():
+            self.process.kill()
+        shutil.rmtree(self.directory, ignore_errors=True)
 
     def __enter__(self):
         pass
@@ -35,9 +41,20 @@ class TorInstance:
         self.close()
 
 
-async def spawn(socks_port: int = 9050, service_ports: dict[int, int] = {}):
+async def spawn(
+    socks_port: int = 9050,
+    service_ports: dict[int, int] = {},
+    keys_directory: Optional[str] = None,
+):
+    """
+    Start a tor instance and wait for it to bootstrap.
+    When `keys_directory` is set the hidden service keys are kept there instead of
+    in the temporary data directory, so the onion addresses survive the instance.
+    """
     directory = tempfile.mkdtemp()
-    torrc = _gen_torrc(directory, socks_port, service_ports)
+    services_directory = directory if keys_directory is None else keys_directory
+    os.makedirs(services_directory, exist_ok=True)
+    torrc = _gen_torrc(directory, services_directory, socks_port, service_ports)
     logging.debug("torrc:\n" + torrc)
     torrc_path = os.path.join(directory, "torrc")
     with open(torrc_path, "w") as f:
@@ -62,15 +79,8 @@ async def spawn(socks_port: int = 9050, service_ports: dict[int, int] = {}):
             if "100%" in line.decode("utf-8"):
                 break
         services = []
-        for dir in os.listdir(directory):
-            path = os.path.join(directory, dir)
-            if not os.path.isdir(path):
-                continue
-            if "service_" not in dir:
-                continue
-            ports = dir.removeprefix("service_").split("_")
-            tor_port = int(ports[0])
-            local_port = int(ports[1])
+        for tor_port, local_port in service_ports.items():
+            path = _service_directory(services_directory, tor_port, local_port)
             with open(os.path.join(path, "hostname"), "r") as f:
                 addr = f.read().strip()
                 services.append(
@@ -81,19 +91,134 @@ async def spawn(socks_port: int = 9050, service_ports: dict[int, int] = {}):
             socks_port=socks_port,
             process=proc,
             services={s.tor_port: s for s in services},
+            # keep reading the output so a long lived instance never blocks on it
+            output_task=asyncio.create_task(_drain(proc.stdout)),
         )
-    except Exception as e:
-        proc.kill()
+    except BaseException as e:
+        # also reached when a timeout cancels the bootstrap
+        if proc.returncode is None:
+            proc.kill()
+        shutil.rmtree(directory)
         raise e
 
 
-def _gen_torrc(directory: str, socks_port: int, service_ports: dict[int, int]) -> str:
+class TorPool:
+    """
+    Keeps bootstrapped tor instances alive so they can be reused by later runs.
+    Instances are matched on their hidden service ports, and hidden service keys
+    are stored in `keys_directory` so a replaced instance keeps the same onion address.
+    """
+
+    def __init__(
+        self,
+        socks_port: int = 9050,
+        keys_directory: str = ".cache/tor-keys",
+        bootstrap_timeout: float = 20,
+        bootstrap_attempts: int = 5,
+        spawn=spawn,
+    ):
+        self.keys_directory = os.path.abspath(keys_directory)
+        self.bootstrap_timeout = bootstrap_timeout
+        self.bootstrap_attempts = bootstrap_attempts
+        self._spawn = spawn
+        self._next_socks_port = socks_port
+        self._free_socks_ports: list[int] = []
+        self._idle: dict[tuple[tuple[int, int], ...], list[TorInstance]] = {}
+
+    async def acquire(self, service_ports: dict[int, int] = {}) -> TorInstance:
+        idle = self._idle.get(_pool_key(service_ports), [])
+        while len(idle) > 0:
+            instance = idle.pop()
+            if instance.alive():
+                return instance
+            logging.info(f"replacing dead tor instance on socks port {instance.socks_port}")
+            self._discard(instance)
+        return await self._start(service_ports)
+
+    async def acquire_all(self, service_ports: list[dict[int, int]]) -> list[TorInstance]:
+        results = await asyncio.gather(
+            *[self.acquire(ports) for ports in service_ports], return_exceptions=True
+        )
+        instances = [r for r in results if not isinstance(r, BaseException)]
+        if len(instances) != len(results):
+            for instance in instances:
+                self.release(instance)
+            raise next(r for r in results if isinstance(r, BaseException))
+        return instances
+
+    def release(self, instance: TorInstance):
+        if not instance.alive():
+            self._discard(instance)
+            return
+        key = _pool_key({s.tor_port: s.local_port for s in instance.services.values()})
+        self._idle.setdefault(key, []).append(instance)
+
+    def close(self):
+        for instances in self._idle.values():
+            for instance in instances:
+                self._discard(instance)
+        self._idle.clear()
+
+    async def _start(self, service_ports: dict[int, int]) -> TorInstance:
+        for attempt in range(self.bootstrap_attempts):
+            socks_port = self._allocate_socks_port()
+            try:
+                return await asyncio.wait_for(
+                    self._spawn(
+                        socks_port=socks_port,
+                        service_ports=service_ports,
+                        keys_directory=self.keys_directory,
+                    ),
+                    timeout=self.bootstrap_timeout,
+                )
+            except (asyncio.TimeoutError, Exception) as e:
+                logging.warning(f"tor bootstrap attempt {attempt} failed: {e!r}")
+                self._free_socks_ports.append(socks_port)
+        raise Exception(f"failed to start tor after {self.bootstrap_attempts} attempts")
+
+    def _discard(self, instance: TorInstance):
+        instance.close()
+        self._free_socks_ports.append(instance.socks_port)
+
+    def _allocate_socks_port(self) -> int:
+        if len(self._free_socks_ports) > 0:
+            return self._free_socks_ports.pop()
+        port = self._next_socks_port
+        self._next_socks_port += 1
+        return port
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+async def _drain(stream: asyncio.StreamReader):
+    while len(await stream.readline()) > 0:
+        pass
+
+
+def _pool_key(service_ports: dict[int, int]) -> tuple[tuple[int, int], ...]:
+    return tuple(sorted(service_ports.items()))
+
+
+def _service_directory(services_directory: str, tor_port: int, local_port: int) -> str:
+    return os.path.join(services_directory, f"service_{tor_port}_{local_port}")
+
+
+def _gen_torrc(
+    directory: str,
+    services_directory: str,
+    socks_port: int,
+    service_ports: dict[int, int],
+) -> str:
     torrc = ""
     torrc += f"SocksPort {socks_port}\n"
     torrc += f"DataDirectory {directory}\n"
     for tor_port, local_port in service_ports.items():
-        torrc += f"HiddenServiceDir {directory}/service_{tor_port}_{local_port}\n"
+        service_directory = _service_directory(services_directory, tor_port, local_port)
+        torrc += f"HiddenServiceDir {service_directory}\n"
         torrc += f"HiddenServicePort {tor_port} 127.0.0.1:{local_port}\n"
         torrc += "\n"
     return torrc
-
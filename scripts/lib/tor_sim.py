@@ -0,0 +1,199 @@
+import time
+import base64
+import random
+import socket
+import struct
+import asyncio
+import hashlib
+import logging
+
+from typing import Optional
+from dataclasses import dataclass
+
+from lib.tor import TorService
+
+# fake onion address -> local port, shared by every simulated instance of this process
+_ONION_SERVICES: dict[tuple[str, int], int] = {}
+
+_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass(kw_only=True, frozen=True)
+class CircuitModel:
+    """
+    Latency model of a connection to an onion service.
+    The defaults are in the range of measured circuits on the live network.
+    """
+
+    # relays between the client and the service (3 on each side of the rendezvous)
+    hops: int = 6
+    # mean one way latency added by each hop in seconds
+    hop_latency: float = 0.04
+    # standard deviation of the latency of each hop in seconds
+    hop_jitter: float = 0.01
+    # bandwidth of a circuit in bytes/s
+    bandwidth: float = 1.5 * 1024 * 1024
+    # round trips needed to reach the service (introduction + rendezvous)
+    connect_round_trips: int = 4
+    seed: Optional[int] = None
+
+    def one_way_delay(self, rng: random.Random) -> float:
+        return sum(
+            max(0.0, rng.gauss(self.hop_latency, self.hop_jitter))
+            for _ in range(self.hops)
+        )
+
+
+@dataclass(kw_only=True)
+class SimulatedTorInstance:
+    """
+    Same interface as `tor.TorInstance`, backed by an in-process SOCKS5 proxy
+    """
+
+    directory: str
+    socks_port: int
+    server: asyncio.AbstractServer
+    services: dict[int, TorService]
+
+    def alive(self) -> bool:
+        return self.server.is_serving()
+
+    def close(self):
+        self.server.close()
+        for service in self.services.values():
+            _ONION_SERVICES.pop((service.address, service.tor_port), None)
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *_):
+        self.close()
+
+
+async def spawn(
+    socks_port: int = 9050,
+    service_ports: dict[int, int] = {},
+    keys_directory: Optional[str] = None,
+    model: CircuitModel = CircuitModel(),
+):
+    """
+    Drop-in replacement for `tor.spawn` that does not need a tor binary or network.
+    Onion addresses are derived from the ports, so they are stable across instances.
+    """
+    services = {}
+    for tor_port, local_port in service_ports.items():
+        address = _onion_address(keys_directory, tor_port, local_port)
+        _ONION_SERVICES[(address, tor_port)] = local_port
+        services[tor_port] = TorService(
+            address=address, tor_port=tor_port, local_port=local_port
+        )
+
+    seed = None if model.seed is None else model.seed + socks_port
+    rng = random.Random(seed)
+    server = await asyncio.start_server(
+        lambda r, w: _handle_socks(r, w, model, rng), "127.0.0.1", socks_port
+    )
+    return SimulatedTorInstance(
+        directory="", socks_port=socks_port, server=server, services=services
+    )
+
+
+def _onion_address(keys_directory: Optional[str], tor_port: int, local_port: int) -> str:
+    digest = hashlib.sha256(f"{keys_directory}/{tor_port}/{local_port}".encode()).digest()
+    # v3 onion addresses are 56 base32 characters
+    return base64.b32encode(digest + digest[:3]).decode().lower()[:56] + ".onion"
+
+
+async def _handle_socks(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    model: CircuitModel,
+    rng: random.Random,
+):
+    try:
+        version, nmethods = await reader.readexactly(2)
+        await reader.readexactly(nmethods)
+        if version != 5:
+            return
+        # no authentication
+        writer.write(b"\x05\x00")
+
+        _version, command, _reserved, address_type = await reader.readexactly(4)
+        if address_type == 1:
+            host = socket.inet_ntoa(await reader.readexactly(4))
+        elif address_type == 3:
+            (length,) = await reader.readexactly(1)
+            host = (await reader.readexactly(length)).decode("utf-8")
+        elif address_type == 4:
+            host = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+        else:
+            return
+        (port,) = struct.unpack(">H", await reader.readexactly(2))
+
+        local_port = _ONION_SERVICES.get((host, port))
+        if command != 1 or local_port is None:
+            logging.warning(f"simulated tor cannot reach {host}:{port}")
+            # host unreachable
+            writer.write(b"\x05\x04\x00\x01\x00\x00\x00\x00\x00\x00")
+            return
+
+        await asyncio.sleep(
+            sum(
+                model.one_way_delay(rng) + model.one_way_delay(rng)
+                for _ in range(model.connect_round_trips)
+            )
+        )
+        service_reader, service_writer = await asyncio.open_connection(
+            "127.0.0.1", local_port
+        )
+        writer.write(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+
+        try:
+            await asyncio.gather(
+                _relay(reader, service_writer, model, rng),
+                _relay(service_reader, writer, model, rng),
+            )
+        finally:
+            service_writer.close()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _relay(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    model: CircuitModel,
+    rng: random.Random,
+):
+    """
+    Forward data from reader to writer, delaying each chunk by the circuit latency
+    and pacing the stream to the circuit bandwidth while keeping the byte order
+    """
+    queue: asyncio.Queue[tuple[float, bytes]] = asyncio.Queue(maxsize=256)
+
+    async def receive():
+        busy_until = 0.0
+        deliver_at = 0.0
+        while True:
+            data = await reader.read(_CHUNK_SIZE)
+            now = time.monotonic()
+            busy_until = max(busy_until, now) + len(data) / model.bandwidth
+            deliver_at = max(deliver_at, busy_until + model.one_way_delay(rng))
+            await queue.put((deliver_at, data))
+            if len(data) == 0:
+                break
+
+    async def deliver():
+        while True:
+            deliver_at, data = await queue.get()
+            await asyncio.sleep(max(0.0, deliver_at - time.monotonic()))
+            if len(data) == 0:
+                if writer.can_write_eof():
+                    writer.write_eof()
+                break
+            writer.write(data)
+            await writer.drain()
+
+    await asyncio.gather(receive(), deliver())
@@ -0,0 +1,151 @@
+import json
+
+from typing import Iterable, Optional, TextIO
+from dataclasses import dataclass, field
+
+from lib.histogram import LogHistogram
+
+# span fields that tell which kind of request a stage belongs to, see
+# anonycast/src/deaddrop.rs
+TYPE_FIELDS = ["job", "message"]
+
+# requests whose span has none of TYPE_FIELDS
+ALL_TYPES = "all"
+
+
+@dataclass(kw_only=True, frozen=True)
+class Span:
+    name: str
+    # microseconds
+    start: float
+    duration: float
+    args: dict
+
+    @property
+    def type(self) -> str:
+        return next((str(self.args[f]) for f in TYPE_FIELDS if f in self.args), ALL_TYPES)
+
+
+def parse_events(lines: Iterable[str]) -> Iterable[dict]:
+    """
+    Yield the events of a Chrome trace written with one event per line, as by
+    tracing-chrome. A trace cut short by a crash is read up to its last
+    complete event.
+    """
+    for line in lines:
+        line = line.strip().rstrip(",")
+        if line in ("", "[", "]"):
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            continue
+
+
+def parse_spans(events: Iterable[dict]) -> Iterable[Span]:
+    """
+    Yield the spans of a trace once they are closed. Async begin/end events are
+    matched by id, the ids of closed spans can be reused. Threaded begin/end events
+    are matched per thread and complete events are taken as they are.
+    """
+    # id -> begin event
+    open_async: dict[object, dict] = {}
+    # tid -> begin events
+    open_threaded: dict[object, list[dict]] = {}
+    for event in events:
+        phase = event.get("ph")
+        begin: Optional[dict] = None
+        if phase == "b":
+            open_async[event.get("id")] = event
+        elif phase == "e":
+            begin = open_async.pop(event.get("id"), None)
+        elif phase == "B":
+            open_threaded.setdefault(event.get("tid"), []).append(event)
+        elif phase == "E":
+            stack = open_threaded.get(event.get("tid"))
+            begin = stack.pop() if stack else None
+        elif phase == "X":
+            yield Span(
+                name=event["name"],
+                start=event["ts"],
+                duration=event.get("dur", 0.0),
+                args=event.get("args", {}),
+            )
+        if begin is not None:
+            yield Span(
+                name=begin["name"],
+                start=begin["ts"],
+                duration=max(event["ts"] - begin["ts"], 0.0),
+                args=begin.get("args", {}),
+            )
+
+
+@dataclass(kw_only=True)
+class StageReport:
+    """
+    Latency of every stage of the requests by type, and queue depth of the
+    worker jobs by type when they were queued
+    """
+
+    # (stage, type) -> seconds
+    stages: dict[tuple[str, str], LogHistogram] = field(default_factory=dict)
+    # type -> jobs already queued
+    queue_depth: dict[str, LogHistogram] = field(default_factory=dict)
+
+    def add(self, span: Span):
+        key = (span.name, span.type)
+        if key not in self.stages:
+            self.stages[key] = LogHistogram()
+        self.stages[key].record(span.duration / 1e6)
+        depth = span.args.get("queue_depth")
+        if depth is not None:
+            if span.type not in self.queue_depth:
+                self.queue_depth[span.type] = LogHistogram()
+            self.queue_depth[span.type].record(float(depth))
+
+    def rows(self) -> list[dict]:
+        """
+        One row per stage and type with the count, mean and percentiles in seconds
+        """
+        rows = []
+        for (stage, type), h in sorted(self.stages.items()):
+            rows.append(
+                {
+                    "stage": stage,
+                    "type": type,
+                    "count": h.count,
+                    "mean": h.mean,
+                    "p50": h.quantile(0.5),
+                    "p99": h.quantile(0.99),
+                    "p999": h.quantile(0.999),
+                    "max": h.max,
+                }
+            )
+        return rows
+
+    def print(self, output: TextIO):
+        for row in self.rows():
+            print(
+                f"{row['stage']:>22} {row['type']:>22} {row['count']:>9}"
+                f" p50 {row['p50'] * 1000:9.3f} ms p99 {row['p99'] * 1000:9.3f} ms"
+                f" p99.9 {row['p999'] * 1000:9.3f} ms",
+                file=output,
+            )
+        for type, h in sorted(self.queue_depth.items()):
+            print(
+                f"{'queue depth':>22} {type:>22} {h.count:>9}"
+                f" p50 {h.quantile(0.5):9.0f}    p99 {h.quantile(0.99):9.0f}"
+                f"    max {h.max:9.0f}",
+                file=output,
+            )
+
+
+def read(path: str) -> StageReport:
+    """
+    Stages of the requests of a trace written with `anonycast --trace`
+    """
+    report = StageReport()
+    with open(path, "r") as f:
+        for span in parse_spans(parse_events(f)):
+            report.add(span)
+    return report
@@ -1,5 +1,17 @@
-# strace -p $(scripts/deaddrop-worker-tids.sh | head -n 1) -e trace=futex -T --stack-trace=source --stack-trace-frame-limit=24 -o trace.txt
-# output when running retrieve benchmark with 200 clients
+#!/usr/bin/env python3
+
+# strace $(scripts/deaddrop-worker-tids.sh | sed 's/^/-p /') -e trace=futex -T --stack-trace=source --stack-trace-frame-limit=24 -o trace.txt
+# scripts/deaddrop-worker-tids.sh > tids.txt
+# scripts/strace-futex.py trace.txt --tids tids.txt --folded futex.folded
+# benchmark.py --futex-trace records the same trace and tids for every run under
+# benchmark/<bench>/futex, e.g. to compare the waits before and after a change. run the
+# same config with the binary of both commits and pass the first trace as --baseline:
+#
+# scripts/strace-futex.py after.trace --tids after.tids --baseline before.trace --baseline-tids before.tids
+#
+# the trace is processed one line at a time, memory only grows with the number of
+# distinct symbols, threads and stacks. output when running retrieve benchmark
+# with 200 clients (before per thread splitting):
 #
 # anonycast::deaddrop::retreive_documents+0x5a
 #         min = 0.016 ms
@@ -15,86 +27,237 @@
 #         max = 25.034 ms
 
 import re
+import sys
+import argparse
 
-from dataclasses import dataclass
+from typing import Iterable, Optional, TextIO
+from dataclasses import dataclass, field
 
+from lib.histogram import LogHistogram
 
-@dataclass(kw_only=True, frozen=True)
-class RawFutexCall:
-    line: str
-    stacktrace: list[str]
+# "1234 " prefix added by strace when tracing more than one thread
+PID_RE = re.compile(r"^(\d+)\s+(.*)$")
+DURATION_RE = re.compile(r"<([0-9.]+)>\s*$")
+# " > /path/to/binary(symbol+0x5a) [0x55d0c0a1b2c3]"
+FRAME_RE = re.compile(r"\((.*)\)\s*\[0x[0-9a-f]+\]\s*$")
+OFFSET_RE = re.compile(r"\+0x[0-9a-f]+$")
 
 
-@dataclass(kw_only=True, frozen=True)
+@dataclass(kw_only=True)
 class FutexCall:
+    tid: Optional[int]
     duration: float
-    symbol: str
+    wait: bool
+    frames: list[str] = field(default_factory=list)
 
 
-def parse_strace(output: str) -> list[RawFutexCall]:
-    futex_calls = []
-    current_line = None
-    current_stacktrace = []
-    for line in output.splitlines():
+def parse_strace(lines: Iterable[str]) -> Iterable[FutexCall]:
+    """
+    Yield the completed futex calls of a trace with their stack trace, innermost
+    frame first. Calls interrupted by another thread are matched with their
+    resumption.
+    """
+    current: Optional[FutexCall] = None
+    # tid -> whether the unfinished call is a wait
+    unfinished: dict[Optional[int], bool] = {}
+    for line in lines:
         line = line.strip()
         if line.startswith(">"):
-            # remove '> '
-            current_stacktrace.append(line[2:].strip())
+            if current is not None:
+                # remove '> '
+                current.frames.append(line[2:].strip())
+            continue
+
+        if current is not None:
+            yield current
+            current = None
+
+        tid = None
+        pid_match = PID_RE.match(line)
+        if pid_match is not None:
+            tid = int(pid_match[1])
+            line = pid_match[2]
+
+        if line.endswith("<unfinished ...>"):
+            unfinished[tid] = "_WAIT" in line
+            continue
+        if line.startswith("<... futex resumed>"):
+            wait = unfinished.pop(tid, False)
+        elif line.startswith("futex("):
+            wait = "_WAIT" in line
         else:
-            if current_line is not None:
-                futex_calls.append(
-                    RawFutexCall(line=current_line, stacktrace=current_stacktrace)
-                )
-            current_line = line
-            current_stacktrace = []
-    return futex_calls
-
-
-def parse_raw_futex_calls(calls: list[RawFutexCall]) -> list[FutexCall]:
-    futex_calls = []
-    for call in calls:
-        if "_WAIT_" not in call.line:
+            # signals, exits
             continue
-        duration_match = re.match(r".*<(.*)>", call.line)
+
+        duration_match = DURATION_RE.search(line)
         if duration_match is None:
-            print(call.line)
-            raise Exception("invalid line")
-        duration = float(duration_match[1])  # type: ignore
-        symbol = None
-        for s in call.stacktrace:
-            s_symbol_match = re.match(r".*\((.*)\).*", s)
-            if s_symbol_match is None:
-                print(s)
-                raise Exception("invalid symbol")
-            s_symbol = s_symbol_match[1]  # type: ignore
-            if "anonycast::" not in s_symbol:  # type: ignore
-                continue
-            symbol = s_symbol
-            break
+            raise Exception(f"invalid line: {line}")
+        current = FutexCall(tid=tid, duration=float(duration_match[1]), wait=wait)
+
+    if current is not None:
+        yield current
+
+
+def frame_symbol(frame: str) -> Optional[str]:
+    match = FRAME_RE.search(frame)
+    if match is None:
+        return None
+    return match[1] or None
+
+
+@dataclass(kw_only=True)
+class Report:
+    symbol_filter: str
+    per_tid: bool
+    # (symbol, tid) -> futex wait durations
+    histograms: dict[tuple[str, Optional[int]], LogHistogram] = field(
+        default_factory=dict
+    )
+    # folded stack -> total futex wait in microseconds
+    folded: dict[str, int] = field(default_factory=dict)
+
+    def add(self, call: FutexCall):
+        symbols = [frame_symbol(f) for f in call.frames]
+        symbol = next((s for s in symbols if s and self.symbol_filter in s), None)
         if symbol is None:
-            continue
-        futex_calls.append(FutexCall(symbol=symbol, duration=duration))
-    return futex_calls
-
-
-content = open("trace.txt").read()
-raw_futex_calls = parse_strace(content)
-futex_calls = parse_raw_futex_calls(raw_futex_calls)
-futex_by_symbol = {
-    s: [f for f in futex_calls if f.symbol in s]
-    for s in set([f.symbol for f in futex_calls])
-}
-symbol_info = []
-for symbol, futexes in futex_by_symbol.items():
-    min_d = min([f.duration for f in futexes])
-    max_d = max([f.duration for f in futexes])
-    avg_d = sum([f.duration for f in futexes]) / len(futexes)
-    symbol_info.append({"symbol": symbol, "min": min_d, "max": max_d, "avg": avg_d})
-
-symbol_info.sort(key=lambda i: i["avg"])
-for info in symbol_info:
-    print(info["symbol"])
-    print(f"\tmin = {info['min'] * 1000} ms")
-    print(f"\tavg = {info['avg'] * 1000} ms")
-    print(f"\tmax = {info['max'] * 1000} ms")
+            return
+
+        key = (symbol, call.tid if self.per_tid else None)
+        if key not in self.histograms:
+            self.histograms[key] = LogHistogram()
+        self.histograms[key].record(call.duration)
+
+        stack = [OFFSET_RE.sub("", s or "[unknown]") for s in reversed(symbols)]
+        if self.per_tid and call.tid is not None:
+            stack.insert(0, f"deaddrop-worker-{call.tid}")
+        folded = ";".join(stack)
+        self.folded[folded] = self.folded.get(folded, 0) + round(call.duration * 1e6)
+
+    def print(self, output: TextIO):
+        entries = sorted(self.histograms.items(), key=lambda e: e[1].mean)
+        for (symbol, tid), h in entries:
+            assert h.max is not None
+            print(symbol if tid is None else f"{symbol} [tid {tid}]", file=output)
+            print(f"\tcount = {h.count}", file=output)
+            print(f"\ttotal = {h.total * 1000:.3f} ms", file=output)
+            print(f"\tavg = {h.mean * 1000:.3f} ms", file=output)
+            print(f"\tp50 = {h.quantile(0.5) * 1000:.3f} ms", file=output)
+            print(f"\tp99 = {h.quantile(0.99) * 1000:.3f} ms", file=output)
+            print(f"\tmax = {h.max * 1000:.3f} ms", file=output)
+
+    def write_folded(self, output: TextIO):
+        for stack, micros in sorted(self.folded.items()):
+            print(f"{stack} {micros}", file=output)
+
+
+    def merged(self) -> dict[str, LogHistogram]:
+        """
+        Wait durations per symbol over all threads, without the offsets that change
+        from one binary to another
+        """
+        merged: dict[str, LogHistogram] = {}
+        for (symbol, _), h in self.histograms.items():
+            symbol = OFFSET_RE.sub("", symbol)
+            if symbol not in merged:
+                merged[symbol] = LogHistogram()
+            merged[symbol].merge(h)
+        return merged
+
+
+def print_comparison(baseline: Report, report: Report, output: TextIO):
+    """
+    Waits per symbol of a baseline trace -> this trace, over all threads
+    """
+    before, after = baseline.merged(), report.merged()
+
+    def ms(h: Optional[LogHistogram], value) -> str:
+        return "-" if h is None or h.count == 0 else f"{value(h) * 1000:.3f} ms"
+
+    for symbol in sorted(set(before) | set(after)):
+        b, a = before.get(symbol), after.get(symbol)
+        print(symbol, file=output)
+        print(
+            f"	count = {b.count if b else 0} -> {a.count if a else 0}", file=output
+        )
+        for name, value in [
+            ("total", lambda h: h.total),
+            ("avg", lambda h: h.mean),
+            ("p50", lambda h: h.quantile(0.5)),
+            ("p99", lambda h: h.quantile(0.99)),
+            ("max", lambda h: h.max),
+        ]:
+            print(f"	{name} = {ms(b, value)} -> {ms(a, value)}", file=output)
+
+
+def read_tids(path: str) -> set[int]:
+    with open(path, "r") as f:
+        return {int(line) for line in f if line.strip()}
+
+
+def read_report(
+    path: str, tids: Optional[set[int]], args: argparse.Namespace
+) -> Report:
+    report = Report(
+        symbol_filter=args.symbol_filter, per_tid=args.per_tid or tids is not None
+    )
+    trace = sys.stdin if path == "-" else open(path, "r")
+    with trace:
+        for call in parse_strace(trace):
+            if not call.wait and not args.all_calls:
+                continue
+            if tids is not None and call.tid not in tids:
+                continue
+            report.add(call)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="futex wait times per symbol of an strace -T -k trace"
+    )
+    parser.add_argument("trace", nargs="?", default="trace.txt", help="- for stdin")
+    parser.add_argument(
+        "--tids",
+        help="only keep these threads (output of deaddrop-worker-tids.sh) and report each one",
+    )
+    parser.add_argument(
+        "--per-tid", action="store_true", default=False, help="report each thread"
+    )
+    parser.add_argument(
+        "--symbol-filter",
+        default="anonycast::",
+        help="calls are attributed to the innermost frame containing this",
+    )
+    parser.add_argument(
+        "--all-calls",
+        action="store_true",
+        default=False,
+        help="also count wakes, not only waits",
+    )
+    parser.add_argument(
+        "--folded", help="write folded stacks weighted by wait time in us"
+    )
+    parser.add_argument(
+        "--baseline",
+        help="trace of the same run before a change, print the waits of each symbol before -> after",
+    )
+    parser.add_argument("--baseline-tids", help="threads of the baseline trace, as --tids")
+    args = parser.parse_args()
+
+    tids = read_tids(args.tids) if args.tids is not None else None
+    report = read_report(args.trace, tids, args)
+
+    if args.baseline is not None:
+        baseline_tids = (
+            read_tids(args.baseline_tids) if args.baseline_tids is not None else None
+        )
+        print_comparison(read_report(args.baseline, baseline_tids, args), report, sys.stdout)
+    else:
+        report.print(sys.stdout)
+    if args.folded is not None:
+        with open(args.folded, "w") as f:
+            report.write_folded(f)
+
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# latency percentiles of every stage of the deaddrop requests, by request type, from
+# the chrome traces written with `anonycast --trace`:
+#
+# anonycast --trace deaddrop.json deaddrop --mode open
+# scripts/trace-stages.py deaddrop.json
+#
+# benchmark.py --trace records the trace of the deaddrop of every run (of the
+# benchmark process for latency runs, where the deaddrops run in process) under
+# benchmark/<bench>/traces, every trace of a directory is reported as its own config:
+#
+# scripts/trace-stages.py benchmark/retreive/traces --csv stages.csv
+#
+# the stages of a request are read_frame and deserialize (body of the request),
+# handle_request (from then until the response is written), queued (waiting in the
+# worker channel, with the queue depth it found), work (on a worker),
+# acquire_state_lock, acquire_writer_lock and write_response
+
+import os
+import csv
+import sys
+import argparse
+
+from lib import trace
+
+
+def trace_paths(paths: list[str]) -> list[tuple[str, str]]:
+    """
+    (config, path) of the traces, the config is the file name without extensions
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames = sorted(f for f in os.listdir(path) if f.endswith(".json"))
+            found.extend((f.split(".")[0], os.path.join(path, f)) for f in filenames)
+        else:
+            found.append((os.path.basename(path).split(".")[0], path))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="latency percentiles per stage and request type of anonycast traces"
+    )
+    parser.add_argument("traces", nargs="+", help="trace files or directories of traces")
+    parser.add_argument("--csv", help="write the rows of every config to this file")
+    args = parser.parse_args()
+
+    rows = []
+    for config, path in trace_paths(args.traces):
+        report = trace.read(path)
+        print(config)
+        report.print(sys.stdout)
+        rows.extend({"config": config, **row} for row in report.rows())
+
+    if args.csv is not None and len(rows) > 0:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()